@@ -0,0 +1,84 @@
+# En BACKEND/benchmarks/bench_hot_sku.py
+#
+# Órdenes por segundo contra UNA sola variante (el caso de un lanzamiento), con el
+# descuento normal (un lock + UPDATE por orden) y con el modo flash de services/hot_sku
+# (un lock + UPDATE por ventana). Guarda las órdenes igual que el consumidor del webhook.
+# Correr desde BACKEND/:  python -m benchmarks.bench_hot_sku [órdenes] [concurrencia]
+# Por defecto usa un SQLite temporal; con BENCH_DB_URL se puede apuntar a una base
+# descartable de MySQL/Postgres (¡se borran y recrean las tablas!).
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, Categoria, Orden, Producto, VarianteProducto
+from services import hot_sku, order_service
+
+
+def payment(payment_id: int) -> dict:
+    return {
+        "id": payment_id, "status": "approved", "external_reference": f"bench-{payment_id}", "transaction_amount": 100,
+        "additional_info": {"items": [{"id": "1", "quantity": "1", "unit_price": "100"}]},
+    }
+
+
+async def seed(engine, factory, stock: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with factory() as db:
+        db.add(Categoria(id=1, nombre="Drop"))
+        db.add(Producto(id=1, nombre="Hot", precio=100, sku="HOT", stock=0, categoria_id=1))
+        db.add(VarianteProducto(id=1, producto_id=1, tamanio="M", color="Negro", cantidad_en_stock=stock))
+        await db.commit()
+
+
+async def run(url: str, orders: int, concurrency: int, flash: bool) -> float:
+    engine = create_async_engine(url, pool_size=concurrency, max_overflow=0, **({"connect_args": {"timeout": 60}} if url.startswith("sqlite") else {}))
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    await seed(engine, factory, stock=orders)
+    hot_sku.reset()
+    hot_sku.HOT_SKU_VARIANT_IDS = {1} if flash else set()
+    hot_sku.AsyncSessionLocal = factory
+    # El flusher también necesita conexión: que los pedidos no se queden con todas
+    limit = asyncio.Semaphore(max(1, concurrency - 1))
+
+    async def one(payment_id: int):
+        async with limit:
+            async with factory() as db:
+                await order_service.save_order_and_update_stock(payment(payment_id), db, str(payment_id))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(payment_id) for payment_id in range(1, orders + 1)))
+    elapsed = time.perf_counter() - start
+
+    async with factory() as db:
+        saved = (await db.execute(select(func.count()).select_from(Orden))).scalar_one()
+        left = (await db.get(VarianteProducto, 1)).cantidad_en_stock
+    await engine.dispose()
+    assert (saved, left) == (orders, 0), "Tienen que entrar todas las órdenes y quedar el stock en cero"
+
+    label = f"modo flash ({hot_sku.stats()['promedio_por_ventana']} por ventana)" if flash else "descuento por orden"
+    print(f"{label:<40} {orders / elapsed:8.1f} órdenes/s")
+    return orders / elapsed
+
+
+async def main():
+    orders = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    url = os.getenv("BENCH_DB_URL") or f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+
+    print(f"{orders} órdenes sobre una variante, {concurrency} a la vez, ventana de {hot_sku.HOT_SKU_WINDOW_MS:g} ms")
+    normal = await run(url, orders, concurrency, flash=False)
+    flash = await run(url, orders, concurrency, flash=True)
+    print(f"{'Mejora':<40} {flash / normal:8.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
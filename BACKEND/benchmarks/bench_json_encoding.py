@@ -0,0 +1,117 @@
+# En BACKEND/benchmarks/bench_json_encoding.py
+#
+# Compara el camino estándar (response_model -> validación Pydantic -> json) contra
+# el camino rápido (dicts armados por el router -> orjson) para los tres endpoints
+# que lo usan: listado de productos, ventas y usuarios del admin. Los dicts salen de
+# las mismas funciones que corren en los routers, no de una copia.
+# Correr desde BACKEND/:  python -m benchmarks.bench_json_encoding [cantidad]
+
+import json
+import sys
+import time
+from datetime import datetime
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import List
+
+from bson import ObjectId
+from pydantic import TypeAdapter
+
+from routers.admin_router import _sale_dicts, _user_dict
+from routers.products_router import _product_dict
+from schemas.admin_schemas import Orden
+from schemas.product_schemas import Product
+from schemas.user_schemas import UserOut
+from utils import fast_json
+
+
+def fake_products(count: int) -> list:
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    products = []
+    for i in range(count):
+        variantes = [
+            SimpleNamespace(id=i * 3 + j, producto_id=i, tamanio=talle, color="Negro", cantidad_en_stock=10)
+            for j, talle in enumerate(("S", "M", "L"))
+        ]
+        products.append(SimpleNamespace(
+            id=i, nombre=f"Remera oversize {i}", descripcion="Algodón peinado 24/1, corte recto.",
+            precio=Decimal("15999.90"), sku=f"SKU-{i:06d}", stock=30, categoria_id=1 + i % 8,
+            urls_imagenes=[f"https://res.cloudinary.com/demo/image/upload/p{i}.jpg"],
+            material="Algodón", talle="M", color="Negro", creado_en=now, actualizado_en=now,
+            variantes=variantes,
+        ))
+    return products
+
+
+def fake_sale_rows(count: int) -> list:
+    """Filas como las de _sales_rows_query (una por detalle) y las órdenes equivalentes."""
+    now = datetime(2025, 1, 1, 12, 0, 0)
+    rows, orders = [], []
+    for i in range(count):
+        order = SimpleNamespace(
+            id=i, usuario_id=f"user-{i % 50}", monto_total=Decimal("31999.80"),
+            estado="Enviado", estado_pago="pagado", creado_en=now, detalles=[],
+        )
+        for j in range(2):
+            detalle = SimpleNamespace(variante_producto_id=i * 2 + j, cantidad=1, precio_en_momento_compra=Decimal("15999.90"))
+            order.detalles.append(detalle)
+            rows.append({**{k: v for k, v in vars(order).items() if k != "detalles"}, **vars(detalle)})
+        orders.append(order)
+    return rows, orders
+
+
+def fake_users(count: int) -> list:
+    return [
+        {
+            "_id": ObjectId(), "email": f"cliente{i}@example.com", "name": "Cliente", "last_name": str(i),
+            "phone": {"prefix": "+54", "number": f"11{i:08d}"}, "role": "user",
+        }
+        for i in range(count)
+    ]
+
+
+def timeit(label: str, fn, rounds: int) -> float:
+    fn()  # calentamiento
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    elapsed = (time.perf_counter() - start) / rounds * 1000
+    print(f"{label:<40} {elapsed:8.2f} ms")
+    return elapsed
+
+
+def compare(title: str, model, data, fast_payload, rounds: int):
+    adapter = TypeAdapter(List[model])
+
+    def standard():
+        validated = adapter.validate_python(data, from_attributes=True)
+        return json.dumps(adapter.dump_python(validated, mode="json", by_alias=True)).encode()
+
+    def fast():
+        return fast_json.dumps(fast_payload())
+
+    assert json.loads(standard()) == json.loads(fast()), f"{title}: los dos caminos tienen que dar el mismo JSON"
+
+    print(title)
+    slow_ms = timeit("  Pydantic + json.dumps", standard, rounds)
+    fast_ms = timeit("  dicts + orjson", fast, rounds)
+    print(f"{'  Mejora':<40} {slow_ms / fast_ms:8.1f}x")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rounds = 20
+    print(f"{count} filas por endpoint, promedio de {rounds} corridas")
+
+    products = fake_products(count)
+    compare("Productos", Product, products, lambda: [_product_dict(p) for p in products], rounds)
+
+    rows, orders = fake_sale_rows(count)
+    compare("Ventas (admin)", Orden, orders, lambda: _sale_dicts(rows), rounds)
+
+    users = fake_users(count)
+    compare("Usuarios (admin)", UserOut, users, lambda: [_user_dict(u) for u in users], rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # En BACKEND/database/models.py
 
 from sqlalchemy import (
-    Column, Integer, String, Text, DECIMAL, TIMESTAMP, ForeignKey, Date, JSON
+    Column, Integer, String, Text, DECIMAL, TIMESTAMP, ForeignKey, Date, JSON, Index, literal_column
 )
 from sqlalchemy.orm import relationship, declarative_base
 from sqlalchemy.sql import func
@@ -41,6 +41,15 @@ class Producto(Base):
     categoria = relationship("Categoria", back_populates="productos")
     variantes = relationship("VarianteProducto", back_populates="producto")
 
+    # Índices pensados para el listado: filtro por categoría + orden por precio/nombre,
+    # siempre con el id al final porque es el desempate del cursor (keyset).
+    __table_args__ = (
+        Index("ix_productos_categoria_precio", "categoria_id", "precio", "id"),
+        Index("ix_productos_precio", "precio", "id"),
+        Index("ix_productos_nombre", "nombre", "id"),
+        Index("ix_productos_actualizado_en", "actualizado_en"),  # max() del ETag del listado
+    )
+
 
 class VarianteProducto(Base):
     __tablename__ = "variantes_productos"
@@ -49,9 +58,20 @@ class VarianteProducto(Base):
     tamanio = Column(String(10), nullable=False)
     color = Column(String(50), nullable=False)
     cantidad_en_stock = Column(Integer, nullable=False)
+    # Los descuentos de stock son UPDATE sueltos que no tocan el producto: cada uno
+    # mueve estas dos columnas (onupdate vale también para update() de Core). El
+    # Last-Modified de producto y listado sale de acá y el ETag suma las versiones.
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    version = Column(Integer, nullable=False, default=1, server_default="1", onupdate=literal_column("version") + 1)
     producto = relationship("Producto", back_populates="variantes")
     detalles_orden = relationship("DetalleOrden", back_populates="variante_producto")
 
+    # Cubre el selectinload de variantes, la suma de stock por producto (vista "card")
+    # y los validadores del listado
+    __table_args__ = (
+        Index("ix_variantes_producto_stock", "producto_id", "cantidad_en_stock", "version", "actualizado_en"),
+    )
+
 
 class Orden(Base):
     __tablename__ = "ordenes"
@@ -66,6 +86,10 @@ class Orden(Base):
     detalles = relationship("DetalleOrden", back_populates="orden")
     payment_id_mercadopago = Column(String(255), unique=True, nullable=True, index=True)
 
+    __table_args__ = (
+        Index("ix_ordenes_creado_en", "creado_en", "monto_total"),  # Gráfico de ventas por día
+    )
+
 
 class DetalleOrden(Base):
     __tablename__ = "detalles_orden"
@@ -77,6 +101,11 @@ class DetalleOrden(Base):
     orden = relationship("Orden", back_populates="detalles")
     variante_producto = relationship("VarianteProducto", back_populates="detalles_orden")
 
+    __table_args__ = (
+        Index("ix_detalles_orden_orden", "orden_id"),
+        Index("ix_detalles_orden_variante", "variante_producto_id", "cantidad"),  # Métrica de más vendidos
+    )
+
 
 class Gasto(Base):
     __tablename__ = "gastos"
@@ -91,7 +120,110 @@ class Gasto(Base):
 class ConversacionIA(Base):
     __tablename__ = "conversaciones_ia"
     id = Column(Integer, primary_key=True, index=True)
-    sesion_id = Column(String(255), nullable=False, index=True)
+    sesion_id = Column(String(255), nullable=False)
     prompt = Column(Text, nullable=False)
     respuesta = Column(Text, nullable=False)
-    creado_en = Column(TIMESTAMP, server_default=func.now())
\ No newline at end of file
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+
+    # Historial de una sesión ya ordenado; reemplaza al índice suelto de sesion_id
+    __table_args__ = (
+        Index("ix_conversaciones_sesion_creado", "sesion_id", "creado_en"),
+    )
+
+
+
+class ImagenSubida(Base):
+    """Índice hash del contenido -> imagen ya subida a Cloudinary, para no subir dos veces la misma foto."""
+    __tablename__ = "imagenes_subidas"
+    id = Column(Integer, primary_key=True, index=True)
+    sha256 = Column(String(64), unique=True, nullable=False)
+    public_id = Column(String(255), nullable=False)
+    url = Column(String(500), nullable=False)
+    bytes = Column(Integer, nullable=False)
+    usos = Column(Integer, nullable=False, default=1) # Cuántas veces se pidió subir este contenido
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+    ultimo_uso_en = Column(TIMESTAMP, server_default=func.now())
+
+class WebhookEvento(Base):
+    """
+    Inbox de notificaciones de Mercado Pago. El webhook solo guarda el evento y
+    responde; el consumidor en segundo plano (services/webhook_inbox) lo procesa.
+    Estados: pendiente -> procesando -> procesado | ignorado | fallido (dead letter).
+    """
+    __tablename__ = "webhook_inbox"
+    id = Column(Integer, primary_key=True, index=True)
+    payment_id = Column(String(64), unique=True, nullable=False) # Deduplica los reenvíos de MP
+    tipo = Column(String(50), nullable=True)
+    payload = Column(JSON, nullable=True)
+    estado = Column(String(20), nullable=False, default="pendiente")
+    intentos = Column(Integer, nullable=False, default=0)
+    # Cuándo se puede volver a tomar: backoff entre reintentos, o fin del lease si está "procesando".
+    # Siempre con el reloj de la base (NOW()), nunca con el de la app
+    proximo_intento_en = Column(TIMESTAMP, nullable=False, server_default=func.now())
+    lease = Column(String(36), nullable=True)  # Qué worker lo tomó la última vez
+    ultimo_error = Column(Text, nullable=True)
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+    actualizado_en = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+
+    # El consumidor busca por estado + vencimiento; las métricas cuentan por estado
+    __table_args__ = (
+        Index("ix_webhook_inbox_estado_proximo", "estado", "proximo_intento_en"),
+    )
+
+
+class ReservaStock(Base):
+    """
+    Unidades apartadas entre que se crea la preferencia de MP y que llega el pago.
+    Una fila por variante; todas las de un mismo checkout comparten reserva_id.
+    `clave` es el external_reference del checkout (usuario o sesión de invitado):
+    cada clave tiene como mucho RESERVA_MAX_POR_CLAVE reservas activas.
+    Vencida (expira_en pasado) ya no cuenta, aunque el barrendero todavía no la haya borrado.
+    """
+    __tablename__ = "reservas_stock"
+    id = Column(Integer, primary_key=True, index=True)
+    reserva_id = Column(String(36), nullable=False)
+    clave = Column(String(255), nullable=False)
+    variante_id = Column(Integer, ForeignKey("variantes_productos.id"), nullable=False)
+    cantidad = Column(Integer, nullable=False)
+    expira_en = Column(TIMESTAMP, nullable=False)
+    creado_en = Column(TIMESTAMP, server_default=func.now())
+
+    __table_args__ = (
+        # Cubre "cuánto hay reservado de estas variantes ahora" (también sin las del
+        # propio comprador): se resuelve sin tocar la tabla
+        Index("ix_reservas_variante_expira", "variante_id", "expira_en", "cantidad", "clave"),
+        Index("ix_reservas_reserva_id", "reserva_id"),  # Convertir / liberar un checkout
+        Index("ix_reservas_clave", "clave", "expira_en"),  # Reservas activas de un comprador
+        Index("ix_reservas_expira", "expira_en"),  # Barrido de vencidas
+    )
+
+
+class DescuentoFlash(Base):
+    """
+    Unidades que el modo flash (services/hot_sku) ya descontó y cuya orden todavía
+    no se guardó. Se escriben en la misma transacción que el descuento y la orden las
+    borra en la suya: si queda alguna vieja, el proceso se cayó en el medio y
+    hot_sku.reconcile devuelve esas unidades al stock.
+    """
+    __tablename__ = "descuentos_flash"
+    id = Column(Integer, primary_key=True, index=True)
+    lote = Column(String(36), nullable=False)  # Un intento de guardar la orden
+    payment_id = Column(String(64), nullable=True)
+    variante_id = Column(Integer, ForeignKey("variantes_productos.id"), nullable=False)
+    cantidad = Column(Integer, nullable=False)
+    creado_en = Column(TIMESTAMP, nullable=False)
+
+    __table_args__ = (
+        Index("ix_descuentos_flash_lote", "lote"),
+        Index("ix_descuentos_flash_creado", "creado_en"),  # Reconciliación de huérfanos
+    )
+
+
+def create_missing_indexes(connection):
+    """
+    create_all no agrega índices a tablas que ya existen, así que en una base
+    creada antes de declararlos no aparecerían nunca. Esto crea los que falten.
+    """
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
\ No newline at end of file
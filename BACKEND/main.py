@@ -3,15 +3,29 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
-from database.database import engine
-from database.models import Base
+from database.database import engine, db_nosql
+from database.models import Base, create_missing_indexes
+from services import cart_service, cloudinary_service, hot_sku, mercadopago_client, stock_reservations, webhook_inbox
+from utils import security
 from routers import health_router, auth_router, products_router, cart_router, admin_router, chatbot_router, checkout_router, payment_router
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_missing_indexes)
+    await cart_service.ensure_indexes(db_nosql)
+    mercadopago_client.get_client()  # Abre el pool de conexiones a MP una sola vez
+    webhook_inbox.start()
+    stock_reservations.start()
+    hot_sku.start()  # Devuelve descuentos flash que quedaron sin orden (también los del proceso anterior)
     yield
+    await hot_sku.stop()
+    await stock_reservations.stop()
+    await webhook_inbox.stop()
+    await mercadopago_client.shutdown()
+    cloudinary_service.shutdown()
+    security.shutdown_hashing()
     # Clean up the engine connection
     await engine.dispose()
 
@@ -37,6 +51,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],  # Para que el front pueda leer la paginación
 )
 
 # --- FIN DEL CAMBIO ---
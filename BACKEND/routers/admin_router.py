@@ -1,13 +1,15 @@
 # En BACKEND/routers/admin_router.py
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func
-from typing import List
+from sqlalchemy import select, func, update
+from typing import List, Optional
 from schemas import admin_schemas, metrics_schemas, user_schemas
 from database.database import get_db, get_db_nosql
-from database.models import Gasto, Orden, DetalleOrden, VarianteProducto, Producto, Categoria
+from database.models import Gasto, Orden, DetalleOrden, VarianteProducto, Producto, Categoria, ImagenSubida, WebhookEvento
 from services.auth_services import get_current_admin_user
+from services import cloudinary_service, principal_cache, webhook_inbox
+from utils import fast_json
 from pymongo.database import Database
 from bson import ObjectId
 from sqlalchemy.orm import joinedload
@@ -34,23 +36,25 @@ async def create_expense(gasto: admin_schemas.GastoCreate, db: AsyncSession = De
     return new_expense
 
 # --- Endpoints de Ventas ---
+# Las queries se arman en funciones aparte para que tests/test_query_plans mire
+# el plan de exactamente lo que corre acá.
 
-@router.get("/sales", response_model=List[admin_schemas.Orden])
-async def get_sales(db: AsyncSession = Depends(get_db)):
+def _sales_query():
     # Para que la respuesta sea completa, cargamos los detalles de cada orden
-    result = await db.execute(
-        select(Orden).options(joinedload(Orden.detalles))
+    return select(Orden).options(joinedload(Orden.detalles))
+
+def _sales_rows_query():
+    return (
+        select(
+            Orden.id, Orden.usuario_id, Orden.monto_total, Orden.estado, Orden.estado_pago, Orden.creado_en,
+            DetalleOrden.variante_producto_id, DetalleOrden.cantidad, DetalleOrden.precio_en_momento_compra,
+        )
+        .outerjoin(DetalleOrden, DetalleOrden.orden_id == Orden.id)
+        .order_by(Orden.id, DetalleOrden.id)
     )
-    sales = result.scalars().unique().all()
-    return sales
 
-@router.get("/sales/{order_id}", response_model=admin_schemas.Orden, summary="Obtener detalles de una orden específica")
-async def get_sale_details(order_id: int, db: AsyncSession = Depends(get_db)):
-    """
-    Obtiene todos los detalles de una única orden, incluyendo los productos
-    comprados en ella.
-    """
-    result = await db.execute(
+def _sale_detail_query(order_id: int):
+    return (
         select(Orden)
         .where(Orden.id == order_id)
         .options(
@@ -59,6 +63,44 @@ async def get_sale_details(order_id: int, db: AsyncSession = Depends(get_db)):
             .joinedload(VarianteProducto.producto) # De cada variante, cargamos el producto padre
         )
     )
+
+# Las columnas de _sales_rows_query se llaman igual que los campos del schema
+_ORDER_FIELDS = [name for name in admin_schemas.Orden.model_fields if name != "detalles"]
+_DETAIL_FIELDS = list(admin_schemas.DetalleOrdenOut.model_fields)
+
+def _sale_dicts(rows) -> list:
+    """
+    Lo mismo que List[Orden] por response_model, armado desde las filas de
+    _sales_rows_query (una por detalle). Los montos Decimal los pasa a float fast_json.
+    """
+    sales = {}
+    for row in rows:
+        order = sales.get(row["id"])
+        if order is None:
+            order = sales[row["id"]] = {name: row[name] for name in _ORDER_FIELDS}
+            order["detalles"] = []
+        if row["variante_producto_id"] is not None:  # Orden sin detalles (outer join)
+            order["detalles"].append({name: row[name] for name in _DETAIL_FIELDS})
+    return list(sales.values())
+
+@router.get("/sales", response_model=List[admin_schemas.Orden])
+async def get_sales(request: Request, db: AsyncSession = Depends(get_db)):
+    if not fast_json.FAST_JSON_ENABLED:
+        result = await db.execute(_sales_query())
+        sales = result.scalars().unique().all()
+        return sales
+
+    # Camino rápido: tuplas planas (orden + detalle), sin instanciar ORM ni modelos de Pydantic
+    result = await db.execute(_sales_rows_query())
+    return fast_json.fast_json_response(request, _sale_dicts(result.mappings()))
+
+@router.get("/sales/{order_id}", response_model=admin_schemas.Orden, summary="Obtener detalles de una orden específica")
+async def get_sale_details(order_id: int, db: AsyncSession = Depends(get_db)):
+    """
+    Obtiene todos los detalles de una única orden, incluyendo los productos
+    comprados en ella.
+    """
+    result = await db.execute(_sale_detail_query(order_id))
     order = result.scalars().unique().first()
 
     if not order:
@@ -115,11 +157,45 @@ async def create_manual_sale(sale_data: admin_schemas.ManualSaleCreate, db: Asyn
 
 # --- Endpoints de Usuarios ---
 
+# Clave en Mongo (alias) -> (obligatorio, default) de cada campo de UserOut
+_USER_FIELDS = {
+    field.alias or name: (field.is_required(), None if field.is_required() else field.get_default())
+    for name, field in user_schemas.UserOut.model_fields.items()
+}
+_PHONE_FIELDS = list(user_schemas.Phone.model_fields)
+# Solo los campos de UserOut: así el hash de la contraseña ni siquiera sale de Mongo
+USER_OUT_PROJECTION = {key: 1 for key in _USER_FIELDS}
+
+def _user_dict(user: dict) -> dict:
+    """
+    Lo mismo que UserOut.model_validate(u).model_dump(by_alias=True), sin validar
+    cada valor. Si falta un campo que no puede ser None (o el teléfono viene
+    incompleto) validamos con el schema, así falla igual que por response_model.
+    """
+    data = {}
+    for key, (required, default) in _USER_FIELDS.items():
+        value = user.get(key, default)
+        if value is None and (required or default is not None):
+            return user_schemas.UserOut.model_validate(user).model_dump(by_alias=True)
+        data[key] = value
+    data["_id"] = str(data["_id"])
+    phone = data["phone"]
+    if phone is not None:
+        data["phone"] = {name: phone.get(name) for name in _PHONE_FIELDS}
+        if None in data["phone"].values():
+            return user_schemas.UserOut.model_validate(user).model_dump(by_alias=True)
+    return data
+
 @router.get("/users", response_model=List[user_schemas.UserOut])
-async def get_users(db: Database = Depends(get_db_nosql)):
-    users_cursor = db.users.find({})
+async def get_users(request: Request, db: Database = Depends(get_db_nosql)):
+    if not fast_json.FAST_JSON_ENABLED:
+        users_cursor = db.users.find({})
+        users_list = await users_cursor.to_list(length=None)
+        return users_list
+
+    users_cursor = db.users.find({}, USER_OUT_PROJECTION)
     users_list = await users_cursor.to_list(length=None)
-    return users_list
+    return fast_json.fast_json_response(request, [_user_dict(user) for user in users_list])
 
 @router.put("/users/{user_id}/role", response_model=user_schemas.UserOut, summary="Actualizar rol de un usuario")
 async def update_user_role(user_id: str, user_update: user_schemas.UserUpdateRole, db: Database = Depends(get_db_nosql)):
@@ -142,11 +218,57 @@ async def update_user_role(user_id: str, user_update: user_schemas.UserUpdateRol
         {"_id": object_id},
         {"$set": {"role": user_update.role}}
     )
+    # El rol viaja en el usuario cacheado: sin esto seguiría valiendo el anterior
+    principal_cache.invalidate(user["email"])
 
     # Devolvemos el usuario actualizado para confirmar el cambio
     updated_user = await db.users.find_one({"_id": object_id})
     return user_schemas.UserOut(**updated_user)
 
+# --- Índice de imágenes subidas ---
+
+@router.get("/images", response_model=List[admin_schemas.ImagenSubida])
+async def get_uploaded_images(db: AsyncSession = Depends(get_db), sha256: Optional[str] = Query(None), skip: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500)):
+    query = select(ImagenSubida).order_by(ImagenSubida.ultimo_uso_en.desc(), ImagenSubida.id.desc())
+    if sha256:
+        query = query.where(ImagenSubida.sha256 == sha256.lower())
+    result = await db.execute(query.offset(skip).limit(limit))
+    return result.scalars().all()
+
+@router.delete("/images/prune", response_model=admin_schemas.ImagePruneResult)
+async def prune_uploaded_images(db: AsyncSession = Depends(get_db), unused_days: int = Query(30, ge=0), destroy: bool = Query(False, description="Además de sacarlas del índice, borrarlas de Cloudinary")):
+    """Saca del índice las imágenes que ningún producto usa y que nadie volvió a subir en `unused_days` días."""
+    result = await db.execute(select(Producto.urls_imagenes).where(Producto.urls_imagenes.is_not(None)))
+    referenced = {url for urls in result.scalars().all() for url in (urls or [])}
+    pruned = await cloudinary_service.prune_image_index(db, referenced, unused_days, destroy=destroy)
+    return {"eliminadas": len(pruned), "imagenes": pruned}
+
+# --- Inbox de webhooks (dead letters) ---
+
+@router.get("/webhooks", response_model=List[admin_schemas.WebhookEvento])
+async def get_webhook_events(db: AsyncSession = Depends(get_db), estado: str = Query("fallido"), limit: int = Query(50, ge=1, le=500)):
+    """Eventos del inbox por estado; por defecto los que agotaron los reintentos."""
+    result = await db.execute(
+        select(WebhookEvento).where(WebhookEvento.estado == estado)
+        .order_by(WebhookEvento.proximo_intento_en, WebhookEvento.id).limit(limit)
+    )
+    return result.scalars().all()
+
+@router.post("/webhooks/{event_id}/retry", response_model=admin_schemas.WebhookEvento)
+async def retry_webhook_event(event_id: int, db: AsyncSession = Depends(get_db)):
+    """Vuelve a poner en cola un evento fallido, con los intentos en cero."""
+    result = await db.execute(
+        update(WebhookEvento)
+        .where(WebhookEvento.id == event_id, WebhookEvento.estado == "fallido")
+        .values(estado="pendiente", intentos=0, proximo_intento_en=func.now())
+    )
+    if not result.rowcount:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No hay un evento fallido con ese id.")
+    await db.commit()
+    webhook_inbox.wake()
+    event = await db.get(WebhookEvento, event_id, populate_existing=True)
+    return event
+
 # --- Endpoints de Métricas y Gráficos ---
 
 @router.get("/metrics/kpis", response_model=metrics_schemas.KPIMetrics)
@@ -172,16 +294,27 @@ async def get_kpis(db: AsyncSession = Depends(get_db), db_nosql: Database = Depe
         total_expenses=float(total_expenses)
     )
 
-@router.get("/metrics/products", response_model=metrics_schemas.ProductMetrics)
-async def get_product_metrics(db: AsyncSession = Depends(get_db)):
-    most_sold_product_result = await db.execute(
-        select(Producto.nombre, func.sum(DetalleOrden.cantidad).label("total_sold"))
-        .join(VarianteProducto, Producto.variantes)
-        .join(DetalleOrden, VarianteProducto.detalles_orden)
+def _most_sold_product_query():
+    # Se suma por variante leyendo solo ix_detalles_orden_variante y después se sube a
+    # producto por PK; arrancar desde productos recorría el catálogo entero.
+    vendidos = (
+        select(DetalleOrden.variante_producto_id, func.sum(DetalleOrden.cantidad).label("cantidad"))
+        .group_by(DetalleOrden.variante_producto_id)
+        .subquery("vendidos")
+    )
+    return (
+        select(Producto.nombre, func.sum(vendidos.c.cantidad).label("total_sold"))
+        .select_from(vendidos)
+        .join(VarianteProducto, VarianteProducto.id == vendidos.c.variante_producto_id)
+        .join(Producto, Producto.id == VarianteProducto.producto_id)
         .group_by(Producto.nombre)
-        .order_by(func.sum(DetalleOrden.cantidad).desc())
+        .order_by(func.sum(vendidos.c.cantidad).desc())
         .limit(1)
     )
+
+@router.get("/metrics/products", response_model=metrics_schemas.ProductMetrics)
+async def get_product_metrics(db: AsyncSession = Depends(get_db)):
+    most_sold_product_result = await db.execute(_most_sold_product_query())
     most_sold_product_data = most_sold_product_result.first()
     most_sold_product_name = most_sold_product_data.nombre if most_sold_product_data else "N/A"
 
@@ -208,9 +341,8 @@ async def get_product_metrics(db: AsyncSession = Depends(get_db)):
         category_with_most_products=category_with_most_products_name
     )
 
-@router.get("/charts/sales-over-time", response_model=metrics_schemas.SalesOverTimeChart)
-async def get_sales_over_time(db: AsyncSession = Depends(get_db)):
-    sales_data = await db.execute(
+def _sales_over_time_query():
+    return (
         select(
             func.date(Orden.creado_en).label("fecha"),
             func.sum(Orden.monto_total).label("total")
@@ -218,6 +350,10 @@ async def get_sales_over_time(db: AsyncSession = Depends(get_db)):
         .group_by(func.date(Orden.creado_en))
         .order_by(func.date(Orden.creado_en))
     )
+
+@router.get("/charts/sales-over-time", response_model=metrics_schemas.SalesOverTimeChart)
+async def get_sales_over_time(db: AsyncSession = Depends(get_db)):
+    sales_data = await db.execute(_sales_over_time_query())
     result = [metrics_schemas.SalesDataPoint(fecha=row.fecha, total=float(row.total)) for row in sales_data.all()]
     return metrics_schemas.SalesOverTimeChart(data=result)
 
@@ -8,7 +8,7 @@ from datetime import datetime
 from schemas import user_schemas
 from utils import security
 from database.database import get_db_nosql
-from services import auth_services as auth_service
+from services import auth_services as auth_service, principal_cache
 
 router = APIRouter(
     prefix="/api/auth",
@@ -24,7 +24,7 @@ async def register_user(user: user_schemas.UserCreate, db: Database = Depends(ge
             detail="El email ya está registrado."
         )
 
-    hashed_password = security.get_password_hash(user.password)
+    hashed_password = await security.get_password_hash_async(user.password)
     
     user_document = user.model_dump()
     user_document["hashed_password"] = hashed_password
@@ -41,13 +41,21 @@ async def register_user(user: user_schemas.UserCreate, db: Database = Depends(ge
 @router.post("/login", response_model=user_schemas.Token)
 async def login_for_access_token(db: Database = Depends(get_db_nosql), form_data: OAuth2PasswordRequestForm = Depends()):
     user = await db.users.find_one({"email": form_data.username})
-    
-    if not user or not security.verify_password(form_data.password, user["hashed_password"]):
+
+    valid, new_hash = (False, None)
+    if user:
+        valid, new_hash = await security.verify_password_async(form_data.password, user["hashed_password"])
+    if not valid:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email o contraseña incorrectos",
             headers={"WWW-Authenticate": "Bearer"},
         )
+
+    if new_hash:
+        # Cambió el costo de bcrypt: aprovechamos que tenemos la contraseña en claro
+        await db.users.update_one({"_id": user["_id"]}, {"$set": {"hashed_password": new_hash}})
+        principal_cache.invalidate(user["email"])
     
     token_data = {
         "sub": user["email"], 
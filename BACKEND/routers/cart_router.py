@@ -1,12 +1,15 @@
 # En backend/routers/cart_router.py
 from fastapi import APIRouter, Depends, HTTPException, Header
+from pymongo import ReturnDocument
 from pymongo.database import Database
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional
 from datetime import datetime
 import uuid
 
-from schemas import cart_schemas
-from database.database import get_db_nosql
+from schemas import cart_schemas, user_schemas
+from services import auth_services, cart_service
+from database.database import get_db, get_db_nosql
 from utils.security import get_current_user_optional
 
 router = APIRouter(
@@ -39,18 +42,23 @@ async def get_cart(
 ):
     identifier = get_session_identifier(current_user, guest_session_id)
     cart_doc = await db.carts.find_one(identifier)
-    
-    if not cart_doc:
-        new_cart_data = identifier.copy()
-        new_cart_data.update({"items": [], "last_updated": datetime.now()})
-        return cart_schemas.Cart(**new_cart_data)
-        
-    # --- ¡ARREGLO A LO BRUTO! ---
-    # Convertimos el ObjectId a string a mano, sin pedirle permiso a nadie.
-    if "_id" in cart_doc:
-        cart_doc["_id"] = str(cart_doc["_id"])
-    
-    return cart_schemas.Cart(**cart_doc)
+    return cart_service.to_cart(cart_doc, identifier)
+
+@router.post("/validate", response_model=cart_schemas.CartValidation, summary="Validar precios y stock del carrito")
+async def validate_cart(
+    guest_session_id: Optional[str] = Header(None, alias="X-Guest-Session-ID"),
+    db: Database = Depends(get_db_nosql),
+    db_sql: AsyncSession = Depends(get_db),
+    current_user: Optional[dict] = Depends(get_current_user_optional)
+):
+    """
+    Chequea el carrito guardado contra la base con el mismo camino que usa el
+    checkout: precios actuales y todos los faltantes de stock juntos. Siempre
+    responde 200; que se pueda comprar lo dice `valido`.
+    """
+    identifier = get_session_identifier(current_user, guest_session_id)
+    cart = cart_service.to_cart(await db.carts.find_one(identifier), identifier)
+    return await cart_service.validate_items(db_sql, cart.items, clave=str(cart.user_id or cart.guest_session_id))
 
 @router.post("/items", response_model=cart_schemas.Cart, summary="Añadir un item al carrito")
 async def add_item_to_cart(
@@ -60,31 +68,36 @@ async def add_item_to_cart(
     current_user: Optional[dict] = Depends(get_current_user_optional)
 ):
     identifier = get_session_identifier(current_user, guest_session_id)
-    
-    result = await db.carts.update_one(
-        {**identifier, "items.variante_id": item.variante_id},
-        {"$inc": {"items.$.quantity": item.quantity}}
-    )
-
-    if result.modified_count == 0:
-        await db.carts.update_one(
-            identifier,
-            {
-                "$push": {"items": item.model_dump()},
-                "$set": {"last_updated": datetime.now()}
-            },
-            upsert=True
-        )
-        
-    updated_cart_doc = await db.carts.find_one(identifier)
-    if not updated_cart_doc:
-         raise HTTPException(status_code=404, detail="No se pudo encontrar o crear el carrito.")
 
-    # --- ¡ARREGLO A LO BRUTO TAMBIÉN ACÁ! ---
-    if "_id" in updated_cart_doc:
-        updated_cart_doc["_id"] = str(updated_cart_doc["_id"])
+    # Un solo viaje: suma o agrega (según corresponda) y devuelve el carrito ya actualizado
+    updated_cart_doc = await db.carts.find_one_and_update(
+        identifier,
+        [cart_service.add_item_stage(item), cart_service.touch_stage()],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return cart_service.to_cart(updated_cart_doc, identifier)
 
-    return cart_schemas.Cart(**updated_cart_doc)
+@router.patch("/", response_model=cart_schemas.Cart, summary="Aplicar varias operaciones al carrito de una vez")
+async def update_cart(
+    batch: cart_schemas.CartBatch,
+    guest_session_id: Optional[str] = Header(None, alias="X-Guest-Session-ID"),
+    db: Database = Depends(get_db_nosql),
+    current_user: Optional[dict] = Depends(get_current_user_optional)
+):
+    """
+    Recibe una lista de operaciones (add, set_quantity, increment, remove, clear) y
+    las aplica en orden en un único update atómico: o entran todas o ninguna.
+    Devuelve el carrito final una sola vez.
+    """
+    identifier = get_session_identifier(current_user, guest_session_id)
+    updated_cart_doc = await db.carts.find_one_and_update(
+        identifier,
+        cart_service.batch_pipeline(batch.operations),
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    return cart_service.to_cart(updated_cart_doc, identifier)
 
 @router.delete("/items/{variante_id}", response_model=cart_schemas.Cart, summary="Eliminar un item del carrito")
 async def remove_item_from_cart(
@@ -94,25 +107,43 @@ async def remove_item_from_cart(
     current_user: Optional[dict] = Depends(get_current_user_optional)
 ):
     identifier = get_session_identifier(current_user, guest_session_id)
-    
-    result = await db.carts.update_one(
+
+    updated_cart_doc = await db.carts.find_one_and_update(
         identifier,
-        {"$pull": {"items": {"variante_id": variante_id}}}
+        {"$pull": {"items": {"variante_id": variante_id}}, "$set": {"last_updated": datetime.now()}},
+        return_document=ReturnDocument.AFTER,
     )
-    
-    if result.matched_count == 0:
-        cart = await db.carts.find_one(identifier)
-        if not cart:
-            raise HTTPException(status_code=404, detail="Carrito no encontrado.")
-    
-    updated_cart_doc = await db.carts.find_one(identifier)
     if not updated_cart_doc:
-        new_cart_data = identifier.copy()
-        new_cart_data.update({"items": [], "last_updated": datetime.now()})
-        return cart_schemas.Cart(**new_cart_data)
+        raise HTTPException(status_code=404, detail="Carrito no encontrado.")
+    return cart_service.to_cart(updated_cart_doc, identifier)
 
-    # --- ¡Y ARREGLO A LO BRUTO POR TERCERA VEZ PARA QUE APRENDA! ---
-    if "_id" in updated_cart_doc:
-        updated_cart_doc["_id"] = str(updated_cart_doc["_id"])
+@router.post("/merge", response_model=cart_schemas.Cart, summary="Pasar el carrito de invitado al del usuario")
+async def merge_guest_cart(
+    guest_session_id: str = Header(..., alias="X-Guest-Session-ID"),
+    db: Database = Depends(get_db_nosql),
+    current_user: user_schemas.UserOut = Depends(auth_services.get_current_user)
+):
+    """
+    El front lo llama justo después del login con el ID de invitado que venía usando.
+    El carrito de invitado se "reclama" con find_one_and_delete (si llegan dos merges
+    a la vez, solo uno lo obtiene) y sus items se suman al del usuario en un solo update.
+    Llamarlo de nuevo no duplica nada: ya no hay carrito de invitado que sumar.
+    """
+    identifier = {"user_id": current_user.id}
+    guest_doc = await db.carts.find_one_and_delete({"guest_session_id": guest_session_id})
+    items = cart_service.guest_items(guest_doc)
+    if not items:
+        return cart_service.to_cart(await db.carts.find_one(identifier), identifier)
 
-    return cart_schemas.Cart(**updated_cart_doc)
\ No newline at end of file
+    try:
+        updated_cart_doc = await db.carts.find_one_and_update(
+            identifier,
+            cart_service.merge_pipeline(items),
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except Exception:
+        # No perdemos el carrito del invitado: lo devolvemos a su lugar
+        await db.carts.insert_one(guest_doc)
+        raise
+    return cart_service.to_cart(updated_cart_doc, identifier)
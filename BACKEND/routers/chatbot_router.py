@@ -18,6 +18,14 @@ logger = logging.getLogger(__name__)
 CONTEXT_TURNS_LIMIT = 5
 
 
+def _history_query(sesion_id: str):
+    return (
+        select(ConversacionIA)
+        .filter(ConversacionIA.sesion_id == sesion_id)
+        .order_by(ConversacionIA.creado_en)
+    )
+
+
 async def _handle_chat_exception(
     e: Exception,
     conversacion: ConversacionIA,
@@ -51,11 +59,7 @@ async def handle_chat_query(query: chatbot_schemas.ChatQuery, db: AsyncSession =
 
     try:
         # 2. Obtenemos el historial completo de la sesión
-        result = await db.execute(
-            select(ConversacionIA)
-            .filter(ConversacionIA.sesion_id == query.sesion_id)
-            .order_by(ConversacionIA.creado_en)
-        )
+        result = await db.execute(_history_query(query.sesion_id))
         full_db_history = result.scalars().all()
 
         # 3. Limitamos el historial a los últimos turnos para eficiencia
@@ -1,33 +1,26 @@
 # En backend/routers/checkout_router.py
 
-import mercadopago
 import os
 import logging
 import hmac
 import hashlib
 import json
+from datetime import timezone
 from fastapi import APIRouter, Depends, HTTPException, Request, status
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, exc as SQLAlchemyExceptions
-from sqlalchemy.orm import joinedload
 from dotenv import load_dotenv
 
 from schemas import cart_schemas
 from database.database import get_db
-from database.models import Orden, DetalleOrden, VarianteProducto, Producto
-from services import email_service
+from services import cart_service, mercadopago_client, stock_reservations, webhook_inbox
+from services.mercadopago_client import MercadoPagoError
 
 # --- 1. CONFIGURACIÓN AL PRINCIPIO DEL ARCHIVO ---
 load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configura el SDK de Mercado Pago
-MERCADOPAGO_TOKEN = os.getenv("MERCADOPAGO_TOKEN")
-if not MERCADOPAGO_TOKEN:
-    logger.critical("MERCADOPAGO_TOKEN no encontrado. El checkout no funcionará.")
-sdk = mercadopago.SDK(MERCADOPAGO_TOKEN)
-
+# El cliente de Mercado Pago (async, compartido) vive en services/mercadopago_client
 MERCADOPAGO_WEBHOOK_SECRET = os.getenv("MERCADOPAGO_WEBHOOK_SECRET")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
@@ -44,37 +37,48 @@ async def create_preference(cart: cart_schemas.Cart, db: AsyncSession = Depends(
             detail="No se puede crear una preferencia de pago con un carrito vacío."
         )
 
-    items = []
-    for item_in_cart in cart.items:
-        query = (
-            select(VarianteProducto)
-            .where(VarianteProducto.id == item_in_cart.variante_id)
-            .options(joinedload(VarianteProducto.producto))
-        )
-        result = await db.execute(query)
-        variante_db = result.scalars().first()
-        
-        if not variante_db:
-            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, 
-                                detail=f"Item con id {item_in_cart.variante_id} no encontrado.")
-        
-        if variante_db.cantidad_en_stock < item_in_cart.quantity:
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
-                                detail=f"Stock insuficiente para {variante_db.producto.nombre}.")
-
-        items.append({
-            "id": str(variante_db.id),
-            "title": variante_db.producto.nombre,
-            "quantity": item_in_cart.quantity,
-            "unit_price": float(variante_db.producto.precio),
-            "currency_id": "ARS"
-        })
-
     external_reference = cart.user_id or cart.guest_session_id
     if not external_reference:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, 
                             detail="El carrito debe tener un user_id o guest_session_id.")
 
+    # Una sola query para todo el carrito; precios de la base, no los del cliente
+    validation = await cart_service.validate_items(db, cart.items, clave=str(external_reference))
+    if not validation.valido:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "mensaje": "Hay items del carrito que no se pueden comprar.",
+                "errores": [error.model_dump() for error in validation.errores],
+            },
+        )
+
+    items = [
+        {
+            "id": str(item.variante_id),
+            "title": item.nombre,
+            "quantity": item.cantidad,
+            "unit_price": item.precio_unitario,
+            "currency_id": "ARS"
+        }
+        for item in validation.items
+    ]
+
+    # Apartamos las unidades hasta que llegue el pago (o venza la reserva). Se vuelve
+    # a chequear bajo lock: entre la validación y acá otro checkout pudo reservar.
+    try:
+        reserva_id, reserva_expira_en = await stock_reservations.reserve(
+            db, {item.variante_id: item.cantidad for item in validation.items}, clave=str(external_reference)
+        )
+    except stock_reservations.ReservaRechazada as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={
+                "mensaje": "Hay items del carrito que no se pueden comprar.",
+                "errores": [error.model_dump() for error in e.errores],
+            },
+        )
+
     preference_data = {
         "items": items,
         "back_urls": {
@@ -84,30 +88,38 @@ async def create_preference(cart: cart_schemas.Cart, db: AsyncSession = Depends(
         },
         # --- CAMBIO CLAVE: Se elimina 'auto_return' para máxima compatibilidad ---
         "notification_url": f"{BACKEND_URL}/api/checkout/webhook",
-        "external_reference": str(external_reference)
+        "external_reference": str(external_reference),
+        # Vuelve en el pago: con esto el webhook convierte la reserva en la orden
+        "metadata": {"reserva_id": reserva_id},
+        # Pasada la reserva MP no acepta el pago (el stock ya pudo haberse liberado)
+        "expires": True,
+        "expiration_date_to": reserva_expira_en.replace(tzinfo=timezone.utc).isoformat(timespec="milliseconds"),
     }
 
     try:
         logger.info(f"Creando preferencia de MP con data: {preference_data}")
-        preference_response = sdk.preference().create(preference_data)
-        
-        if "response" in preference_response and preference_response["response"]:
-            preference = preference_response["response"]
-            return {"preference_id": preference.get("id"), "init_point": preference.get("init_point")}
-        else:
-            # Manejo de error más robusto si Mercado Pago no devuelve lo esperado
-            error_message = preference_response.get("message", "Error desconocido de Mercado Pago.")
-            logger.error(f"Error de Mercado Pago al crear preferencia: {error_message}")
-            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error de Mercado Pago: {error_message}")
-
+        preference = await mercadopago_client.get_client().create_preference(preference_data)
+        return {
+            "preference_id": preference.get("id"),
+            "init_point": preference.get("init_point"),
+            "reserva_id": reserva_id,
+            "reserva_expira_en": reserva_expira_en,
+        }
+
+    except MercadoPagoError as e:
+        await stock_reservations.release(db, reserva_id)  # Sin preferencia no hay pago posible
+        logger.error(f"Error de Mercado Pago al crear preferencia: {e.message}")
+        if e.status_code is None or e.status_code >= 500:
+            # MP caído o lento (ya se reintentó): no es culpa del pedido
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Mercado Pago no está disponible. Probá de nuevo en unos minutos.")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Error de Mercado Pago: {e.message}")
     except Exception as e:
+        await stock_reservations.release(db, reserva_id)
         logger.error(f"Excepción al crear la preferencia de Mercado Pago: {e}", exc_info=True)
-        if isinstance(e, HTTPException):
-            raise e
         raise HTTPException(status_code=500, detail="Error interno del servidor al procesar el pago.")
 
 
-# --- 3. FUNCIONES DE WEBHOOK Y GUARDADO (YA ESTABAN BIEN) ---
+# --- 3. WEBHOOK (el guardado de la orden está en services/order_service) ---
 def verify_mercadopago_signature(request: Request, payload: bytes):
     if not MERCADOPAGO_WEBHOOK_SECRET:
         logger.warning("MERCADOPAGO_WEBHOOK_SECRET no está configurado. Omitiendo verificación.")
@@ -159,92 +171,16 @@ async def mercadopago_webhook(request: Request, db: AsyncSession = Depends(get_d
         raise HTTPException(status_code=400, detail="JSON malformado.")
 
     verify_mercadopago_signature(request, body)
-    
+
+    # Solo lo dejamos en el inbox y respondemos: el pedido a MP y la transacción de
+    # orden + stock los hace el consumidor en segundo plano (services/webhook_inbox).
+    # Así MP recibe su 200 enseguida y no reintenta aunque llegue una ráfaga.
     if data.get("type") == "payment":
         payment_id = data.get("data", {}).get("id")
         if not payment_id:
             return {"status": "ignored", "reason": "No payment ID"}
 
-        try:
-            existing_order = await db.execute(
-                select(Orden).filter(Orden.payment_id_mercadopago == str(payment_id))
-            )
-            if existing_order.scalars().first():
-                logger.info(f"Webhook para payment_id {payment_id} ya fue procesado. Omitiendo.")
-                return {"status": "ok", "reason": "Already processed"}
-
-            payment_info_response = sdk.payment().get(payment_id)
-            payment_info = payment_info_response["response"]
-
-            if payment_info["status"] == "approved":
-                logger.info(f"Pago aprobado! ID: {payment_id}. Procesando orden...")
-                await save_order_and_update_stock(payment_info, db, str(payment_id))
-                
-        except Exception as e:
-            logger.error(f"Error al procesar el webhook de Mercado Pago: {e}")
-            return {"status": "error", "detail": str(e)}
+        queued = await webhook_inbox.enqueue(db, str(payment_id), data)
+        return {"status": "ok", "reason": "Queued" if queued else "Already queued"}
 
     return {"status": "ok"}
-
-async def save_order_and_update_stock(payment_info: dict, db: AsyncSession, payment_id: str):
-    try:
-        usuario_id = payment_info.get("external_reference")
-        monto_total = payment_info.get("transaction_amount")
-        
-        new_order = Orden(
-            usuario_id=usuario_id,
-            monto_total=monto_total,
-            estado="Completado",
-            estado_pago="Aprobado",
-            metodo_pago="MercadoPago",
-            payment_id_mercadopago=payment_id
-        )
-        db.add(new_order)
-        await db.flush()
-
-        items_procesados = []
-        for item in payment_info.get("additional_info", {}).get("items", []):
-            variante_id = int(item.get("id"))
-            cantidad_comprada = int(item.get("quantity"))
-            precio_unitario = float(item.get("unit_price"))
-
-            order_detail = DetalleOrden(
-                orden_id=new_order.id,
-                variante_producto_id=variante_id,
-                cantidad=cantidad_comprada,
-                precio_en_momento_compra=precio_unitario
-            )
-            db.add(order_detail)
-            items_procesados.append({"id": variante_id, "cantidad": cantidad_comprada})
-
-        for item in items_procesados:
-            variante_id = item["id"]
-            cantidad_comprada = item["cantidad"]
-
-            result = await db.execute(
-                select(VarianteProducto)
-                .where(VarianteProducto.id == variante_id)
-                .with_for_update()
-            )
-            variante_producto = result.scalars().first()
-            
-            if variante_producto:
-                if variante_producto.cantidad_en_stock >= cantidad_comprada:
-                    variante_producto.cantidad_en_stock -= cantidad_comprada
-                    db.add(variante_producto)
-                else:
-                    raise Exception(f"Stock insuficiente para {variante_id}")
-            else:
-                raise Exception(f"Variante {variante_id} no encontrada")
-
-        await db.commit()
-        logger.info(f"Orden {new_order.id} guardada y stock actualizado exitosamente.")
-
-    except SQLAlchemyExceptions.IntegrityError as e:
-        logger.error(f"Error de Integridad de DB al guardar la orden: {e}")
-        await db.rollback()
-        raise HTTPException(status_code=500, detail="Error de base de datos al guardar la orden.")
-    except Exception as e:
-        logger.error(f"Error al procesar la orden y stock: {e}")
-        await db.rollback()
-        raise HTTPException(status_code=500, detail=f"Error al procesar la orden: {str(e)}")
\ No newline at end of file
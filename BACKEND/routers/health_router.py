@@ -2,6 +2,7 @@
 
 from fastapi import APIRouter
 from database.database import check_sql_connection, check_nosql_connection
+from services import catalog_cache, hot_sku, principal_cache, stock_reservations, webhook_inbox
 
 router = APIRouter(
     prefix="/health",
@@ -16,4 +17,15 @@ async def check_sql_database():
 @router.get("/db-nosql")
 async def check_nosql_database():
     """Verifica que la conexión con MongoDB funcione."""
-    return await check_nosql_connection()
\ No newline at end of file
+    return await check_nosql_connection()
+
+@router.get("/metrics")
+async def get_metrics():
+    """Contadores internos (caches, colas) para scrapear desde el monitoreo."""
+    return {
+        "catalog_cache": catalog_cache.stats(),
+        "principal_cache": principal_cache.stats(),
+        "webhook_inbox": webhook_inbox.stats(),
+        "stock_reservations": stock_reservations.stats(),
+        "hot_sku": hot_sku.stats(),
+    }
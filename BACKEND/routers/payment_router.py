@@ -1,8 +1,9 @@
 import os
 from fastapi import APIRouter, HTTPException, status
 from dotenv import load_dotenv
-import mercadopago
 from schemas.payment_schemas import CardToken
+from services import mercadopago_client
+from services.mercadopago_client import MercadoPagoError
 
 # Carga las variables de entorno del .env
 load_dotenv()
@@ -12,8 +13,6 @@ access_token = os.getenv("MERCADOPAGO_TOKEN")
 if not access_token:
     raise Exception("MERCADOPAGO_ACCESS_TOKEN no está configurado en las variables de entorno")
 
-sdk = mercadopago.SDK(access_token)
-
 router = APIRouter(
     prefix="/payments",
     tags=["Payments"]
@@ -35,8 +34,8 @@ async def process_payment(card_token: CardToken):
     }
 
     try:
-        payment_response = sdk.payment().create(payment_data)
-        payment = payment_response["response"]
+        # El token de tarjeta es de un solo uso: sirve de clave de idempotencia
+        payment = await mercadopago_client.get_client().create_payment(payment_data, idempotency_key=card_token.token)
 
         if payment["status"] == "approved":
             return {"status": "approved", "payment_id": payment["id"]}
@@ -46,6 +45,13 @@ async def process_payment(card_token: CardToken):
                 detail=f"El pago no fue aprobado. Estado: {payment['status']} - {payment['status_detail']}"
             )
 
+    except HTTPException:
+        raise
+    except MercadoPagoError as e:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY if e.status_code is None or e.status_code >= 500 else status.HTTP_400_BAD_REQUEST,
+            detail=f"Error de Mercado Pago: {e.message}"
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,20 +1,24 @@
 # En backend/routers/products_router.py
 
 # --- IMPORTS ACTUALIZADOS ---
+import shutil
+import tempfile
 from fastapi import (
-    APIRouter, Depends, HTTPException, Query, status, 
+    APIRouter, Depends, HTTPException, Query, Request, Response, status, 
     File, UploadFile, Form
 )
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from sqlalchemy.orm import joinedload
-from typing import List, Optional
+from sqlalchemy import select, func, case
+from sqlalchemy.orm import joinedload, selectinload
+from typing import List, Optional, Union
 
 # --- Tus Módulos y Servicios ---
 from database.models import VarianteProducto, Producto
-from services import auth_services, cloudinary_service # <-- ¡Importamos el nuevo servicio!
+from services import auth_services, cloudinary_service, catalog_index, catalog_cache, product_import, bulk_update, stock_reservations # <-- ¡Importamos el nuevo servicio!
 from schemas import product_schemas, user_schemas
 from database.database import get_db
+from utils import pagination, http_cache, fast_json, image_urls
 
 
 router = APIRouter(
@@ -22,33 +26,251 @@ router = APIRouter(
     tags=["Products"]
 )
 
+MAX_PRODUCT_IMAGES = 3
+
+# --- Filtros comunes del catálogo ---
+def get_product_filters(material: Optional[str] = Query(None), precio_max: Optional[float] = Query(None, alias="precio"), categoria_id: Optional[int] = Query(None), talle: Optional[str] = Query(None), color: Optional[str] = Query(None)) -> product_schemas.ProductFilters:
+    return product_schemas.ProductFilters(material=material, precio_max=precio_max, categoria_id=categoria_id, talle=talle, color=color)
+
+def apply_product_filters(query, filters: product_schemas.ProductFilters):
+    if filters.material: query = query.where(Producto.material.ilike(f"%{filters.material}%"))
+    if filters.precio_max: query = query.where(Producto.precio <= filters.precio_max)
+    if filters.categoria_id: query = query.where(Producto.categoria_id == filters.categoria_id)
+    if filters.talle: query = query.where(Producto.talle.ilike(f"%{filters.talle}%"))
+    if filters.color: query = query.where(Producto.color.ilike(f"%{filters.color}%"))
+    return query
+
+def _list_validators_query(filters: product_schemas.ProductFilters):
+    """
+    max(actualizado_en), cantidad y suma de precios de los productos filtrados, y de
+    sus variantes max(actualizado_en), cantidad y suma de versiones (cada UPDATE de
+    una variante la sube en 1, así que dos cambios no se compensan), más lo reservado
+    ahora mismo (una reserva que vence cambia el stock libre sin escribir nada).
+    Todo en una sola query de agregados.
+    """
+    filtrados = apply_product_filters(select(Producto.id, Producto.precio, Producto.actualizado_en), filters).cte("filtrados")
+    de_filtrados = VarianteProducto.producto_id.in_(select(filtrados.c.id))
+    reservado = stock_reservations.held_subquery(select(VarianteProducto.id).where(de_filtrados))
+    return select(
+        select(func.max(filtrados.c.actualizado_en)).scalar_subquery(),
+        select(func.max(VarianteProducto.actualizado_en)).where(de_filtrados).scalar_subquery(),
+        select(func.count()).select_from(filtrados).scalar_subquery(),
+        select(func.sum(filtrados.c.precio)).scalar_subquery(),
+        select(func.count(VarianteProducto.id)).where(de_filtrados).scalar_subquery(),
+        select(func.sum(VarianteProducto.version)).where(de_filtrados).scalar_subquery(),
+        select(func.sum(reservado.c.reservado)).scalar_subquery(),
+    )
+
+def _last_modified(*values):
+    """El más nuevo de los timestamps (producto y variantes); None si no hay ninguno."""
+    return max((value for value in values if value is not None), default=None)
+
+async def _list_validators(db: AsyncSession, filters: product_schemas.ProductFilters, page_key) -> tuple:
+    """ETag y Last-Modified de un listado sin traer las filas."""
+    productos_modificado, variantes_modificado, *summary = (await db.execute(_list_validators_query(filters))).one()
+    last_modified = _last_modified(productos_modificado, variantes_modificado)
+    return http_cache.make_etag("productos", page_key, last_modified, summary), last_modified
+
+def _card_query():
+    """
+    Solo las columnas que usa la grilla. "En stock" es que alguna variante tenga
+    unidades libres (stock - reservas vigentes), con subqueries correlacionadas por
+    fila: buscan en ix_variantes_producto_stock e ix_reservas_variante_expira solo
+    para los productos de la página. Si el producto no tiene variantes se mira Producto.stock.
+    """
+    variantes = select(VarianteProducto.id).where(VarianteProducto.producto_id == Producto.id)
+    libre = variantes.where(VarianteProducto.cantidad_en_stock > stock_reservations.held_scalar(VarianteProducto.id)).exists()
+    en_stock = case((variantes.exists(), libre), else_=Producto.stock > 0)
+    return select(Producto.id, Producto.nombre, Producto.precio, Producto.urls_imagenes, en_stock.label("en_stock"))
+
+def _product_page_query(filters: product_schemas.ProductFilters, skip: int, limit: int, sort_by: Optional[str], cursor: Optional[str], view: str = "full"):
+    if view == "card":
+        query = _card_query()
+    else:
+        # selectinload trae las variantes en una segunda query, así el LIMIT se aplica
+        # sobre productos y no sobre las filas multiplicadas por el JOIN.
+        query = select(Producto).options(selectinload(Producto.variantes))
+    query = apply_product_filters(query, filters)
+    query = query.order_by(*pagination.keyset_order_by(Producto, sort_by))
+
+    # Modo cursor (keyset): en vez de OFFSET seguimos desde la última fila vista.
+    if cursor is not None:
+        if cursor:
+            last_value, last_id = pagination.decode_cursor(cursor, sort_by)
+            query = query.where(pagination.keyset_after(Producto, sort_by, last_value, last_id))
+        query = query.limit(limit + 1)  # Una fila extra nos dice si hay página siguiente
+    else:
+        query = query.offset(skip).limit(limit)
+    return query
+
+def _product_detail_query(product_id: int):
+    return select(Producto).options(joinedload(Producto.variantes)).filter(Producto.id == product_id)
+
+async def _load_product_page(db: AsyncSession, filters: product_schemas.ProductFilters, skip: int, limit: int, sort_by: Optional[str], cursor: Optional[str], view: str = "full") -> tuple:
+    result = await db.execute(_product_page_query(filters, skip, limit, sort_by, cursor, view))
+    products = result.all() if view == "card" else result.scalars().all()
+
+    headers = {}
+    if cursor is not None and len(products) > limit:
+        products = products[:limit]
+        last = products[-1]
+        headers["X-Next-Cursor"] = pagination.encode_cursor(
+            sort_by, pagination.sort_value(last, sort_by), last.id
+        )
+    return products, headers
+
+_PRODUCT_FIELDS = [name for name in product_schemas.Product.model_fields if name not in ("variantes", "imagenes_responsive")]
+_VARIANT_FIELDS = list(product_schemas.VarianteProducto.model_fields)
+
+async def _held(db: AsyncSession, products) -> dict:
+    """Reservas vigentes de las variantes de estos productos (una query, solo índice)."""
+    return await stock_reservations.held_by_variant(db, [v.id for p in products for v in p.variantes])
+
+def _free_stock(variants: list, held: dict) -> list:
+    """El stock que se muestra es el libre: lo que tiene la variante menos lo reservado."""
+    for variant in variants:
+        variant["cantidad_en_stock"] = max(variant["cantidad_en_stock"] - held.get(variant["id"], 0), 0)
+    return variants
+
+def _product_dict(product: Producto, responsive: bool = False, held: Optional[dict] = None) -> dict:
+    """
+    Lo mismo que Product.model_validate(p).model_dump(), pero leyendo los atributos
+    directo (sin validar). Los campos salen de los schemas, así no se desincronizan.
+    """
+    data = {name: getattr(product, name) for name in _PRODUCT_FIELDS}
+    data["precio"] = float(data["precio"])
+    data["variantes"] = _free_stock([{name: getattr(v, name) for name in _VARIANT_FIELDS} for v in product.variantes], held or {})
+    if responsive:
+        data["imagenes_responsive"] = image_urls.responsive_images(data["urls_imagenes"])
+    return data
+
+def _card_dict(row, responsive: bool = False) -> dict:
+    imagen = row.urls_imagenes[0] if row.urls_imagenes else None
+    data = {
+        "id": row.id,
+        "nombre": row.nombre,
+        "precio": float(row.precio),
+        "imagen": imagen,
+        "en_stock": bool(row.en_stock),
+    }
+    if responsive and imagen:
+        data["imagen_responsive"] = image_urls.responsive_image(imagen)
+    return data
+
+def _detail_payload(entry: catalog_cache.CachedProduct, responsive: bool) -> tuple:
+    """(payload, etag) del detalle; la versión responsive se arma una vez por versión cacheada."""
+    if not responsive:
+        return entry.payload, entry.etag
+    if entry.responsive is None:
+        payload = {**entry.payload, "imagenes_responsive": image_urls.responsive_images(entry.payload["urls_imagenes"])}
+        entry.responsive = (payload, http_cache.make_etag("producto-responsive", entry.etag))
+    return entry.responsive
+
+def _cache_product(product: Producto, held: dict, generation: int) -> catalog_cache.CachedProduct:
+    """
+    Serializa un producto una sola vez por versión y le calcula sus validadores.
+    `generation` es la del cache antes de leer el producto de la base.
+    """
+    payload = product_schemas.Product.model_validate(product).model_dump()
+    _free_stock(payload["variantes"], held)
+    # Un descuento de stock mueve la variante, no el producto
+    last_modified = _last_modified(product.actualizado_en, *(v.actualizado_en for v in product.variantes))
+    entry = catalog_cache.CachedProduct(
+        payload=payload,
+        # El payload incluye el stock de cada variante; actualizado_en cubre el resto
+        etag=http_cache.make_etag("producto", last_modified, payload),
+        last_modified=last_modified,
+    )
+    catalog_cache.set_product(product.id, entry, generation)
+    return entry
+
 # --- GET (Estos ya estaban bien, no se tocan) ---
-@router.get("/", response_model=List[product_schemas.Product])
-async def get_products(db: AsyncSession = Depends(get_db), material: Optional[str] = Query(None), precio_max: Optional[float] = Query(None, alias="precio"), categoria_id: Optional[int] = Query(None), talle: Optional[str] = Query(None), color: Optional[str] = Query(None), skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100), sort_by: Optional[str] = Query(None)):
-    query = select(Producto).options(joinedload(Producto.variantes))
-    if material: query = query.where(Producto.material.ilike(f"%{material}%"))
-    if precio_max: query = query.where(Producto.precio <= precio_max)
-    if categoria_id: query = query.where(Producto.categoria_id == categoria_id)
-    if talle: query = query.where(Producto.talle.ilike(f"%{talle}%"))
-    if color: query = query.where(Producto.color.ilike(f"%{color}%"))
-    if sort_by:
-        if sort_by == "precio_asc": query = query.order_by(Producto.precio.asc())
-        elif sort_by == "precio_desc": query = query.order_by(Producto.precio.desc())
-        elif sort_by == "nombre_asc": query = query.order_by(Producto.nombre.asc())
-        elif sort_by == "nombre_desc": query = query.order_by(Producto.nombre.desc())
-    query = query.offset(skip).limit(limit)
-    result = await db.execute(query)
-    products = result.scalars().unique().all()
-    return products
+@router.get("/", response_model=Union[List[product_schemas.Product], List[product_schemas.ProductCard]])
+async def get_products(request: Request, response: Response, db: AsyncSession = Depends(get_db), filters: product_schemas.ProductFilters = Depends(get_product_filters), skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100), sort_by: Optional[str] = Query(None), cursor: Optional[str] = Query(None, description="Paginación por cursor: mandá vacío para la primera página y después el valor del header X-Next-Cursor"), view: str = Query("full", pattern="^(full|card)$", description="'card' devuelve solo id, nombre, precio, primera imagen y si hay stock"), responsive: bool = Query(False, description="Agrega las URLs por ancho (srcset) de cada imagen")):
+    # Read-through: la misma página pedida dos veces no vuelve a tocar MySQL
+    cache_key = (tuple(filters.model_dump().items()), skip, limit, sort_by, cursor, view, responsive)
+    cached = catalog_cache.get_list(cache_key)
+
+    if cached is None:
+        generation = catalog_cache.generation()
+        # Antes de traer filas, vemos con agregados si el cliente ya tiene esta versión
+        etag, last_modified = await _list_validators(db, filters, cache_key)
+        if http_cache.is_not_modified(request, etag, last_modified):
+            return http_cache.not_modified(etag, last_modified)
+
+        products, headers = await _load_product_page(db, filters, skip, limit, sort_by, cursor, view)
+        if view == "card":
+            items = [_card_dict(p, responsive) for p in products]
+        else:
+            held = await _held(db, products)
+            items = [_product_dict(p, responsive, held) for p in products]
+        cached = catalog_cache.CachedList(
+            items=items,
+            product_ids=frozenset(p.id for p in products),
+            etag=etag, last_modified=last_modified, headers=headers,
+        )
+        catalog_cache.set_list(cache_key, cached, generation)
+    elif http_cache.is_not_modified(request, cached.etag, cached.last_modified):
+        return http_cache.not_modified(cached.etag, cached.last_modified)
+
+    headers = {**cached.headers, **http_cache.validator_headers(cached.etag, cached.last_modified)}
+    if fast_json.FAST_JSON_ENABLED:
+        # Mismo schema que response_model, pero serializado con orjson una sola vez por página
+        return fast_json.fast_json_response(request, cached.items, headers=headers, encoded_cache=cached.encoded)
+    response.headers.update(headers)
+    return cached.items
+
+@router.get("/search", response_model=List[product_schemas.Product], summary="Buscar productos por texto")
+async def search_products(response: Response, q: str = Query(..., min_length=1, max_length=200), db: AsyncSession = Depends(get_db), filters: product_schemas.ProductFilters = Depends(get_product_filters), skip: int = Query(0, ge=0), limit: int = Query(10, ge=1, le=100), responsive: bool = Query(False)):
+    """
+    Búsqueda sobre nombre, descripción, material, color y talle usando el índice
+    invertido en memoria (sin tildes, sin importar mayúsculas, rankeada por relevancia).
+    Se combina con los mismos filtros que el listado. El total va en X-Total-Count.
+    """
+    ids, total = await catalog_index.search(db, q, filters, skip=skip, limit=limit)
+    response.headers["X-Total-Count"] = str(total)
+    if not ids:
+        return []
+
+    # Primero lo que ya está en el cache de detalle; a la DB solo va lo que falta
+    by_id = {pid: catalog_cache.get_product(pid) for pid in ids}
+    missing = [pid for pid, entry in by_id.items() if entry is None]
+    if missing:
+        generation = catalog_cache.generation()
+        result = await db.execute(select(Producto).options(selectinload(Producto.variantes)).where(Producto.id.in_(missing)))
+        products = result.scalars().all()
+        held = await _held(db, products)
+        for product in products:
+            by_id[product.id] = _cache_product(product, held, generation)
+    # Respetamos el orden de relevancia que devolvió el índice
+    return [_detail_payload(by_id[pid], responsive)[0] for pid in ids if by_id.get(pid) is not None]
+
+@router.get("/facets", response_model=product_schemas.ProductFacets, summary="Conteos por filtro para el panel del catálogo")
+async def get_product_facets(db: AsyncSession = Depends(get_db), filters: product_schemas.ProductFilters = Depends(get_product_filters), price_buckets: int = Query(5, ge=1, le=50)):
+    """
+    Recibe los mismos filtros que el listado y devuelve, en una sola llamada,
+    cuántos productos hay por material, color, talle y categoría, más un
+    histograma de precios. Sale de los bitmaps del índice en memoria, no de la DB.
+    """
+    return await catalog_index.facets(db, filters, price_buckets=price_buckets)
 
 @router.get("/{product_id}", response_model=product_schemas.Product)
-async def get_product(product_id: int, db: AsyncSession = Depends(get_db)):
-    query = select(Producto).options(joinedload(Producto.variantes)).filter(Producto.id == product_id)
-    result = await db.execute(query)
-    product = result.scalars().unique().first()
-    if not product:
-        raise HTTPException(status_code=404, detail="Producto no encontrado")
-    return product
+async def get_product(product_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db), responsive: bool = Query(False, description="Agrega las URLs por ancho (srcset) de cada imagen")):
+    cached = catalog_cache.get_product(product_id)
+    if cached is None:
+        generation = catalog_cache.generation()
+        result = await db.execute(_product_detail_query(product_id))
+        product = result.scalars().unique().first()
+        if not product:
+            raise HTTPException(status_code=404, detail="Producto no encontrado")
+        cached = _cache_product(product, await _held(db, [product]), generation)
+
+    payload, etag = _detail_payload(cached, responsive)
+    # Si el cliente ya tiene esta versión, 304 sin cuerpo
+    if http_cache.is_not_modified(request, etag, cached.last_modified):
+        return http_cache.not_modified(etag, cached.last_modified)
+    response.headers.update(http_cache.validator_headers(etag, cached.last_modified))
+    return payload
 
 # --- POST DE VARIANTES (Este que agregaste lo dejamos como está) ---
 @router.post(
@@ -75,6 +297,8 @@ async def create_variant_for_product(
     db.add(new_variant)
     await db.commit()
     await db.refresh(new_variant)
+    # Una variante nueva no cambia en qué listados aparece el producto
+    catalog_cache.invalidate_products([product_id], membership_changed=False)
     return new_variant
 
 # --- POST PARA CREAR PRODUCTO (ACÁ ESTÁ LA MAGIA NUEVA) ---
@@ -91,7 +315,7 @@ async def create_product(
     talle: Optional[str] = Form(None),
     color: Optional[str] = Form(None),
     # Y acá recibimos la lista de archivos de imagen
-    images: List[UploadFile] = File(..., description="Hasta 3 imágenes del producto"),
+    images: Optional[List[UploadFile]] = File(None, description="Hasta 3 imágenes del producto (o subirlas después con /uploads/signature + /{product_id}/images)"),
     db: AsyncSession = Depends(get_db),
     current_admin: user_schemas.UserOut = Depends(auth_services.get_current_admin_user)
 ):
@@ -101,13 +325,14 @@ async def create_product(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Ya existe un producto con el SKU: {sku}")
 
     # 2. Verificación de la cantidad de imágenes
-    if len(images) > 3:
+    images = images or []
+    if len(images) > MAX_PRODUCT_IMAGES:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Se pueden subir como máximo 3 imágenes.")
 
     # 3. Subida de imágenes a Cloudinary
     image_urls = []
     if images and images[0].filename: # Chequeamos que no venga una lista vacía o con archivos sin nombre
-        image_urls = await cloudinary_service.upload_images(images)
+        image_urls = await cloudinary_service.upload_images(images, db=db)  # Con db: reutiliza fotos ya subidas
 
     # 4. Armado del objeto del producto con los datos del formulario y las URLs
     product_data = product_schemas.ProductCreate(
@@ -130,11 +355,109 @@ async def create_product(
     await db.refresh(new_product)
 
     # 6. Devolvemos el producto completo, con sus variantes (si las tuviera)
-    query = select(Producto).options(joinedload(Producto.variantes)).filter(Producto.id == new_product.id)
-    result = await db.execute(query)
+    result = await db.execute(_product_detail_query(new_product.id))
     created_product = result.scalars().unique().first()
+    catalog_index.index_product(created_product)
+    catalog_cache.invalidate_product(created_product.id)
     return created_product
 
+# --- IMPORTACIÓN MASIVA (CSV / JSONL) ---
+@router.post("/import", response_model=product_schemas.ImportSummary, summary="Importar productos y variantes desde CSV o JSONL (Solo Admins)")
+async def import_products(
+    request: Request,
+    file: UploadFile = File(..., description="CSV con cabecera o JSONL (un producto por línea)"),
+    formato: Optional[str] = Query(None, pattern="^(csv|jsonl)$", description="Si no se manda, se deduce de la extensión"),
+    db: AsyncSession = Depends(get_db),
+    current_admin: user_schemas.UserOut = Depends(auth_services.get_current_admin_user)
+):
+    """
+    Columnas/campos: los de ProductCreate más `variantes`. En CSV las imágenes van
+    separadas por `|` y las variantes como `talle/color/stock` separadas por `;`.
+    Se guarda de a lotes; las filas con error se informan y no frenan al resto.
+    Con `Accept: application/x-ndjson` la respuesta va llegando de a líneas: una
+    `{"tipo": "progreso", ...}` por lote guardado y al final `{"tipo": "resumen", ...}`.
+    """
+    fmt = formato or product_import.detect_format(file.filename, file.content_type)
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Formato no soportado: subí un .csv o un .jsonl (o indicá ?formato=).")
+
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        # FastAPI cierra el archivo subido antes de mandar el cuerpo: lo pasamos a uno
+        # temporal propio (en disco, de a bloques) que vive lo que dure el stream
+        spool = tempfile.TemporaryFile()
+        shutil.copyfileobj(file.file, spool)
+        spool.seek(0)
+        return StreamingResponse(_import_events(spool, fmt), media_type="application/x-ndjson")
+
+    summary, _ = await product_import.import_products(db, file.file, fmt)
+    _after_import(summary["creados"])
+    return summary
+
+def _after_import(created: int):
+    if created:
+        # Muchos productos nuevos de golpe: más barato reconstruir el índice que indexar de a uno
+        catalog_index.invalidate()
+        catalog_cache.invalidate_lists()
+
+async def _import_events(spool, fmt: str):
+    created = 0
+    try:
+        async for event in product_import.import_products_with_progress(spool, fmt):
+            created = event["creados"]
+            yield fast_json.dumps(event) + b"\n"
+    finally:
+        # También si el cliente cortó a la mitad: los lotes ya guardados quedan
+        spool.close()
+        _after_import(created)
+
+# --- ACTUALIZACIÓN MASIVA DE STOCK Y PRECIOS ---
+# Con muchos precios cambiados es más barato rearmar el índice que reindexar de a uno
+BULK_REINDEX_THRESHOLD = 500
+
+@router.patch("/bulk", response_model=product_schemas.BulkUpdateResult, summary="Actualizar stock de variantes y precios en lote (Solo Admins)")
+async def bulk_update_products(changes: product_schemas.BulkUpdateRequest, db: AsyncSession = Depends(get_db), current_admin: user_schemas.UserOut = Depends(auth_services.get_current_admin_user)):
+    """
+    Todo o nada: si una fila falla no se aplica ninguna y el 400 trae la lista de errores.
+    Devuelve el antes/después de cada fila.
+    """
+    diff, stock_products, price_products = await bulk_update.apply_bulk_update(db, changes)
+
+    catalog_cache.invalidate_products(stock_products - price_products, membership_changed=False)
+    if price_products:
+        catalog_cache.invalidate_products(price_products)  # El precio mueve productos entre listados
+        if len(price_products) > BULK_REINDEX_THRESHOLD:
+            catalog_index.invalidate()
+        else:
+            result = await db.execute(select(Producto).where(Producto.id.in_(price_products)).execution_options(populate_existing=True))
+            for product in result.scalars().all():
+                catalog_index.index_product(product)
+    return diff
+
+# --- SUBIDA DIRECTA DE IMÁGENES (el archivo va del navegador a Cloudinary) ---
+@router.post("/uploads/signature", response_model=product_schemas.SignedUploadParams, summary="Parámetros firmados para subir imágenes directo a Cloudinary (Solo Admins)")
+async def get_upload_signature(current_admin: user_schemas.UserOut = Depends(auth_services.get_current_admin_user)):
+    return cloudinary_service.signed_upload_params()
+
+@router.post("/{product_id}/images", response_model=product_schemas.Product, summary="Asociar imágenes ya subidas a Cloudinary a un producto (Solo Admins)")
+async def attach_product_images(product_id: int, images: List[product_schemas.UploadedImage], db: AsyncSession = Depends(get_db), current_admin: user_schemas.UserOut = Depends(auth_services.get_current_admin_user)):
+    product_db = await db.get(Producto, product_id)
+    if not product_db:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado")
+
+    new_urls = [cloudinary_service.verified_image_url(img.public_id, img.version, img.signature) for img in images]
+    current_urls = list(product_db.urls_imagenes or [])
+    urls = current_urls + [url for url in new_urls if url not in current_urls]
+    if len(urls) > MAX_PRODUCT_IMAGES:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Un producto puede tener como máximo {MAX_PRODUCT_IMAGES} imágenes.")
+
+    product_db.urls_imagenes = urls  # Lista nueva: a la columna JSON hay que reasignarla para que se guarde
+    await db.commit()
+
+    result = await db.execute(_product_detail_query(product_id).execution_options(populate_existing=True))
+    updated_product = result.scalars().unique().first()
+    catalog_cache.invalidate_product(product_id, changed_fields=["urls_imagenes"])
+    return updated_product
+
 # --- PUT (CORREGIDO, sin cambios funcionales pero consistente) ---
 @router.put("/{product_id}", response_model=product_schemas.Product, summary="Actualizar un producto (Solo Admins)")
 async def update_product(product_id: int, product_in: product_schemas.ProductUpdate, db: AsyncSession = Depends(get_db), current_admin: user_schemas.UserOut = Depends(auth_services.get_current_admin_user)):
@@ -149,9 +472,10 @@ async def update_product(product_id: int, product_in: product_schemas.ProductUpd
     db.add(product_db)
     await db.commit()
 
-    query = select(Producto).options(joinedload(Producto.variantes)).filter(Producto.id == product_id)
-    result = await db.execute(query)
+    result = await db.execute(_product_detail_query(product_id))
     updated_product = result.scalars().unique().first()
+    catalog_index.index_product(updated_product)
+    catalog_cache.invalidate_product(product_id, changed_fields=update_data.keys())
     return updated_product
 
 # --- DELETE (CORREGIDO, sin cambios funcionales pero consistente) ---
@@ -162,4 +486,6 @@ async def delete_product(product_id: int, db: AsyncSession = Depends(get_db), cu
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Producto no encontrado")
     await db.delete(product_db)
     await db.commit()
+    catalog_index.remove_product(product_id)
+    catalog_cache.invalidate_product(product_id)
     return {"message": "Product deleted successfully"}
\ No newline at end of file
@@ -60,4 +60,40 @@ class Orden(BaseModel): # Renombrado de OrdenOut para más claridad
     detalles: List[DetalleOrdenOut]
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+
+# --- Índice de imágenes subidas (deduplicación por contenido) ---
+
+class ImagenSubida(BaseModel):
+    id: int
+    sha256: str
+    public_id: str
+    url: str
+    bytes: int
+    usos: int
+    creado_en: Optional[datetime] = None
+    ultimo_uso_en: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class ImagePruneResult(BaseModel):
+    eliminadas: int
+    imagenes: List[ImagenSubida]
+
+# --- Inbox de webhooks de Mercado Pago ---
+
+class WebhookEvento(BaseModel):
+    id: int
+    payment_id: str
+    tipo: Optional[str] = None
+    estado: str
+    intentos: int
+    proximo_intento_en: Optional[datetime] = None
+    ultimo_error: Optional[str] = None
+    creado_en: Optional[datetime] = None
+    actualizado_en: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
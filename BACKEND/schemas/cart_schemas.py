@@ -1,6 +1,6 @@
 # En BACKEND/schemas/cart_schemas.py
 from pydantic import BaseModel, Field, BeforeValidator, ConfigDict
-from typing import List, Optional
+from typing import List, Literal, Optional, Union
 from datetime import datetime
 from typing_extensions import Annotated
 
@@ -26,4 +26,59 @@ class Cart(BaseModel):
     model_config = ConfigDict(
         populate_by_name = True,
         arbitrary_types_allowed = True
-    )
\ No newline at end of file
+    )
+
+# --- Operaciones en lote (PATCH /api/cart) ---
+class AddItemOp(BaseModel):
+    op: Literal["add"]
+    item: CartItem
+
+class SetQuantityOp(BaseModel):
+    op: Literal["set_quantity"]
+    variante_id: int
+    quantity: int = Field(..., ge=0) # 0 = sacarlo del carrito
+
+class IncrementOp(BaseModel):
+    op: Literal["increment"]
+    variante_id: int
+    delta: int # Negativo para restar; si llega a 0 o menos, se saca
+
+class RemoveItemOp(BaseModel):
+    op: Literal["remove"]
+    variante_id: int
+
+class ClearCartOp(BaseModel):
+    op: Literal["clear"]
+
+CartOperation = Annotated[
+    Union[AddItemOp, SetQuantityOp, IncrementOp, RemoveItemOp, ClearCartOp],
+    Field(discriminator="op"),
+]
+
+class CartBatch(BaseModel):
+    operations: List[CartOperation] = Field(..., min_length=1, max_length=100)
+
+# --- Validación del carrito contra la base (precios y stock reales) ---
+class ValidatedItem(BaseModel):
+    variante_id: int
+    producto_id: int
+    nombre: str
+    tamanio: str
+    color: str
+    cantidad: int
+    precio_unitario: float # El de la base, nunca el que mandó el cliente
+    subtotal: float
+    precio_cambio: bool = False # El precio guardado en el carrito ya no es el actual
+
+class CartItemError(BaseModel):
+    variante_id: int
+    error: Literal["no_existe", "stock_insuficiente"]
+    mensaje: str
+    solicitado: int
+    disponible: int = 0
+
+class CartValidation(BaseModel):
+    valido: bool
+    items: List[ValidatedItem] = []
+    errores: List[CartItemError] = []
+    total: float = 0
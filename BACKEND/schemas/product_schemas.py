@@ -1,7 +1,7 @@
 # En backend/schemas/product_schemas.py
 
-from pydantic import BaseModel, Field
-from typing import Optional,List
+from pydantic import BaseModel, Field, model_serializer, model_validator
+from typing import Optional, List, Union
 
 # --- CAMBIO NUEVO: Schema para las Variantes ---
 class VarianteProducto(BaseModel):
@@ -14,6 +14,12 @@ class VarianteProducto(BaseModel):
     class Config:
         from_attributes = True
 
+# Variante tal como llega en una carga (todavía sin id ni producto)
+class VarianteCreate(BaseModel):
+    tamanio: str
+    color: str
+    cantidad_en_stock: int = Field(..., ge=0)
+
 # Schema base del producto, con los campos comunes
 class ProductBase(BaseModel):
     nombre: str
@@ -44,9 +50,140 @@ class ProductUpdate(BaseModel):
     stock: Optional[int] = Field(None, ge=0) # Nuevo campo para el stock
     categoria_id: Optional[int] = None
 
+# Filtros del catálogo. Los comparten el listado, la búsqueda y cualquier
+# endpoint que tenga que devolver "lo mismo que get_products".
+class ProductFilters(BaseModel):
+    material: Optional[str] = None
+    precio_max: Optional[float] = None
+    categoria_id: Optional[int] = None
+    talle: Optional[str] = None
+    color: Optional[str] = None
+
+# Conteos del panel de filtros: "Negro (42)"
+class FacetCount(BaseModel):
+    valor: Union[int, str]
+    cantidad: int
+
+class PriceBucket(BaseModel):
+    desde: float
+    hasta: float
+    cantidad: int
+
+class ProductFacets(BaseModel):
+    total: int
+    material: List[FacetCount] = []
+    color: List[FacetCount] = []
+    talle: List[FacetCount] = []
+    categoria_id: List[FacetCount] = []
+    precio: List[PriceBucket] = []
+
+def _without_none(data: dict, key: str) -> dict:
+    if data.get(key) is None:
+        data.pop(key, None)
+    return data
+
+# Variantes por ancho de una imagen de Cloudinary (para <img srcset>)
+class ResponsiveImageVariant(BaseModel):
+    ancho: int
+    url: str
+
+class ResponsiveImage(BaseModel):
+    original: str
+    variantes: List[ResponsiveImageVariant] = []
+    srcset: str = ""
+
 # Schema para mostrar un producto en la base de datos (incluye el id)
 class Product(ProductBase):
     id: int
     variantes: List[VarianteProducto] = [] #CAMBIO NUEVO!!!
+    # Solo viene con ?responsive=true; si no, ni aparece en la respuesta
+    imagenes_responsive: Optional[List[ResponsiveImage]] = None
+
+    @model_serializer(mode="wrap")
+    def _omit_responsive(self, handler):
+        return _without_none(handler(self), "imagenes_responsive")
     class Config:
-        from_attributes = True # Permite que Pydantic lea los datos desde un objeto de SQLAlchemy
\ No newline at end of file
+        from_attributes = True # Permite que Pydantic lea los datos desde un objeto de SQLAlchemy
+
+# Versión liviana para la grilla de la tienda (?view=card): sin descripción ni variantes
+class ProductCard(BaseModel):
+    id: int
+    nombre: str
+    precio: float
+    imagen: Optional[str] = None # La primera de urls_imagenes
+    en_stock: bool
+    imagen_responsive: Optional[ResponsiveImage] = None # Solo con ?responsive=true
+
+    @model_serializer(mode="wrap")
+    def _omit_responsive(self, handler):
+        return _without_none(handler(self), "imagen_responsive")
+
+# --- Importación masiva ---
+# Una fila del CSV/JSONL: el producto más sus variantes
+class ProductImportRow(ProductCreate):
+    variantes: List[VarianteCreate] = []
+
+class ImportRowError(BaseModel):
+    fila: int # Número de línea/registro dentro del archivo (la cabecera del CSV no cuenta)
+    sku: Optional[str] = None
+    errores: List[str]
+
+class ImportSummary(BaseModel):
+    procesadas: int
+    creados: int
+    variantes_creadas: int
+    con_error: int
+    lotes: int
+    errores: List[ImportRowError] = [] # Recortada a las primeras N si hay demasiadas
+
+# --- Actualización masiva de stock y precios ---
+class VariantStockChange(BaseModel):
+    variante_id: int
+    cantidad_en_stock: Optional[int] = Field(None, ge=0) # Valor absoluto...
+    delta: Optional[int] = None # ...o suma/resta sobre el stock actual (no los dos)
+
+    @model_validator(mode="after")
+    def _exactly_one(self):
+        if (self.cantidad_en_stock is None) == (self.delta is None):
+            raise ValueError("Mandá cantidad_en_stock o delta (uno solo).")
+        return self
+
+class ProductPriceChange(BaseModel):
+    producto_id: int
+    precio: float = Field(..., gt=0)
+
+class BulkUpdateRequest(BaseModel):
+    variantes: List[VariantStockChange] = Field(default_factory=list, max_length=20000)
+    precios: List[ProductPriceChange] = Field(default_factory=list, max_length=20000)
+
+class VariantStockDiff(BaseModel):
+    variante_id: int
+    producto_id: int
+    antes: int
+    despues: int
+
+class ProductPriceDiff(BaseModel):
+    producto_id: int
+    antes: float
+    despues: float
+
+class BulkUpdateResult(BaseModel):
+    variantes: List[VariantStockDiff] = []
+    precios: List[ProductPriceDiff] = []
+
+# --- Subida directa de imágenes a Cloudinary ---
+class SignedUploadParams(BaseModel):
+    upload_url: str
+    api_key: Optional[str] = None
+    cloud_name: Optional[str] = None
+    timestamp: int
+    folder: str
+    allowed_formats: str
+    signature: str
+    expires_at: int
+
+# Lo que devolvió Cloudinary al front después de subir (tal cual)
+class UploadedImage(BaseModel):
+    public_id: str
+    version: int
+    signature: str
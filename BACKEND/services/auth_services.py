@@ -5,6 +5,7 @@ from jose import JWTError, jwt
 from pymongo.database import Database
 
 from database.database import get_db_nosql
+from services import principal_cache
 from utils import security
 from schemas import user_schemas
 
@@ -25,7 +26,7 @@ async def get_current_user(authorization: HTTPAuthorizationCredentials = Depends
     except JWTError:
         raise credentials_exception
 
-    user = await db.users.find_one({"email": email})
+    user = await principal_cache.get_user(db, email)
     if user is None:
         raise credentials_exception
     # Convert ObjectId to string for Pydantic validation
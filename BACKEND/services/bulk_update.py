@@ -0,0 +1,95 @@
+# En BACKEND/services/bulk_update.py
+
+from typing import Dict, List, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto
+from schemas import product_schemas
+from utils.db_locks import chunks, lock_rows
+
+
+def _duplicates(ids: List[int]) -> set:
+    seen, repeated = set(), set()
+    for item_id in ids:
+        (repeated if item_id in seen else seen).add(item_id)
+    return repeated
+
+
+async def _set_values(db: AsyncSession, model, column_name: str, new_values: Dict[int, object]):
+    """UPDATE ... SET col = CASE id WHEN ... END WHERE id IN (...), de a bloques."""
+    column = getattr(model, column_name)
+    items = sorted(new_values.items())
+    for chunk in chunks(items):
+        await db.execute(
+            update(model)
+            .where(model.id.in_([item_id for item_id, _ in chunk]))
+            .values({column: case(dict(chunk), value=model.id)})
+            .execution_options(synchronize_session=False)
+        )
+
+
+async def apply_bulk_update(db: AsyncSession, changes: product_schemas.BulkUpdateRequest) -> Tuple[dict, set, set]:
+    """
+    Aplica todos los cambios en una sola transacción o ninguno. Si alguna fila no
+    es válida (id inexistente, stock negativo, id repetido) se responde 400 con la
+    lista completa de problemas y no se toca nada.
+    Devuelve el diff y los ids de productos con stock tocado / precio tocado.
+    """
+    errors = []
+    variant_ids = [c.variante_id for c in changes.variantes]
+    product_ids = [c.producto_id for c in changes.precios]
+    for item_id in sorted(_duplicates(variant_ids)):
+        errors.append({"variante_id": item_id, "error": "La variante aparece más de una vez en el pedido."})
+    for item_id in sorted(_duplicates(product_ids)):
+        errors.append({"producto_id": item_id, "error": "El producto aparece más de una vez en el pedido."})
+    if errors:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail={"mensaje": "Pedido inválido.", "errores": errors})
+
+    try:
+        current_variants = await lock_rows(
+            db, [VarianteProducto.producto_id, VarianteProducto.cantidad_en_stock], VarianteProducto.id, variant_ids
+        ) if variant_ids else {}
+        current_prices = await lock_rows(db, [Producto.precio], Producto.id, product_ids) if product_ids else {}
+
+        new_stock, variant_diff = {}, []
+        for change in changes.variantes:
+            current = current_variants.get(change.variante_id)
+            if current is None:
+                errors.append({"variante_id": change.variante_id, "error": "La variante no existe."})
+                continue
+            producto_id, before = current
+            after = change.cantidad_en_stock if change.delta is None else before + change.delta
+            if after < 0:
+                errors.append({"variante_id": change.variante_id, "error": f"El stock quedaría negativo ({before} {change.delta:+d})."})
+                continue
+            new_stock[change.variante_id] = after
+            variant_diff.append({"variante_id": change.variante_id, "producto_id": producto_id, "antes": before, "despues": after})
+
+        new_prices, price_diff = {}, []
+        for change in changes.precios:
+            current = current_prices.get(change.producto_id)
+            if current is None:
+                errors.append({"producto_id": change.producto_id, "error": "El producto no existe."})
+                continue
+            new_prices[change.producto_id] = change.precio
+            price_diff.append({"producto_id": change.producto_id, "antes": float(current[0]), "despues": change.precio})
+
+        if errors:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail={"mensaje": "No se aplicó ningún cambio.", "errores": errors})
+
+        # Solo escribimos las filas que cambian de verdad
+        await _set_values(db, VarianteProducto, "cantidad_en_stock",
+                          {d["variante_id"]: d["despues"] for d in variant_diff if d["antes"] != d["despues"]})
+        await _set_values(db, Producto, "precio",
+                          {d["producto_id"]: new_prices[d["producto_id"]] for d in price_diff if d["antes"] != d["despues"]})
+        await db.commit()
+    except BaseException:
+        await db.rollback()  # Suelta los FOR UPDATE
+        raise
+
+    stock_products = {d["producto_id"] for d in variant_diff if d["antes"] != d["despues"]}
+    price_products = {d["producto_id"] for d in price_diff if d["antes"] != d["despues"]}
+    return {"variantes": variant_diff, "precios": price_diff}, stock_products, price_products
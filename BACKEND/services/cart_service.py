@@ -0,0 +1,241 @@
+# En BACKEND/services/cart_service.py
+
+import logging
+import os
+from datetime import datetime
+from typing import Optional
+
+from pydantic import ValidationError
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto
+from schemas import cart_schemas
+from services import stock_reservations
+
+logger = logging.getLogger(__name__)
+
+# Un carrito de invitado sin tocar durante este tiempo lo borra Mongo solo (índice TTL)
+GUEST_CART_TTL_DAYS = int(os.getenv("GUEST_CART_TTL_DAYS", 30))
+
+# Campos de un item tal como se guardan en Mongo; salen del schema para no desincronizarse
+ITEM_FIELDS = list(cart_schemas.CartItem.model_fields)
+
+
+def _literal(value):
+    """En un pipeline, un string que empieza con "$" se lee como campo: lo escapamos."""
+    if isinstance(value, str) and value.startswith("$"):
+        return {"$literal": value}
+    return value
+
+
+def _item_doc(item: cart_schemas.CartItem) -> dict:
+    return {key: _literal(value) for key, value in item.model_dump().items()}
+
+
+# --- Etapas de pipeline de update ---
+# Cada mutación del carrito es un solo find_one_and_update con un pipeline: Mongo
+# la aplica atómicamente sobre el documento y devuelve cómo quedó, sin ida y vuelta extra.
+
+def add_item_stage(item: cart_schemas.CartItem) -> dict:
+    """Si la variante ya está en el carrito suma la cantidad; si no, agrega el item al final."""
+    items = {"$ifNull": ["$items", []]}
+    bumped = {
+        **{field: f"$$it.{field}" for field in ITEM_FIELDS},
+        "quantity": {"$add": ["$$it.quantity", item.quantity]},
+    }
+    return {"$set": {"items": {"$cond": [
+        {"$in": [item.variante_id, {"$ifNull": ["$items.variante_id", []]}]},
+        {"$map": {"input": items, "as": "it", "in": {
+            "$cond": [{"$eq": ["$$it.variante_id", item.variante_id]}, bumped, "$$it"]
+        }}},
+        {"$concatArrays": [items, [_item_doc(item)]]},
+    ]}}}
+
+
+def _update_item_stage(variante_id: int, new_quantity) -> dict:
+    """Cambia la cantidad de una variante (si está) y saca las que quedan en 0 o menos."""
+    updated = {
+        **{field: f"$$it.{field}" for field in ITEM_FIELDS},
+        "quantity": new_quantity,
+    }
+    return {"$set": {"items": {"$filter": {
+        "input": {"$map": {"input": {"$ifNull": ["$items", []]}, "as": "it", "in": {
+            "$cond": [{"$eq": ["$$it.variante_id", variante_id]}, updated, "$$it"]
+        }}},
+        "as": "it",
+        "cond": {"$gt": ["$$it.quantity", 0]},
+    }}}}
+
+
+def set_quantity_stage(variante_id: int, quantity: int) -> dict:
+    return _update_item_stage(variante_id, quantity)
+
+
+def increment_stage(variante_id: int, delta: int) -> dict:
+    return _update_item_stage(variante_id, {"$add": ["$$it.quantity", delta]})
+
+
+def remove_item_stage(variante_id: int) -> dict:
+    return {"$set": {"items": {"$filter": {
+        "input": {"$ifNull": ["$items", []]},
+        "as": "it",
+        "cond": {"$ne": ["$$it.variante_id", variante_id]},
+    }}}}
+
+
+def clear_stage() -> dict:
+    return {"$set": {"items": {"$literal": []}}}
+
+
+def operation_stage(operation) -> dict:
+    """Una operación de PATCH /api/cart -> su etapa del pipeline."""
+    if operation.op == "add":
+        return add_item_stage(operation.item)
+    if operation.op == "set_quantity":
+        return set_quantity_stage(operation.variante_id, operation.quantity)
+    if operation.op == "increment":
+        return increment_stage(operation.variante_id, operation.delta)
+    if operation.op == "remove":
+        return remove_item_stage(operation.variante_id)
+    return clear_stage()
+
+
+def batch_pipeline(operations: list) -> list:
+    """Todas las operaciones, en orden, como un único pipeline (un solo update atómico)."""
+    return [operation_stage(op) for op in operations] + [touch_stage()]
+
+
+def touch_stage() -> dict:
+    return {"$set": {"last_updated": datetime.now()}}
+
+
+def to_cart(doc: Optional[dict], identifier: dict) -> cart_schemas.Cart:
+    """Documento de Mongo (o nada) -> Cart. Sin documento, el carrito vacío de esa sesión."""
+    if not doc:
+        return cart_schemas.Cart(**identifier, items=[], last_updated=datetime.now())
+    if "_id" in doc:
+        doc["_id"] = str(doc["_id"])
+    return cart_schemas.Cart(**doc)
+
+
+def guest_items(doc: Optional[dict]) -> list:
+    """Los items de un carrito de invitado que siguen siendo válidos (los rotos se descartan)."""
+    items = []
+    for raw in (doc or {}).get("items") or []:
+        try:
+            items.append(cart_schemas.CartItem.model_validate(raw))
+        except ValidationError:
+            logger.warning(f"Item inválido en el carrito de invitado {doc.get('guest_session_id')}: {raw!r}")
+    return items
+
+
+def merge_pipeline(items: list) -> list:
+    """Suma los items del invitado al carrito del usuario, todo en un único update."""
+    return [add_item_stage(item) for item in items] + [touch_stage()]
+
+
+# --- Índices de la colección carts ---
+# Parciales: los carritos de usuario no tienen guest_session_id y viceversa, y un
+# índice único común chocaría con los null. El TTL solo aplica a los de invitado.
+def _index_models() -> list:
+    return [
+        IndexModel([("user_id", ASCENDING)], name="ux_carts_user_id", unique=True,
+                   partialFilterExpression={"user_id": {"$type": "string"}}),
+        IndexModel([("guest_session_id", ASCENDING)], name="ux_carts_guest_session_id", unique=True,
+                   partialFilterExpression={"guest_session_id": {"$type": "string"}}),
+        IndexModel([("last_updated", ASCENDING)], name="ttl_carts_guest_last_updated",
+                   expireAfterSeconds=GUEST_CART_TTL_DAYS * 24 * 3600,
+                   partialFilterExpression={"guest_session_id": {"$type": "string"}}),
+    ]
+
+
+async def ensure_indexes(db) -> None:
+    """
+    Lo llama el lifespan al arrancar. create_index es idempotente; si cambió el
+    TTL (GUEST_CART_TTL_DAYS), el índice ya existe con otra opción y se ajusta con collMod.
+    Si algo falla se loguea y la API arranca igual: sin índices anda, solo más lento.
+    """
+    for model in _index_models():
+        spec = model.document
+        try:
+            await db.carts.create_indexes([model])
+        except PyMongoError as e:
+            if "expireAfterSeconds" in spec and getattr(e, "code", None) in (85, 86):  # IndexOptionsConflict / IndexKeySpecsConflict
+                try:
+                    await db.command("collMod", "carts", index={"name": spec["name"], "expireAfterSeconds": spec["expireAfterSeconds"]})
+                    continue
+                except PyMongoError as retry_error:
+                    e = retry_error
+            logger.error(f"No se pudo crear el índice {spec['name']} en carts: {e}")
+
+
+# --- Validación contra la base (checkout y /api/cart/validate) ---
+
+def validation_query(variante_ids: list, clave: Optional[str] = None):
+    """Variantes pedidas con su producto y su stock libre (stock - reservas vigentes de otros)."""
+    held = stock_reservations.held_scalar(VarianteProducto.id, excluir_clave=clave)
+    return (
+        select(
+            VarianteProducto.id,
+            VarianteProducto.cantidad_en_stock - held,
+            VarianteProducto.tamanio, VarianteProducto.color, Producto.id, Producto.nombre, Producto.precio,
+        )
+        .join(Producto, VarianteProducto.producto_id == Producto.id)
+        .where(VarianteProducto.id.in_(variante_ids))
+    )
+
+
+async def validate_items(db: AsyncSession, items: list, clave: Optional[str] = None) -> cart_schemas.CartValidation:
+    """
+    Resuelve todas las variantes del carrito en una sola query (IN + join al
+    producto y a las reservas vigentes). El precio sale siempre de la base; el que
+    trae el item solo se usa para avisar que cambió. El stock disponible es el de la
+    variante menos lo que otros checkouts tienen reservado (las reservas de `clave`,
+    el mismo comprador, no cuentan: su nuevo checkout las reemplaza). Junta todos los problemas
+    de stock en vez de cortar en el primero.
+    """
+    # Si la misma variante viene repetida, lo que importa es la cantidad total
+    requested: dict = {}
+    client_prices: dict = {}
+    for item in items:
+        requested[item.variante_id] = requested.get(item.variante_id, 0) + item.quantity
+        client_prices.setdefault(item.variante_id, item.price)
+
+    rows = {}
+    if requested:
+        result = await db.execute(validation_query(list(requested), clave))
+        rows = {row[0]: row for row in result.all()}
+
+    validated, errors = [], []
+    for variante_id, cantidad in requested.items():
+        row = rows.get(variante_id)
+        if row is None:
+            errors.append(cart_schemas.CartItemError(
+                variante_id=variante_id, error="no_existe", solicitado=cantidad,
+                mensaje=f"El item {variante_id} ya no existe.",
+            ))
+            continue
+        _, stock, tamanio, color, producto_id, nombre, precio = row
+        stock = max(stock, 0)
+        if stock < cantidad:
+            errors.append(cart_schemas.CartItemError(
+                variante_id=variante_id, error="stock_insuficiente", solicitado=cantidad, disponible=stock,
+                mensaje=f"Stock insuficiente para {nombre} ({tamanio}/{color}): pediste {cantidad}, quedan {stock}.",
+            ))
+            continue
+        precio = float(precio)
+        validated.append(cart_schemas.ValidatedItem(
+            variante_id=variante_id, producto_id=producto_id, nombre=nombre, tamanio=tamanio, color=color,
+            cantidad=cantidad, precio_unitario=precio, subtotal=precio * cantidad,
+            precio_cambio=client_prices[variante_id] != precio,
+        ))
+
+    return cart_schemas.CartValidation(
+        valido=not errors,
+        items=validated,
+        errores=errors,
+        total=sum(item.subtotal for item in validated),
+    )
@@ -0,0 +1,129 @@
+# En BACKEND/services/catalog_cache.py
+
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, FrozenSet, Hashable, Iterable, Optional
+
+from utils.cache import InstrumentedTTLCache
+
+# El catálogo cambia pocas veces por día y siempre por los endpoints de admin,
+# que invalidan acá. El TTL es solo la red de seguridad para los otros workers.
+CATALOG_CACHE_TTL_SECONDS = int(os.getenv("CATALOG_CACHE_TTL_SECONDS", 300))
+CATALOG_CACHE_MAX_PRODUCTS = int(os.getenv("CATALOG_CACHE_MAX_PRODUCTS", 5000))
+CATALOG_CACHE_MAX_LISTS = int(os.getenv("CATALOG_CACHE_MAX_LISTS", 1000))
+
+# Campos que deciden en qué listados aparece un producto y en qué orden.
+# Si un update no toca ninguno, alcanza con tirar los listados que lo contienen.
+LIST_MEMBERSHIP_FIELDS = {"nombre", "precio", "material", "talle", "color", "categoria_id"}
+
+
+@dataclass
+class CachedProduct:
+    """Detalle de un producto ya serializado, con sus validadores HTTP."""
+    payload: Any
+    etag: str
+    last_modified: Optional[datetime] = None
+    # (payload, etag) con las imágenes responsive, armado la primera vez que se pide
+    responsive: Optional[tuple] = None
+
+
+@dataclass
+class CachedList:
+    """Una página del listado ya serializada, con los ids que contiene."""
+    items: Any
+    product_ids: FrozenSet[int]
+    etag: str
+    last_modified: Optional[datetime] = None
+    headers: dict = field(default_factory=dict)
+    # Cuerpo ya serializado (y comprimido) por encoding, para no rehacerlo en cada hit
+    encoded: dict = field(default_factory=dict)
+
+
+_products = InstrumentedTTLCache(maxsize=CATALOG_CACHE_MAX_PRODUCTS, ttl=CATALOG_CACHE_TTL_SECONDS)
+_lists = InstrumentedTTLCache(maxsize=CATALOG_CACHE_MAX_LISTS, ttl=CATALOG_CACHE_TTL_SECONDS)
+# Sube con cada invalidación. El read-through lo toma antes de ir a la base y lo
+# devuelve al guardar: si en el medio se invalidó algo, lo que leyó puede ser
+# anterior a ese cambio y no se guarda (si no, quedaría viejo hasta el TTL).
+_generation = 0
+_skipped = 0
+
+
+# --- Lectura / escritura ---
+
+def generation() -> int:
+    return _generation
+
+
+def _is_stale(generation_read: Optional[int]) -> bool:
+    global _skipped
+    if generation_read is None or generation_read == _generation:
+        return False
+    _skipped += 1
+    return True
+
+
+def get_product(product_id: int) -> Optional[CachedProduct]:
+    return _products.lookup(product_id)
+
+
+def set_product(product_id: int, entry: CachedProduct, generation_read: Optional[int] = None):
+    if not _is_stale(generation_read):
+        _products[product_id] = entry
+
+
+def get_list(key: Hashable) -> Optional[CachedList]:
+    return _lists.lookup(key)
+
+
+def set_list(key: Hashable, entry: CachedList, generation_read: Optional[int] = None):
+    if not _is_stale(generation_read):
+        _lists[key] = entry
+
+
+# --- Invalidación (la llaman los endpoints que escriben el catálogo) ---
+
+def invalidate_products(product_ids: Iterable[int], membership_changed: bool = True):
+    """
+    Tira el detalle de cada producto y los listados afectados.
+    Con `membership_changed=False` (cambió stock, descripción, imágenes...)
+    solo se tiran las páginas que contienen alguno de esos productos; si no,
+    el producto pudo entrar, salir o moverse en cualquier listado y se tiran todos.
+    """
+    global _generation
+    _generation += 1
+    ids = set(product_ids)
+    for product_id in ids:
+        _products.invalidate(product_id)
+
+    if membership_changed:
+        invalidate_lists()
+        return
+    for key, entry in list(_lists.items()):
+        if entry.product_ids & ids:
+            _lists.invalidate(key)
+
+
+def invalidate_product(product_id: int, changed_fields: Optional[Iterable[str]] = None):
+    """Atajo para un solo producto; `changed_fields=None` significa "no sé qué cambió"."""
+    membership_changed = changed_fields is None or bool(LIST_MEMBERSHIP_FIELDS & set(changed_fields))
+    invalidate_products([product_id], membership_changed=membership_changed)
+
+
+def invalidate_lists():
+    global _generation
+    _generation += 1
+    for key in list(_lists.keys()):
+        _lists.invalidate(key)
+
+
+def stats() -> dict:
+    return {"products": _products.stats(), "lists": _lists.stats(), "descartadas_por_invalidacion": _skipped}
+
+
+def reset():
+    global _skipped
+    _skipped = 0
+    for cache in (_products, _lists):
+        cache.clear()
+        cache.hits = cache.misses = cache.evictions = cache.expirations = cache.invalidations = 0
@@ -0,0 +1,503 @@
+# En BACKEND/services/catalog_index.py
+
+import asyncio
+import bisect
+import heapq
+import logging
+import math
+import os
+import re
+import time
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cada worker tiene su propio índice. Los cambios hechos por el admin en este
+# proceso se aplican al toque; este máximo acota cuánto puede tardar en verlos
+# un worker que no recibió la escritura.
+INDEX_MAX_AGE_SECONDS = int(os.getenv("SEARCH_INDEX_MAX_AGE_SECONDS", 300))
+
+# Peso de cada campo al rankear: pegarle al nombre vale más que a la descripción.
+FIELD_WEIGHTS = {
+    "nombre": 3.0,
+    "material": 2.0,
+    "color": 2.0,
+    "talle": 2.0,
+    "descripcion": 1.0,
+}
+
+# Parámetros clásicos de BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+STOPWORDS = {
+    "a", "al", "con", "de", "del", "el", "en", "la", "las", "lo", "los",
+    "para", "por", "sin", "su", "un", "una", "y", "o",
+}
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Atributos con conteos por valor (facetas) para el panel de filtros
+FACET_FIELDS = ("material", "color", "talle", "categoria_id")
+
+
+def fold(text: str) -> str:
+    """Minúsculas y sin tildes: 'Algodón' -> 'algodon', 'Ñandú' -> 'nandu'."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def _stem(token: str) -> str:
+    # Stemming mínimo para plurales en castellano: remeras -> remera, pantalones -> pantalon
+    if len(token) > 4 and token.endswith("es"):
+        return token[:-2]
+    if len(token) > 3 and token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    if not text:
+        return []
+    return [_stem(t) for t in _TOKEN_RE.findall(fold(text)) if t not in STOPWORDS]
+
+
+@dataclass
+class _Doc:
+    """Lo mínimo de un producto que el índice necesita para filtrar y rankear."""
+    precio: float
+    categoria_id: Optional[int]
+    material: str
+    talle: str
+    color: str
+    length: float
+
+
+class CatalogIndex:
+    """
+    Índice invertido en memoria sobre el catálogo (término -> {producto_id: tf pesado}).
+    Se arma una vez desde la DB y después se mantiene con `upsert`/`remove`
+    desde los endpoints de admin, así las búsquedas nunca escanean la tabla.
+    """
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._rebuild_task: Optional[asyncio.Task] = None
+        self.reset()
+
+    def reset(self):
+        self._docs: Dict[int, _Doc] = {}
+        self._postings: Dict[str, Dict[int, float]] = {}
+        self._doc_terms: Dict[int, List[str]] = {}
+        self._total_length = 0.0
+        self._vocab: List[str] = []
+        self._vocab_dirty = False
+        # Facetas como bitmaps: cada producto ocupa un bit (su "slot") y cada valor de
+        # un atributo es un int con los bits de sus productos. Filtrar es AND/OR y
+        # contar es bit_count(), todo en C aunque el catálogo tenga 100k+ productos.
+        self._slots: Dict[int, int] = {}
+        self._free_slots: List[int] = []
+        self._facets: Dict[str, Dict[object, int]] = {field: {} for field in FACET_FIELDS}
+        self._labels: Dict[str, Dict[object, object]] = {field: {} for field in FACET_FIELDS}
+        # Bitmaps derivados del precio; se recalculan a demanda después de cada cambio
+        self._price_filters: Dict[float, int] = {}
+        self._price_buckets: Dict[int, Tuple[float, float, List[int]]] = {}
+        self._built_at: Optional[float] = None
+        # Mientras se reconstruye en otro hilo, anotamos los cambios para reaplicarlos
+        self._replay: Optional[List[Tuple[str, object]]] = None
+
+    @property
+    def ready(self) -> bool:
+        return self._built_at is not None
+
+    # --- Construcción ---
+
+    async def ensure_built(self, db: AsyncSession):
+        if not self.ready:
+            async with self._lock:
+                if not self.ready:
+                    await self._rebuild(db)
+        elif time.monotonic() - self._built_at > INDEX_MAX_AGE_SECONDS:
+            # Índice viejo: seguimos sirviendo el actual y lo refrescamos en segundo plano
+            # con una sesión propia (la del request se cierra al terminar).
+            if self._rebuild_task is None or self._rebuild_task.done():
+                self._rebuild_task = asyncio.create_task(self._background_rebuild())
+
+    async def _background_rebuild(self):
+        from database.database import AsyncSessionLocal
+        try:
+            async with self._lock:
+                async with AsyncSessionLocal() as db:
+                    await self._rebuild(db)
+        except Exception as e:
+            logger.error(f"Error al reconstruir el índice de búsqueda: {e}", exc_info=True)
+
+    async def _rebuild(self, db: AsyncSession):
+        started = time.monotonic()
+        # Se anota desde antes del SELECT: un cambio del admin mientras la query está
+        # en vuelo puede no salir en la foto, y reaplicarlo es idempotente
+        self._replay = []
+        fresh = CatalogIndex()
+        try:
+            result = await db.execute(select(
+                Producto.id, Producto.nombre, Producto.descripcion, Producto.material,
+                Producto.talle, Producto.color, Producto.precio, Producto.categoria_id,
+            ))
+            rows = result.all()
+            # Armamos la estructura nueva fuera del event loop y la intercambiamos al final
+            await asyncio.get_running_loop().run_in_executor(None, fresh._load_rows, rows)
+            replay, self._replay = self._replay, None
+        except BaseException:
+            self._replay = None
+            raise
+
+        for name, value in vars(fresh).items():
+            if name not in ("_lock", "_rebuild_task", "_replay"):
+                setattr(self, name, value)
+        self._built_at = time.monotonic()
+        for op, arg in replay:
+            if op == "upsert":
+                self.upsert(arg)
+            else:
+                self.remove(arg)
+        logger.info(f"Índice de búsqueda armado con {len(rows)} productos en {time.monotonic() - started:.2f}s")
+
+    def _load_rows(self, rows):
+        # En la carga masiva juntamos los slots y armamos cada bitmap de una sola vez
+        pending: Dict[Tuple[str, object], List[int]] = {}
+        for row in rows:
+            self._add(row, pending=pending)
+        for (field, key), slots in pending.items():
+            self._facets[field][key] = _bits(slots)
+        self._built_at = time.monotonic()
+
+    # --- Mantenimiento incremental ---
+
+    def upsert(self, producto):
+        """Agrega o reemplaza un producto (cualquier objeto con los atributos de `Producto`)."""
+        if self._replay is not None:
+            self._replay.append(("upsert", producto))
+        if not self.ready:
+            return  # Se va a indexar cuando se arme desde la DB
+        self._discard(producto.id)
+        self._add(producto)
+
+    def remove(self, product_id: int):
+        if self._replay is not None:
+            self._replay.append(("remove", product_id))
+        if self.ready:
+            self._discard(product_id)
+
+    def invalidate(self):
+        """Fuerza una reconstrucción completa en la próxima búsqueda (p. ej. tras una carga masiva)."""
+        self._built_at = None
+
+    def _add(self, producto, pending: Optional[dict] = None):
+        weighted: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokenize(getattr(producto, field)):
+                weighted[term] = weighted.get(term, 0.0) + weight
+
+        length = sum(weighted.values())
+        self._docs[producto.id] = _Doc(
+            precio=float(producto.precio),
+            categoria_id=producto.categoria_id,
+            material=fold(producto.material or ""),
+            talle=fold(producto.talle or ""),
+            color=fold(producto.color or ""),
+            length=length,
+        )
+        self._doc_terms[producto.id] = list(weighted)
+        self._total_length += length
+
+        slot = self._free_slots.pop() if self._free_slots else len(self._slots)
+        self._slots[producto.id] = slot
+        self._track_price(slot, float(producto.precio))
+        for field in FACET_FIELDS:
+            raw = getattr(producto, field)
+            if raw is None or raw == "":
+                continue
+            key = _facet_key(raw)
+            self._labels[field][key] = raw
+            if pending is not None:
+                pending.setdefault((field, key), []).append(slot)
+            else:
+                self._facets[field][key] = self._facets[field].get(key, 0) | (1 << slot)
+        for term, tf in weighted.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._vocab_dirty = True
+            postings[producto.id] = tf
+
+    def _track_price(self, slot: int, precio: float):
+        """Mantiene al día los bitmaps de precio ya calculados en vez de tirarlos."""
+        bit = 1 << slot
+        for precio_max in self._price_filters:
+            if precio <= precio_max:
+                self._price_filters[precio_max] |= bit
+        for buckets, (low, width, bucket_bits) in list(self._price_buckets.items()):
+            if width and low <= precio <= low + width * buckets:
+                bucket_bits[min(int((precio - low) / width), buckets - 1)] |= bit
+            else:
+                del self._price_buckets[buckets]  # Fuera de rango: se rearma en la próxima consulta
+
+    def _discard(self, product_id: int):
+        doc = self._docs.pop(product_id, None)
+        if doc is None:
+            return
+        self._total_length -= doc.length
+
+        slot = self._slots.pop(product_id)
+        self._free_slots.append(slot)
+        mask = ~(1 << slot)
+        self._price_filters = {precio: bits & mask for precio, bits in self._price_filters.items()}
+        for low, width, bucket_bits in self._price_buckets.values():
+            bucket_bits[:] = [bits & mask for bits in bucket_bits]
+        for field in FACET_FIELDS:
+            raw = doc.categoria_id if field == "categoria_id" else getattr(doc, field)
+            key = _facet_key(raw) if raw not in (None, "") else None
+            bits = self._facets[field].get(key)
+            if bits is not None:
+                bits &= mask
+                if bits:
+                    self._facets[field][key] = bits
+                else:
+                    del self._facets[field][key]
+                    self._labels[field].pop(key, None)
+        for term in self._doc_terms.pop(product_id, []):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+                    self._vocab_dirty = True
+
+    # --- Consulta ---
+
+    def _expand_prefix(self, prefix: str) -> List[str]:
+        if self._vocab_dirty:
+            self._vocab = sorted(self._postings)
+            self._vocab_dirty = False
+        start = bisect.bisect_left(self._vocab, prefix)
+        end = bisect.bisect_left(self._vocab, prefix + "\uffff")
+        return self._vocab[start:end]
+
+    def _predicate(self, filters):
+        """Mismos filtros que `get_products`, pero sobre los datos en memoria."""
+        material = fold(filters.material) if filters.material else None
+        talle = fold(filters.talle) if filters.talle else None
+        color = fold(filters.color) if filters.color else None
+        precio_max, categoria_id = filters.precio_max, filters.categoria_id
+
+        def check(doc: _Doc) -> bool:
+            if material and material not in doc.material: return False
+            if precio_max and doc.precio > precio_max: return False
+            if categoria_id and doc.categoria_id != categoria_id: return False
+            if talle and talle not in doc.talle: return False
+            if color and color not in doc.color: return False
+            return True
+        return check
+
+    def search(self, text: str, filters, skip: int = 0, limit: int = 10) -> Tuple[List[int], int]:
+        """
+        Devuelve (ids de la página ordenados por relevancia, total de resultados).
+        Todos los términos tienen que aparecer; el último se toma como prefijo
+        para que la caja de búsqueda funcione mientras el usuario escribe.
+        """
+        raw = _TOKEN_RE.findall(fold(text))
+        if not raw or not self._docs:
+            return [], 0
+
+        # Cada término de la consulta puede corresponder a varios del índice (prefijo)
+        exact = [_stem(t) for t in raw[:-1] if t not in STOPWORDS]
+        groups: List[List[str]] = [[t] if t in self._postings else [] for t in exact]
+        last = raw[-1]
+        prefix_group = set(self._expand_prefix(last))
+        if last not in STOPWORDS:
+            prefix_group |= {_stem(last)} & self._postings.keys()
+            if not prefix_group:
+                return [], 0
+        if prefix_group:
+            groups.append(sorted(prefix_group))
+        if not groups or any(not group for group in groups):
+            return [], 0
+
+        # Intersección arrancando por el grupo más chico
+        def group_ids(group):
+            ids = set()
+            for term in group:
+                ids.update(self._postings[term])
+            return ids
+
+        ordered = sorted(groups, key=lambda g: sum(len(self._postings[t]) for t in g))
+        candidates = group_ids(ordered[0])
+        for group in ordered[1:]:
+            if not candidates:
+                break
+            candidates &= group_ids(group)
+
+        check = self._predicate(filters)
+        candidates = [pid for pid in candidates if check(self._docs[pid])]
+        if not candidates:
+            return [], 0
+
+        n_docs = len(self._docs)
+        avg_length = self._total_length / n_docs if n_docs else 1.0
+        scores = dict.fromkeys(candidates, 0.0)
+        for group in groups:
+            for term in group:
+                postings = self._postings[term]
+                idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                # Recorremos lo más corto: la lista del término o los candidatos
+                if len(postings) < len(candidates):
+                    hits = ((pid, tf) for pid, tf in postings.items() if pid in scores)
+                else:
+                    hits = ((pid, postings[pid]) for pid in candidates if pid in postings)
+                for pid, tf in hits:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self._docs[pid].length / avg_length)
+                    scores[pid] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        # Solo ordenamos lo necesario para la página pedida
+        ranked = heapq.nsmallest(skip + limit, candidates, key=lambda pid: (-scores[pid], pid))
+        return ranked[skip:], len(candidates)
+
+    def _filter_bits(self, field: str, filters) -> Optional[int]:
+        """Bitmap de los productos que pasan el filtro de un campo, o None si no está activo."""
+        if field == "precio":
+            if not filters.precio_max:
+                return None
+            bits = self._price_filters.get(filters.precio_max)
+            if bits is None:
+                bits = _bits([self._slots[pid] for pid, doc in self._docs.items() if doc.precio <= filters.precio_max])
+                if len(self._price_filters) > 256:
+                    self._price_filters.clear()
+                self._price_filters[filters.precio_max] = bits
+            return bits
+        wanted = getattr(filters, field)
+        if not wanted:
+            return None
+        if field == "categoria_id":
+            return self._facets[field].get(wanted, 0)
+        # Igual que el ilike('%x%') del listado: alcanza con que el valor contenga lo buscado
+        needle = fold(wanted)
+        bits = 0
+        for key, key_bits in self._facets[field].items():
+            if needle in key:
+                bits |= key_bits
+        return bits
+
+    def _histogram(self, base: Optional[int], buckets: int) -> List[dict]:
+        # Los tramos se arman sobre el rango de precios de todo el catálogo y se cachean
+        # como bitmaps hasta el próximo cambio; así el slider no cambia de escala al filtrar.
+        cached = self._price_buckets.get(buckets)
+        if cached is None:
+            if not self._docs:
+                return []
+            low = min(doc.precio for doc in self._docs.values())
+            high = max(doc.precio for doc in self._docs.values())
+            width = (high - low) / buckets
+            slots: List[List[int]] = [[] for _ in range(buckets)]
+            for pid, doc in self._docs.items():
+                i = min(int((doc.precio - low) / width), buckets - 1) if width else 0
+                slots[i].append(self._slots[pid])
+            cached = self._price_buckets[buckets] = (low, width, [_bits(s) for s in slots])
+
+        low, width, bucket_bits = cached
+        return [
+            {
+                "desde": round(low + i * width, 2),
+                "hasta": round(low + (i + 1) * width, 2),
+                "cantidad": bits.bit_count() if base is None else (bits & base).bit_count(),
+            }
+            for i, bits in enumerate(bucket_bits)
+        ]
+
+    def facets(self, filters, price_buckets: int = 5) -> dict:
+        """
+        Conteos por material, color, talle y categoría, más un histograma de precios.
+        Cada faceta se cuenta aplicando todos los filtros menos el suyo, así el
+        panel puede mostrar cuántos productos suma elegir otro valor del mismo campo.
+        """
+        active = {}
+        for field in FACET_FIELDS + ("precio",):
+            bits = self._filter_bits(field, filters)
+            if bits is not None:
+                active[field] = bits
+
+        def base_without(excluded: Optional[str]) -> Optional[int]:
+            base = None
+            for field, bits in active.items():
+                if field != excluded:
+                    base = bits if base is None else base & bits
+            return base  # None = sin filtros, todo el catálogo
+
+        result = {}
+        for field in FACET_FIELDS:
+            base = base_without(field)
+            counts = []
+            for key, bits in self._facets[field].items():
+                count = bits.bit_count() if base is None else (bits & base).bit_count()
+                if count:
+                    counts.append({"valor": self._labels[field][key], "cantidad": count})
+            counts.sort(key=lambda c: (-c["cantidad"], str(c["valor"])))
+            result[field] = counts
+
+        matching = base_without(None)
+        result["total"] = len(self._docs) if matching is None else matching.bit_count()
+        # El histograma ignora el tope de precio para que se vea todo el rango
+        result["precio"] = self._histogram(base_without("precio"), price_buckets)
+        return result
+
+
+def _facet_key(raw):
+    return fold(raw).strip() if isinstance(raw, str) else raw
+
+
+def _bits(slots: List[int]) -> int:
+    """Arma un bitmap con los slots dados sin ir haciendo OR de a uno (que copia el int cada vez)."""
+    if not slots:
+        return 0
+    buf = bytearray((max(slots) >> 3) + 1)
+    for slot in slots:
+        buf[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buf, "little")
+
+
+_index = CatalogIndex()
+
+
+# --- API del servicio ---
+
+async def search(db: AsyncSession, text: str, filters, skip: int = 0, limit: int = 10) -> Tuple[List[int], int]:
+    await _index.ensure_built(db)
+    return _index.search(text, filters, skip=skip, limit=limit)
+
+
+async def facets(db: AsyncSession, filters, price_buckets: int = 5) -> dict:
+    await _index.ensure_built(db)
+    return _index.facets(filters, price_buckets=price_buckets)
+
+
+def index_product(producto):
+    _index.upsert(producto)
+
+
+def remove_product(product_id: int):
+    _index.remove(product_id)
+
+
+def invalidate():
+    _index.invalidate()
+
+
+def reset():
+    _index.reset()
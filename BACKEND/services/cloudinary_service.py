@@ -1,11 +1,31 @@
 # En BACKEND/services/cloudinary_service.py
 
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
 import cloudinary
+import cloudinary.exceptions
 import cloudinary.uploader
-import os
+import cloudinary.utils
+import urllib3.exceptions
 from dotenv import load_dotenv
 from fastapi import HTTPException, UploadFile, status
-from typing import List
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import ImagenSubida
+
+logger = logging.getLogger(__name__)
 
 # Carga las variables de entorno del .env
 load_dotenv()
@@ -19,27 +39,265 @@ cloudinary.config(
     secure=True # Para que siempre devuelva URLs https
 )
 
-async def upload_images(files: List[UploadFile]) -> List[str]:
+UPLOAD_FOLDER = "void_ecommerce_products" # Carpeta dentro de Cloudinary
+
+# El SDK de Cloudinary es bloqueante: cada subida corre en un hilo de este pool
+# y el event loop sigue atendiendo al resto de los clientes. El tope de hilos
+# es también el tope de subidas simultáneas de todo el proceso.
+UPLOAD_WORKERS = int(os.getenv("CLOUDINARY_UPLOAD_WORKERS", 4))
+# El corte lo hace el SDK (`timeout` de la conexión) y llega como error desde el
+# hilo. No hay wait_for del lado async: el hilo seguiría leyendo el archivo
+# mientras el reintento lo rebobina desde otro hilo.
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("CLOUDINARY_UPLOAD_TIMEOUT_SECONDS", 30))
+UPLOAD_MAX_ATTEMPTS = int(os.getenv("CLOUDINARY_UPLOAD_MAX_ATTEMPTS", 3))
+UPLOAD_BACKOFF_SECONDS = float(os.getenv("CLOUDINARY_UPLOAD_BACKOFF_SECONDS", 0.5))
+# Desde este tamaño se sube por partes (upload_large) en vez de mandar el archivo entero
+LARGE_FILE_BYTES = int(os.getenv("CLOUDINARY_LARGE_FILE_BYTES", 10 * 1024 * 1024))
+LARGE_CHUNK_BYTES = 6 * 1024 * 1024
+HASH_CHUNK_BYTES = 1024 * 1024
+
+# La API de subida no usa las subclases de cloudinary.exceptions: todo llega como el
+# Error base. Un timeout o un corte de red viene envuelto ("Unexpected error -
+# ReadTimeoutError..." / "Socket error...") con la excepción de urllib3 como
+# __context__; un 5xx que no es JSON (el HTML de un gateway) trae el status en el
+# mensaje; un rate limit, solo el mensaje.
+TRANSIENT_CAUSES = (urllib3.exceptions.HTTPError, OSError)
+TRANSIENT_STATUS = re.compile(r"^Error parsing server response \((5\d\d|420|429)\)")
+RATE_LIMITED = re.compile(r"rate limit|too many requests", re.IGNORECASE)
+
+_executor = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="cloudinary-upload")
+
+
+class _KeepOpen:
+    """upload_large cierra el archivo al terminar; así lo podemos rebobinar para reintentar."""
+
+    def __init__(self, stream: BinaryIO, name: Optional[str]):
+        self._stream = stream
+        self.name = name
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        return self._stream.seek(offset, whence)
+
+    def tell(self) -> int:
+        return self._stream.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def _file_size(stream: BinaryIO) -> int:
+    stream.seek(0, os.SEEK_END)
+    size = stream.tell()
+    stream.seek(0)
+    return size
+
+
+def _upload_sync(stream: BinaryIO, filename: Optional[str]) -> dict:
+    """Corre en el pool. Le pasamos el archivo (spooleado a disco por FastAPI), no sus bytes."""
+    stream.seek(0)
+    options = dict(folder=UPLOAD_FOLDER, resource_type="image", timeout=UPLOAD_TIMEOUT_SECONDS)
+    if _file_size(stream) >= LARGE_FILE_BYTES:
+        return cloudinary.uploader.upload_large(_KeepOpen(stream, filename), chunk_size=LARGE_CHUNK_BYTES, **options)
+    return cloudinary.uploader.upload(stream, **options)
+
+
+async def _run_in_pool(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, partial(func, *args))
+
+
+def _is_retryable(error: Exception) -> bool:
     """
-    Sube una lista de archivos a Cloudinary y devuelve sus URLs seguras.
+    ¿Vale la pena reintentar? Sí para timeouts, cortes de red, 5xx y rate limits;
+    no para lo que es culpa del pedido (imagen inválida, credenciales...).
+    Todo sale del SDK, o sea que el intento anterior ya terminó de leer el archivo.
     """
-    uploaded_urls = []
-    for file in files:
+    if isinstance(error, (cloudinary.exceptions.GeneralError, cloudinary.exceptions.RateLimited, OSError)):
+        return True
+    if not isinstance(error, cloudinary.exceptions.Error):
+        return False
+    if isinstance(error.__cause__ or error.__context__, TRANSIENT_CAUSES):
+        return True
+    message = str(error)
+    return bool(TRANSIENT_STATUS.match(message) or RATE_LIMITED.search(message))
+
+
+async def _upload_one(file: UploadFile) -> dict:
+    for attempt in range(1, UPLOAD_MAX_ATTEMPTS + 1):
         try:
-            # La magia de verdad pasa acá. `upload` es una función bloqueante,
-            # pero para este caso de uso inicial no necesitamos complicarnos con hilos.
-            # FastAPI es lo suficientemente inteligente para manejarlo bien.
-            upload_result = cloudinary.uploader.upload(
-                file.file,
-                folder="void_ecommerce_products", # Carpeta dentro de Cloudinary
-                resource_type="image"
-            )
-            # De la respuesta de Cloudinary, solo nos interesa la URL segura
-            uploaded_urls.append(upload_result.get("secure_url"))
+            return await _run_in_pool(_upload_sync, file.file, file.filename)
         except Exception as e:
+            if attempt == UPLOAD_MAX_ATTEMPTS or not _is_retryable(e):
+                raise
+            delay = UPLOAD_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+            logger.warning(f"Falló la subida de '{file.filename}' (intento {attempt}): {e!r}. Reintento en {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def _discard_uploaded(results: list):
+    """Si una imagen no se pudo subir, borramos las que sí subieron para no dejar huérfanas."""
+    for result in results:
+        if isinstance(result, dict) and result.get("public_id"):
+            try:
+                await _run_in_pool(cloudinary.uploader.destroy, result["public_id"])
+            except Exception as e:
+                logger.error(f"No se pudo borrar la imagen huérfana {result['public_id']}: {e}")
+
+
+# --- Deduplicación por contenido ---
+
+def _content_hash(stream: BinaryIO) -> Tuple[str, int]:
+    """sha256 leyendo de a bloques (el archivo puede estar en disco y ser grande)."""
+    stream.seek(0)
+    digest, size = hashlib.sha256(), 0
+    for block in iter(lambda: stream.read(HASH_CHUNK_BYTES), b""):
+        digest.update(block)
+        size += len(block)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+async def _known_images(db: AsyncSession, hashes: List[str]) -> Dict[str, ImagenSubida]:
+    result = await db.execute(select(ImagenSubida).where(ImagenSubida.sha256.in_(hashes)))
+    return {img.sha256: img for img in result.scalars().all()}
+
+
+async def _record_images(db: AsyncSession, reused: List[str], uploaded: List[dict]):
+    if reused:
+        await db.execute(
+            update(ImagenSubida)
+            .where(ImagenSubida.sha256.in_(reused))
+            .values(usos=ImagenSubida.usos + 1, ultimo_uso_en=func.now())
+        )
+    for entry in uploaded:
+        try:
+            async with db.begin_nested():
+                db.add(ImagenSubida(**entry))
+        except IntegrityError:
+            pass  # Otro request subió el mismo contenido justo ahora; su fila vale igual
+    await db.commit()
+
+
+async def upload_images(files: List[UploadFile], db: Optional[AsyncSession] = None) -> List[str]:
+    """
+    Sube una lista de archivos a Cloudinary y devuelve sus URLs seguras, en el
+    mismo orden. Las subidas van en paralelo, así que tarda lo que la más lenta.
+    Con `db`, antes de subir se busca cada archivo por hash de contenido: si esa
+    misma foto ya se subió alguna vez, se reutiliza la URL y no se sube de nuevo.
+    """
+    if db is None:
+        return await _upload_all(files)
+
+    hashes = await asyncio.gather(*(_run_in_pool(_content_hash, file.file) for file in files))
+    known = await _known_images(db, [sha for sha, _ in hashes])
+
+    # Un archivo repetido dentro del mismo pedido también se sube una sola vez
+    pending: Dict[str, UploadFile] = {}
+    for file, (sha, _) in zip(files, hashes):
+        if sha not in known and sha not in pending:
+            pending[sha] = file
+    uploaded_urls = dict(zip(pending, await _upload_all(list(pending.values()), keep_results=True)))
+
+    urls = [known[sha].url if sha in known else uploaded_urls[sha]["secure_url"] for sha, _ in hashes]
+    sizes = dict(hashes)
+    await _record_images(
+        db,
+        reused=list({sha for sha, _ in hashes if sha in known}),
+        uploaded=[
+            {"sha256": sha, "public_id": result.get("public_id"), "url": result["secure_url"], "bytes": sizes[sha]}
+            for sha, result in uploaded_urls.items()
+        ],
+    )
+    return urls
+
+
+async def _upload_all(files: List[UploadFile], keep_results: bool = False) -> list:
+    results = await asyncio.gather(*(_upload_one(file) for file in files), return_exceptions=True)
+
+    for file, result in zip(files, results):
+        if isinstance(result, BaseException):
             # Si una imagen falla, paramos todo y avisamos
+            await _discard_uploaded(results)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail=f"Error al subir la imagen '{file.filename}': {e}"
+                detail=f"Error al subir la imagen '{file.filename}': {result}"
             )
-    return uploaded_urls
\ No newline at end of file
+    if keep_results:
+        return results
+    # De la respuesta de Cloudinary, solo nos interesa la URL segura
+    return [result.get("secure_url") for result in results]
+
+
+async def prune_image_index(db: AsyncSession, referenced_urls: set, unused_days: int, destroy: bool = False) -> List[ImagenSubida]:
+    """
+    Borra del índice las imágenes que ningún producto usa y que no se pidieron
+    en los últimos `unused_days` días. Con `destroy` también se borran de Cloudinary.
+    """
+    # ultimo_uso_en lo pone la base (NOW(), en la zona de su sesión): el corte se
+    # calcula con el mismo reloj, como los vencimientos del inbox de webhooks
+    now = (await db.execute(select(func.now()))).scalar_one()
+    cutoff = now - timedelta(days=unused_days)
+    result = await db.execute(select(ImagenSubida).where(ImagenSubida.ultimo_uso_en < cutoff))
+    stale = [img for img in result.scalars().all() if img.url not in referenced_urls]
+    for img in stale:
+        await db.delete(img)
+    await db.commit()
+
+    if destroy:
+        for img in stale:
+            try:
+                await _run_in_pool(cloudinary.uploader.destroy, img.public_id)
+            except Exception as e:
+                logger.error(f"No se pudo borrar {img.public_id} de Cloudinary: {e}")
+    return stale
+
+
+# --- Subida directa desde el navegador (firmada) ---
+# El front sube el archivo directo a Cloudinary con estos parámetros y después
+# nos manda solo public_id/version/signature: los bytes nunca pasan por la API.
+SIGNED_UPLOAD_ALLOWED_FORMATS = "jpg,jpeg,png,webp"
+# Cloudinary rechaza firmas con timestamp de más de 1 hora; es lo más corto que permite
+SIGNED_UPLOAD_TTL_SECONDS = 3600
+
+
+def signed_upload_params() -> dict:
+    """Parámetros firmados que solo sirven para subir imágenes a la carpeta de productos."""
+    config = cloudinary.config()
+    timestamp = int(time.time())
+    params_to_sign = {
+        "timestamp": timestamp,
+        "folder": UPLOAD_FOLDER,
+        "allowed_formats": SIGNED_UPLOAD_ALLOWED_FORMATS,
+    }
+    return {
+        **params_to_sign,
+        "signature": cloudinary.utils.api_sign_request(params_to_sign, config.api_secret),
+        "api_key": config.api_key,
+        "cloud_name": config.cloud_name,
+        "upload_url": f"https://api.cloudinary.com/v1_1/{config.cloud_name}/image/upload",
+        "expires_at": timestamp + SIGNED_UPLOAD_TTL_SECONDS,
+    }
+
+
+def verified_image_url(public_id: str, version: int, signature: str) -> str:
+    """
+    Chequea que la respuesta de Cloudinary que nos reenvía el front sea auténtica
+    (firma sobre public_id + version) y que la imagen esté en nuestra carpeta.
+    Devuelve la URL segura de esa versión.
+    """
+    if not public_id.startswith(f"{UPLOAD_FOLDER}/"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"La imagen '{public_id}' no está en la carpeta de productos.")
+    if not cloudinary.utils.verify_api_response_signature(public_id, version, signature):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"La firma de la imagen '{public_id}' no es válida.")
+    url, _ = cloudinary.utils.cloudinary_url(public_id, version=version, secure=True, resource_type="image", type="upload")
+    return url
+
+
+def shutdown():
+    """Lo llama el lifespan al apagar: espera a que terminen las subidas en curso."""
+    _executor.shutdown(wait=True)
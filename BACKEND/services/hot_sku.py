@@ -0,0 +1,270 @@
+# En BACKEND/services/hot_sku.py
+
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import AsyncSessionLocal
+from database.models import DescuentoFlash, VarianteProducto
+
+logger = logging.getLogger(__name__)
+
+# Modo "flash sale": en un lanzamiento casi todas las órdenes pegan contra la misma
+# variante y cada una espera el lock de esa fila. Para las variantes marcadas acá
+# (HOT_SKU_VARIANT_IDS="12,15"), los descuentos se encolan en memoria y cada
+# ventana de HOT_SKU_WINDOW_MS se aplican todos juntos: un lock y un UPDATE por
+# ventana en vez de uno por orden. Cada orden recibe su propio sí/no.
+#
+# El descuento se commitea antes que la orden. Para no perder unidades si el
+# proceso se cae entre los dos commits, cada descuento deja una fila en
+# descuentos_flash (misma transacción) que la orden borra en la suya (`confirm`).
+# Las que quedan más de HOT_SKU_RECONCILE_AFTER_SECONDS las devuelve `reconcile`,
+# que corre al arrancar y después cada HOT_SKU_RECONCILE_EVERY_SECONDS (un restore
+# que falló, un worker que se murió mientras los demás siguen andando).
+HOT_SKU_VARIANT_IDS: Set[int] = {int(v) for v in os.getenv("HOT_SKU_VARIANT_IDS", "").split(",") if v.strip()}
+HOT_SKU_WINDOW_MS = float(os.getenv("HOT_SKU_WINDOW_MS", 10))
+HOT_SKU_MAX_BATCH = int(os.getenv("HOT_SKU_MAX_BATCH", 500))
+# Una orden tarda milisegundos entre el descuento y su commit; esto es holgadísimo
+HOT_SKU_RECONCILE_AFTER_SECONDS = int(os.getenv("HOT_SKU_RECONCILE_AFTER_SECONDS", 300))
+HOT_SKU_RECONCILE_EVERY_SECONDS = float(os.getenv("HOT_SKU_RECONCILE_EVERY_SECONDS", 60))
+
+
+class VentanaFallida(Exception):
+    """
+    La ventana no se pudo escribir (deadlock, conexión caída...) o su descuento ya
+    no está para confirmar. No dice nada del stock: la orden se puede reintentar.
+    """
+
+
+@dataclass
+class _Pedido:
+    cantidad: int
+    lote: str
+    payment_id: Optional[str]
+    future: asyncio.Future
+
+
+@dataclass
+class _Queue:
+    pending: List[_Pedido] = field(default_factory=list)
+    flusher: Optional[asyncio.Task] = None
+    # La próxima ventana junta pedidos mientras esta escribe, pero aplica después
+    writing: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+_queues: Dict[int, _Queue] = {}
+_task: Optional[asyncio.Task] = None
+_counters = {
+    "ventanas": 0, "ventanas_fallidas": 0, "pedidos": 0, "aceptados": 0, "rechazados": 0,
+    "devueltos": 0, "reconciliados": 0, "max_por_ventana": 0,
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def is_hot(variante_id: int) -> bool:
+    return variante_id in HOT_SKU_VARIANT_IDS
+
+
+async def decrement(variante_id: int, cantidad: int, lote: str, payment_id: Optional[str] = None, session_factory=None) -> Tuple[bool, Optional[int]]:
+    """
+    Pide descontar `cantidad` de una variante en modo flash. Espera a que cierre la
+    ventana y devuelve (aceptado, producto_id). El descuento ya quedó commiteado a
+    nombre de `lote`: la orden lo confirma con `confirm` o lo devuelve con `restore`.
+    Si la ventana no se pudo escribir, levanta VentanaFallida.
+    """
+    queue = _queues.setdefault(variante_id, _Queue())
+    future = asyncio.get_running_loop().create_future()
+    queue.pending.append(_Pedido(cantidad, lote, payment_id, future))
+    _counters["pedidos"] += 1
+    if queue.flusher is None:
+        queue.flusher = asyncio.create_task(_flush_after_window(variante_id, queue, session_factory or AsyncSessionLocal))
+    return await future
+
+
+async def _flush_after_window(variante_id: int, queue: _Queue, session_factory):
+    await asyncio.sleep(HOT_SKU_WINDOW_MS / 1000)
+    batch, queue.pending = queue.pending[:HOT_SKU_MAX_BATCH], queue.pending[HOT_SKU_MAX_BATCH:]
+    # Lo que llegue desde ahora va a la próxima ventana, mientras esta escribe
+    queue.flusher = asyncio.create_task(_flush_after_window(variante_id, queue, session_factory)) if queue.pending else None
+
+    try:
+        async with queue.writing:
+            granted, producto_id = await _apply(session_factory, variante_id, batch)
+    except Exception as e:
+        logger.error(f"Falló la ventana de la variante caliente {variante_id}: {e!r}")
+        _counters["ventanas_fallidas"] += 1
+        for pedido in batch:
+            if not pedido.future.done():
+                error = VentanaFallida(f"No se pudo descontar la variante {variante_id}: {e!r}")
+                error.__cause__ = e
+                pedido.future.set_exception(error)
+        return
+
+    _counters["ventanas"] += 1
+    _counters["max_por_ventana"] = max(_counters["max_por_ventana"], len(batch))
+    for ok, pedido in zip(granted, batch):
+        _counters["aceptados" if ok else "rechazados"] += 1
+        if not pedido.future.done():
+            pedido.future.set_result((ok, producto_id))
+
+
+async def _apply(session_factory, variante_id: int, batch: List[_Pedido]) -> Tuple[List[bool], Optional[int]]:
+    """
+    Un lock y un UPDATE para toda la ventana. Se reparte en orden de llegada: a cada
+    pedido se le da lo suyo mientras alcance; el que no entra se rechaza sin frenar a los demás.
+    Lo concedido queda anotado en descuentos_flash en la misma transacción.
+    """
+    async with session_factory() as db:
+        try:
+            row = (await db.execute(
+                select(VarianteProducto.cantidad_en_stock, VarianteProducto.producto_id)
+                .where(VarianteProducto.id == variante_id)
+                .with_for_update()
+            )).one_or_none()
+            if row is None:
+                return [False] * len(batch), None
+            stock, producto_id = row
+
+            granted, remaining = [], stock
+            for pedido in batch:
+                ok = pedido.cantidad <= remaining
+                remaining -= pedido.cantidad if ok else 0
+                granted.append(ok)
+
+            total = stock - remaining
+            if total:
+                result = await db.execute(
+                    update(VarianteProducto)
+                    .where(VarianteProducto.id == variante_id, VarianteProducto.cantidad_en_stock >= total)
+                    .values(cantidad_en_stock=VarianteProducto.cantidad_en_stock - total)
+                    .execution_options(synchronize_session=False)
+                )
+                if result.rowcount != 1:
+                    # Sin FOR UPDATE real alguien escribió en el medio (un descuento fuera del modo flash)
+                    raise RuntimeError(f"El stock de la variante {variante_id} cambió durante la ventana")
+                now = _now()
+                await db.execute(insert(DescuentoFlash), [
+                    {"lote": p.lote, "payment_id": p.payment_id, "variante_id": variante_id, "cantidad": p.cantidad, "creado_en": now}
+                    for p, ok in zip(batch, granted) if ok
+                ])
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+    return granted, producto_id
+
+
+async def confirm(db: AsyncSession, lote: str, variantes: int):
+    """
+    Dentro de la transacción de la orden: las unidades del lote pasan a ser de la
+    orden. Si la reconciliación ya las devolvió, la orden no puede seguir.
+    """
+    result = await db.execute(delete(DescuentoFlash).where(DescuentoFlash.lote == lote))
+    if result.rowcount != variantes:
+        raise VentanaFallida(f"El descuento flash {lote} ya no está pendiente (¿se reconcilió?)")
+
+
+async def restore(lote: str, session_factory=None) -> int:
+    """
+    Devuelve al stock lo que se descontó para una orden que al final no se guardó.
+    Borrar la anotación y sumar el stock van juntos: no se devuelve dos veces.
+    """
+    async with (session_factory or AsyncSessionLocal)() as db:
+        rows = (await db.execute(
+            select(DescuentoFlash.id, DescuentoFlash.variante_id, DescuentoFlash.cantidad)
+            .where(DescuentoFlash.lote == lote)
+            .with_for_update()
+        )).all()
+        if not rows:
+            return 0
+        cantidades: Dict[int, int] = {}
+        for _, variante_id, cantidad in rows:
+            cantidades[variante_id] = cantidades.get(variante_id, 0) + cantidad
+        deleted = await db.execute(delete(DescuentoFlash).where(DescuentoFlash.id.in_([row[0] for row in rows])))
+        if deleted.rowcount != len(rows):
+            await db.rollback()  # Otro (la orden o la reconciliación) se lo llevó primero
+            return 0
+        await db.execute(
+            update(VarianteProducto)
+            .where(VarianteProducto.id.in_(sorted(cantidades)))
+            .values(cantidad_en_stock=VarianteProducto.cantidad_en_stock + case(cantidades, value=VarianteProducto.id))
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    _counters["devueltos"] += len(cantidades)
+    return len(cantidades)
+
+
+async def reconcile(session_factory=None) -> int:
+    """
+    Devuelve las unidades de descuentos que nunca llegaron a ser orden (el proceso
+    se cayó entre el descuento y la orden, o la devolución falló). Lo corre
+    run_reconciler en segundo plano.
+    """
+    factory = session_factory or AsyncSessionLocal
+    cutoff = _now() - timedelta(seconds=HOT_SKU_RECONCILE_AFTER_SECONDS)
+    async with factory() as db:
+        lotes = (await db.execute(
+            select(DescuentoFlash.lote, DescuentoFlash.payment_id).where(DescuentoFlash.creado_en < cutoff).distinct()
+        )).all()
+    total = 0
+    for lote, payment_id in lotes:
+        restored = await restore(lote, factory)
+        if restored:
+            logger.warning(f"Se devolvieron al stock {restored} variantes del descuento flash huérfano {lote} (pago {payment_id}).")
+            total += restored
+    _counters["reconciliados"] += total
+    return total
+
+
+async def run_reconciler(session_factory=None):
+    while True:
+        try:
+            await reconcile(session_factory)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error reconciliando descuentos flash: {e!r}", exc_info=True)
+        await asyncio.sleep(HOT_SKU_RECONCILE_EVERY_SECONDS)
+
+
+def start():
+    """Lo llama el lifespan al arrancar; la primera pasada es inmediata."""
+    global _task
+    _task = asyncio.create_task(run_reconciler(), name="hot-sku-reconciler")
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    ventanas = _counters["ventanas"]
+    return {
+        **_counters,
+        "variantes": sorted(HOT_SKU_VARIANT_IDS),
+        "window_ms": HOT_SKU_WINDOW_MS,
+        "promedio_por_ventana": round((_counters["aceptados"] + _counters["rechazados"]) / ventanas, 2) if ventanas else 0.0,
+    }
+
+
+def reset():
+    for key in _counters:
+        _counters[key] = 0
+    _queues.clear()
@@ -0,0 +1,144 @@
+# En BACKEND/services/mercadopago_client.py
+
+import asyncio
+import logging
+import os
+import random
+import uuid
+from typing import Optional
+
+import httpx
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# El SDK oficial es sincrónico (requests): cada llamada frenaba el event loop
+# cientos de ms. Este adaptador habla la misma API REST con un httpx.AsyncClient
+# compartido, así las conexiones se reutilizan (keep-alive) entre requests.
+MERCADOPAGO_API_URL = os.getenv("MERCADOPAGO_API_URL", "https://api.mercadopago.com")
+MERCADOPAGO_CONNECT_TIMEOUT_SECONDS = float(os.getenv("MERCADOPAGO_CONNECT_TIMEOUT_SECONDS", 3))
+MERCADOPAGO_READ_TIMEOUT_SECONDS = float(os.getenv("MERCADOPAGO_READ_TIMEOUT_SECONDS", 10))
+MERCADOPAGO_MAX_CONNECTIONS = int(os.getenv("MERCADOPAGO_MAX_CONNECTIONS", 20))
+MERCADOPAGO_MAX_ATTEMPTS = int(os.getenv("MERCADOPAGO_MAX_ATTEMPTS", 3))
+MERCADOPAGO_BACKOFF_SECONDS = float(os.getenv("MERCADOPAGO_BACKOFF_SECONDS", 0.3))
+
+# Respuestas que indican un problema del lado de MP y que vale la pena reintentar
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Cuánto del cuerpo de una respuesta que no es JSON se guarda en el error
+ERROR_BODY_CHARS = 200
+
+
+class MercadoPagoError(Exception):
+    """MP respondió con error (o no respondió). `status_code` es None si ni siquiera hubo respuesta."""
+
+    def __init__(self, message: str, status_code: Optional[int] = None, payload: Optional[dict] = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        self.payload = payload or {}
+
+
+def _decode(response: httpx.Response) -> dict:
+    """
+    El JSON de la respuesta. Si no es JSON (la página de error de un proxy o un
+    balanceador) es un MercadoPagoError con el status y el principio del cuerpo.
+    """
+    if not response.content:
+        return {}
+    try:
+        return response.json()
+    except ValueError:
+        body = response.text[:ERROR_BODY_CHARS]
+        raise MercadoPagoError(f"Mercado Pago respondió {response.status_code} sin JSON: {body}", response.status_code, {"body": body})
+
+
+class MercadoPagoClient:
+    def __init__(self, access_token: Optional[str], base_url: str = MERCADOPAGO_API_URL, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self._http = httpx.AsyncClient(
+            base_url=base_url,
+            headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
+            timeout=httpx.Timeout(
+                MERCADOPAGO_READ_TIMEOUT_SECONDS,
+                connect=MERCADOPAGO_CONNECT_TIMEOUT_SECONDS,
+                pool=MERCADOPAGO_CONNECT_TIMEOUT_SECONDS,
+            ),
+            limits=httpx.Limits(max_connections=MERCADOPAGO_MAX_CONNECTIONS, max_keepalive_connections=MERCADOPAGO_MAX_CONNECTIONS),
+            transport=transport,
+        )
+
+    async def _request(self, method: str, path: str, idempotent: bool, **kwargs) -> dict:
+        """
+        Solo se reintenta lo que es seguro repetir: GETs y POSTs con X-Idempotency-Key.
+        Un POST sin clave se reintenta únicamente si no llegó a conectar (MP nunca lo recibió).
+        """
+        for attempt in range(1, MERCADOPAGO_MAX_ATTEMPTS + 1):
+            last_attempt = attempt == MERCADOPAGO_MAX_ATTEMPTS
+            try:
+                response = await self._http.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+                error = MercadoPagoError(f"No se pudo conectar con Mercado Pago: {e!r}")
+            except httpx.TransportError as e:
+                error = MercadoPagoError(f"Mercado Pago no respondió: {e!r}")
+                if not idempotent:
+                    raise error from e
+            else:
+                try:
+                    payload = _decode(response)
+                except MercadoPagoError as decode_error:
+                    error = decode_error
+                else:
+                    if response.is_success:
+                        return payload
+                    error = MercadoPagoError(payload.get("message") or response.reason_phrase, response.status_code, payload)
+                if response.status_code not in RETRYABLE_STATUS or not idempotent:
+                    raise error
+
+            if last_attempt:
+                raise error
+            delay = MERCADOPAGO_BACKOFF_SECONDS * 2 ** (attempt - 1) * random.uniform(0.8, 1.2)
+            logger.warning(f"{method} {path} a Mercado Pago falló (intento {attempt}): {error.message}. Reintento en {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def create_preference(self, data: dict, idempotency_key: Optional[str] = None) -> dict:
+        key = idempotency_key or str(uuid.uuid4())
+        return await self._request("POST", "/checkout/preferences", idempotent=True, json=data, headers={"X-Idempotency-Key": key})
+
+    async def get_payment(self, payment_id) -> dict:
+        return await self._request("GET", f"/v1/payments/{payment_id}", idempotent=True)
+
+    async def create_payment(self, data: dict, idempotency_key: str) -> dict:
+        # Con la misma clave MP devuelve el pago ya creado en vez de cobrar dos veces
+        return await self._request("POST", "/v1/payments", idempotent=True, json=data, headers={"X-Idempotency-Key": idempotency_key})
+
+    async def aclose(self):
+        await self._http.aclose()
+
+
+_client: Optional[MercadoPagoClient] = None
+
+
+def get_client() -> MercadoPagoClient:
+    """El cliente compartido. Lo crea el lifespan; si no corrió (scripts), se crea acá."""
+    global _client
+    if _client is None:
+        token = os.getenv("MERCADOPAGO_TOKEN")
+        if not token:
+            logger.critical("MERCADOPAGO_TOKEN no encontrado. El checkout no funcionará.")
+        _client = MercadoPagoClient(token)
+    return _client
+
+
+def set_client(client: Optional[MercadoPagoClient]):
+    """Para los tests: apunta la app a otro cliente (ej. el servidor falso)."""
+    global _client
+    _client = client
+
+
+async def shutdown():
+    """Lo llama el lifespan al apagar: cierra las conexiones abiertas."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
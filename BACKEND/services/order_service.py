@@ -0,0 +1,184 @@
+# En BACKEND/services/order_service.py
+
+import asyncio
+import logging
+import uuid
+from typing import Dict, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import case, insert, select, update, exc as SQLAlchemyExceptions
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Orden, DetalleOrden, VarianteProducto
+from services import catalog_cache, hot_sku, mercadopago_client, stock_reservations
+from utils.db_locks import lock_rows
+
+logger = logging.getLogger(__name__)
+
+
+def existing_order_query(payment_id: str):
+    return select(Orden.id).filter(Orden.payment_id_mercadopago == payment_id)
+
+
+async def process_payment_notification(db: AsyncSession, payment_id: str) -> str:
+    """
+    Lo que antes hacía el webhook en línea: si el pago está aprobado y todavía no
+    tiene orden, la crea y descuenta stock. Devuelve el estado final del evento:
+    "procesado", o "ignorado" si el pago aún no está aprobado (MP va a volver a avisar).
+    Cualquier excepción la trata el consumidor del inbox como reintentable.
+    """
+    existing_order = await db.execute(existing_order_query(payment_id))
+    if existing_order.scalars().first():
+        logger.info(f"El payment_id {payment_id} ya tiene orden. Omitiendo.")
+        return "procesado"
+    # Soltamos la conexión mientras esperamos a MP (y a la ventana del modo flash)
+    await db.commit()
+
+    payment_info = await mercadopago_client.get_client().get_payment(payment_id)
+    if payment_info.get("status") != "approved":
+        logger.info(f"Pago {payment_id} en estado '{payment_info.get('status')}'. Se espera la próxima notificación.")
+        return "ignorado"
+
+    logger.info(f"Pago aprobado! ID: {payment_id}. Procesando orden...")
+    await save_order_and_update_stock(payment_info, db, payment_id)
+    return "procesado"
+
+
+class StockInsuficiente(Exception):
+    """
+    Alguna variante no alcanza para cubrir la orden (no se descontó nada). Es
+    definitivo: save_order_and_update_stock la deja pasar tal cual para que el
+    inbox no la reintente.
+    """
+
+
+async def _decrement_stock(db: AsyncSession, cantidades: Dict[int, int]) -> Set[int]:
+    """
+    Descuenta todas las variantes de la orden de una vez. Primero las bloquea con un
+    solo SELECT ... FOR UPDATE en orden de id (dos webhooks que comparten variantes
+    toman los locks en el mismo orden: no hay deadlock). Después un único UPDATE
+    condicional: cantidad_en_stock = cantidad_en_stock - qty WHERE cantidad_en_stock >= qty.
+    Si alguna fila no cumple la condición, no se toca ninguna. Devuelve los productos afectados.
+    """
+    ids = sorted(cantidades)
+    locked = await lock_rows(db, [VarianteProducto.producto_id, VarianteProducto.cantidad_en_stock], VarianteProducto.id, ids)
+    missing = [variante_id for variante_id in ids if variante_id not in locked]
+    if missing:
+        raise Exception(f"Variante {missing[0]} no encontrada")
+    short = [variante_id for variante_id in ids if locked[variante_id][1] < cantidades[variante_id]]
+    if short:
+        raise StockInsuficiente(f"Stock insuficiente para {short[0]}")
+
+    cantidad = case(cantidades, value=VarianteProducto.id)
+    result = await db.execute(
+        update(VarianteProducto)
+        .where(VarianteProducto.id.in_(ids), VarianteProducto.cantidad_en_stock >= cantidad)
+        .values(cantidad_en_stock=VarianteProducto.cantidad_en_stock - cantidad)
+        .execution_options(synchronize_session=False)
+    )
+    # Sin FOR UPDATE real (ej. SQLite) otro pudo descontar entre el SELECT y el UPDATE:
+    # la condición del WHERE es la que garantiza que nunca quede stock negativo
+    if result.rowcount != len(ids):
+        raise StockInsuficiente("Stock insuficiente: otra compra se llevó las últimas unidades")
+    return {locked[variante_id][0] for variante_id in ids}
+
+
+async def _decrement_hot(cantidades: Dict[int, int], lote: str, payment_id: str) -> Tuple[Dict[int, int], Set[int]]:
+    """
+    Las variantes en modo flash (services/hot_sku) se descuentan por su cola, que ya
+    commitea a nombre de `lote`. Si alguna no alcanza (o su ventana falló) se devuelve
+    lo que sí se tomó y se corta la orden: StockInsuficiente es definitivo,
+    VentanaFallida se puede reintentar.
+    """
+    hot = {variante_id: cantidad for variante_id, cantidad in sorted(cantidades.items()) if hot_sku.is_hot(variante_id)}
+    if not hot:
+        return {}, set()
+    results = await asyncio.gather(*(hot_sku.decrement(v, q, lote, payment_id) for v, q in hot.items()), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    rejected = [v for v, result in zip(hot, results) if not isinstance(result, BaseException) and not result[0]]
+    if errors or rejected:
+        await _undo_hot(lote)
+        if errors:
+            raise errors[0]
+        raise StockInsuficiente(f"Stock insuficiente para {rejected[0]}")
+    return hot, {result[1] for result in results}
+
+
+async def _undo_hot(lote: str):
+    try:
+        await hot_sku.restore(lote)
+    except Exception as e:
+        # Queda anotado en descuentos_flash: lo devuelve hot_sku.reconcile
+        logger.critical(f"No se pudo devolver el stock del descuento flash {lote}: {e!r}")
+
+
+async def save_order_and_update_stock(payment_info: dict, db: AsyncSession, payment_id: str):
+    hot_taken: Dict[int, int] = {}
+    lote = str(uuid.uuid4())
+    try:
+        usuario_id = payment_info.get("external_reference")
+        monto_total = payment_info.get("transaction_amount")
+
+        detalles = []
+        cantidades: Dict[int, int] = {}
+        for item in payment_info.get("additional_info", {}).get("items", []):
+            variante_id = int(item.get("id"))
+            cantidad_comprada = int(item.get("quantity"))
+            detalles.append({
+                "variante_producto_id": variante_id,
+                "cantidad": cantidad_comprada,
+                "precio_en_momento_compra": float(item.get("unit_price")),
+            })
+            # La misma variante en dos líneas se descuenta sumada
+            cantidades[variante_id] = cantidades.get(variante_id, 0) + cantidad_comprada
+
+        # Primero las variantes en modo flash, antes de abrir la transacción de la orden
+        hot_taken, productos_afectados = await _decrement_hot(cantidades, lote, payment_id)
+        normales = {v: q for v, q in cantidades.items() if v not in hot_taken}
+
+        new_order = Orden(
+            usuario_id=usuario_id,
+            monto_total=monto_total,
+            estado="Completado",
+            estado_pago="Aprobado",
+            metodo_pago="MercadoPago",
+            payment_id_mercadopago=payment_id
+        )
+        db.add(new_order)
+        await db.flush()
+        orden_id = new_order.id
+
+        if hot_taken:
+            await hot_sku.confirm(db, lote, len(hot_taken))
+        if normales:
+            productos_afectados |= await _decrement_stock(db, normales)
+        if detalles:
+            await db.execute(insert(DetalleOrden), [{**detalle, "orden_id": orden_id} for detalle in detalles])
+        # Las unidades ya salieron del stock: la reserva del checkout se borra en la misma transacción
+        reserva_id = (payment_info.get("metadata") or {}).get("reserva_id")
+        if reserva_id:
+            await stock_reservations.release(db, reserva_id, commit=False, converted=True)
+
+        await db.commit()
+        # El stock de las variantes viaja en el detalle del producto: lo sacamos del cache
+        catalog_cache.invalidate_products(productos_afectados, membership_changed=False)
+        logger.info(f"Orden {orden_id} guardada y stock actualizado exitosamente.")
+
+    except StockInsuficiente as e:
+        logger.error(f"No se pudo guardar la orden del pago {payment_id}: {e}")
+        await db.rollback()
+        if hot_taken:
+            await _undo_hot(lote)
+        raise
+    except SQLAlchemyExceptions.IntegrityError as e:
+        logger.error(f"Error de Integridad de DB al guardar la orden: {e}")
+        await db.rollback()
+        if hot_taken:
+            await _undo_hot(lote)
+        raise HTTPException(status_code=500, detail="Error de base de datos al guardar la orden.")
+    except Exception as e:
+        logger.error(f"Error al procesar la orden y stock: {e!r}", exc_info=True)
+        await db.rollback()
+        if hot_taken:
+            await _undo_hot(lote)
+        raise HTTPException(status_code=500, detail="Error al procesar la orden.")
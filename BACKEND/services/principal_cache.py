@@ -0,0 +1,49 @@
+# En BACKEND/services/principal_cache.py
+
+import os
+from typing import Optional
+
+from pymongo.database import Database
+
+from utils.cache import InstrumentedTTLCache
+
+# Cada request autenticado resolvía el usuario del token con un find_one a Mongo.
+# Lo guardamos acá por subject (el email del JWT). El que cambia un usuario
+# (ej: update_user_role) invalida al toque; el TTL corto es la red de seguridad
+# para los otros workers, que no se enteran de esa invalidación.
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+PRINCIPAL_CACHE_MAX_USERS = int(os.getenv("PRINCIPAL_CACHE_MAX_USERS", 10000))
+
+_users = InstrumentedTTLCache(maxsize=PRINCIPAL_CACHE_MAX_USERS, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+_mongo_lookups = 0
+
+
+async def get_user(db: Database, email: str) -> Optional[dict]:
+    """
+    El documento del usuario con ese email, o None. Devuelve una copia: los
+    que llaman le pisan `_id`/`id` y eso no tiene que quedar en el cache.
+    """
+    global _mongo_lookups
+    user = _users.lookup(email)
+    if user is None:
+        _mongo_lookups += 1
+        user = await db.users.find_one({"email": email})
+        if user is None:
+            return None  # No guardamos negativos: el email se puede registrar en cualquier momento
+        _users[email] = user
+    return dict(user)
+
+
+def invalidate(email: str):
+    _users.invalidate(email)
+
+
+def stats() -> dict:
+    return {**_users.stats(), "mongo_lookups": _mongo_lookups}
+
+
+def reset():
+    global _mongo_lookups
+    _users.clear()
+    _users.hits = _users.misses = _users.evictions = _users.expirations = _users.invalidations = 0
+    _mongo_lookups = 0
@@ -0,0 +1,238 @@
+# En BACKEND/services/product_import.py
+
+import csv
+import io
+import json
+import logging
+import os
+from typing import AsyncIterator, BinaryIO, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import AsyncSessionLocal
+from database.models import Categoria, Producto, VarianteProducto
+from schemas import product_schemas
+
+logger = logging.getLogger(__name__)
+
+# Filas por transacción: un IN de SKUs y dos executemany por lote
+IMPORT_CHUNK_SIZE = int(os.getenv("PRODUCT_IMPORT_CHUNK_SIZE", 500))
+# Con un archivo muy roto no queremos devolver un JSON de 50 MB de errores
+MAX_REPORTED_ERRORS = int(os.getenv("PRODUCT_IMPORT_MAX_ERRORS", 1000))
+
+def detect_format(filename: Optional[str], content_type: Optional[str]) -> Optional[str]:
+    name = (filename or "").lower()
+    if name.endswith(".csv") or content_type == "text/csv":
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")) or content_type in ("application/x-ndjson", "application/jsonl"):
+        return "jsonl"
+    return None
+
+
+# --- Lectura en streaming: de a una fila, nunca el archivo entero ---
+
+def _parse_variants(raw: str) -> List[dict]:
+    """En CSV las variantes van en una sola celda: "M/Negro/10;L/Negro/5"."""
+    variants = []
+    for chunk in raw.split(";"):
+        if not chunk.strip():
+            continue
+        parts = [p.strip() for p in chunk.split("/")]
+        if len(parts) != 3:
+            raise ValueError(f"Variante mal formada: '{chunk.strip()}' (se espera talle/color/stock)")
+        variants.append({"tamanio": parts[0], "color": parts[1], "cantidad_en_stock": parts[2]})
+    return variants
+
+
+def _iter_csv(stream: BinaryIO) -> Iterator[Tuple[int, object]]:
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+    try:
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            # Celdas vacías = campo no informado (así aplican los defaults del schema)
+            data = {k.strip(): v.strip() for k, v in row.items() if k and v is not None and v.strip() != ""}
+            try:
+                if "urls_imagenes" in data:
+                    data["urls_imagenes"] = [u.strip() for u in data["urls_imagenes"].split("|") if u.strip()]
+                if "variantes" in data:
+                    data["variantes"] = _parse_variants(data["variantes"])
+            except ValueError as e:
+                yield number, e
+                continue
+            yield number, data
+    finally:
+        text.detach()  # El UploadFile lo cierra FastAPI, no el wrapper
+
+
+def _iter_jsonl(stream: BinaryIO) -> Iterator[Tuple[int, object]]:
+    for number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield number, ValueError(f"JSON inválido: {e}")
+            continue
+        yield number, data if isinstance(data, dict) else ValueError("Cada línea tiene que ser un objeto JSON.")
+
+
+def iter_rows(stream: BinaryIO, fmt: str) -> Iterator[Tuple[int, object]]:
+    """Devuelve (número de fila, dict crudo) o (número de fila, excepción) si la fila no se pudo leer."""
+    return _iter_csv(stream) if fmt == "csv" else _iter_jsonl(stream)
+
+
+def _validation_messages(error: ValidationError) -> List[str]:
+    return [f"{'.'.join(str(p) for p in e['loc']) or 'fila'}: {e['msg']}" for e in error.errors()]
+
+
+# --- Importación ---
+
+def taken_skus_query(skus: List[str]):
+    """SKUs del lote que ya existen en la base (un solo IN por lote)."""
+    return select(Producto.sku).where(Producto.sku.in_(skus))
+
+
+class _Importer:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.summary = {"procesadas": 0, "creados": 0, "variantes_creadas": 0, "con_error": 0, "lotes": 0, "errores": []}
+        self.known_categories = set()
+        self.created_ids: List[int] = []
+
+    def progress(self) -> dict:
+        """Los contadores del resumen, sin la lista de errores (eso va al final)."""
+        return {k: v for k, v in self.summary.items() if k != "errores"}
+
+    def add_error(self, fila: int, sku: Optional[str], errores: List[str]):
+        self.summary["con_error"] += 1
+        if len(self.summary["errores"]) < MAX_REPORTED_ERRORS:
+            self.summary["errores"].append({"fila": fila, "sku": sku, "errores": errores})
+
+    async def _missing_categories(self, ids: set) -> set:
+        unknown = ids - self.known_categories
+        if unknown:
+            result = await self.db.execute(select(Categoria.id).where(Categoria.id.in_(unknown)))
+            self.known_categories.update(result.scalars().all())
+        return ids - self.known_categories
+
+    async def flush_chunk(self, chunk: List[Tuple[int, product_schemas.ProductImportRow]]):
+        if not chunk:
+            return
+        self.summary["lotes"] += 1
+
+        # Un solo IN por lote para las colisiones de SKU contra la base
+        skus = [row.sku for _, row in chunk]
+        result = await self.db.execute(taken_skus_query(skus))
+        taken = set(result.scalars().all())
+        missing_categories = await self._missing_categories({row.categoria_id for _, row in chunk})
+
+        valid = []
+        for number, row in chunk:
+            if row.sku in taken:
+                self.add_error(number, row.sku, [f"Ya existe un producto con el SKU: {row.sku}"])
+            elif row.categoria_id in missing_categories:
+                self.add_error(number, row.sku, [f"categoria_id: la categoría {row.categoria_id} no existe"])
+            else:
+                valid.append((number, row))
+        if not valid:
+            return
+
+        try:
+            await self.db.execute(insert(Producto), [row.model_dump(exclude={"variantes"}) for _, row in valid])
+            # Sin RETURNING en MySQL: recuperamos los ids por SKU con otro IN
+            result = await self.db.execute(
+                select(Producto.sku, Producto.id).where(Producto.sku.in_([row.sku for _, row in valid]))
+            )
+            ids_by_sku = dict(result.all())
+            variants = [
+                {**v.model_dump(), "producto_id": ids_by_sku[row.sku]}
+                for _, row in valid for v in row.variantes
+            ]
+            if variants:
+                await self.db.execute(insert(VarianteProducto), variants)
+            await self.db.commit()
+        except SQLAlchemyError as e:
+            # Algo que no vimos venir (p. ej. otro admin cargó el mismo SKU recién): cae el lote entero
+            await self.db.rollback()
+            logger.error(f"Falló el lote {self.summary['lotes']} de la importación: {e}")
+            for number, row in valid:
+                self.add_error(number, row.sku, ["No se pudo guardar el lote de esta fila; reintentá la importación."])
+            return
+
+        self.summary["creados"] += len(valid)
+        self.summary["variantes_creadas"] += len(variants)
+        self.created_ids.extend(ids_by_sku.values())
+        logger.info(
+            f"Importación: lote {self.summary['lotes']} guardado ({self.summary['procesadas']} filas leídas, "
+            f"{self.summary['creados']} productos creados, {self.summary['con_error']} con error)"
+        )
+
+
+async def _run(importer: _Importer, stream: BinaryIO, fmt: str, chunk_size: Optional[int]) -> AsyncIterator[dict]:
+    """Lee, valida y guarda; después de cada lote devuelve cómo va."""
+    chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+    chunk: List[Tuple[int, product_schemas.ProductImportRow]] = []
+    seen_skus = set()
+
+    rows = iter_rows(stream, fmt)
+    while True:
+        try:
+            number, raw = next(rows)
+        except StopIteration:
+            break
+        except UnicodeDecodeError:
+            # No tiene sentido seguir leyendo: se guarda lo que ya estaba validado y se corta
+            importer.add_error(importer.summary["procesadas"] + 1, None, ["El archivo tiene que estar en UTF-8."])
+            break
+        importer.summary["procesadas"] += 1
+        sku = raw.get("sku") if isinstance(raw, dict) else None
+        if isinstance(raw, Exception):
+            importer.add_error(number, None, [str(raw)])
+            continue
+        try:
+            row = product_schemas.ProductImportRow.model_validate(raw)
+        except ValidationError as e:
+            importer.add_error(number, sku if isinstance(sku, str) else None, _validation_messages(e))
+            continue
+        if row.sku in seen_skus:
+            importer.add_error(number, row.sku, [f"SKU repetido dentro del archivo: {row.sku}"])
+            continue
+        seen_skus.add(row.sku)
+
+        chunk.append((number, row))
+        if len(chunk) >= chunk_size:
+            await importer.flush_chunk(chunk)
+            chunk = []
+            yield importer.progress()
+
+    if chunk:
+        await importer.flush_chunk(chunk)
+        yield importer.progress()
+
+
+async def import_products(db: AsyncSession, stream: BinaryIO, fmt: str, chunk_size: Optional[int] = None) -> Tuple[dict, List[int]]:
+    """
+    Lee el archivo fila por fila, valida con ProductImportRow y guarda de a lotes,
+    cada lote en su propia transacción. Las filas con error no frenan al resto.
+    Devuelve el resumen y los ids creados.
+    """
+    importer = _Importer(db)
+    async for _ in _run(importer, stream, fmt, chunk_size):
+        pass
+    return importer.summary, importer.created_ids
+
+
+async def import_products_with_progress(stream: BinaryIO, fmt: str, chunk_size: Optional[int] = None, session_factory=None) -> AsyncIterator[dict]:
+    """
+    La misma importación, pero avisando: un {"tipo": "progreso", ...contadores} por
+    lote guardado y al final {"tipo": "resumen", ...resumen completo}. Abre su propia
+    sesión porque corre dentro de un StreamingResponse, cuando la del request ya se cerró.
+    """
+    async with (session_factory or AsyncSessionLocal)() as db:
+        importer = _Importer(db)
+        async for progress in _run(importer, stream, fmt, chunk_size):
+            yield {"tipo": "progreso", **progress}
+    yield {"tipo": "resumen", **importer.summary}
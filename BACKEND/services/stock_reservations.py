@@ -0,0 +1,285 @@
+# En BACKEND/services/stock_reservations.py
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import AsyncSessionLocal
+from database.models import ReservaStock, VarianteProducto
+from schemas import cart_schemas
+from services import catalog_cache, hot_sku
+from utils.db_locks import lock_rows
+
+logger = logging.getLogger(__name__)
+
+# Al crear la preferencia de MP se apartan las unidades por este tiempo. Si el pago
+# no llega antes, la reserva deja de contar sola (se filtra por expira_en) y el
+# barrendero la borra después. MP tampoco acepta el pago pasado ese momento.
+# El catálogo muestra el stock libre (stock - reservas vigentes), así que reservar
+# y barrer tiran del cache las páginas de esos productos y mueven la variante
+# (version / actualizado_en) para que los validadores HTTP se enteren.
+RESERVA_TTL_MINUTES = int(os.getenv("RESERVA_TTL_MINUTES", 15))
+# Reservas activas por comprador (external_reference). Un nuevo checkout de la misma
+# clave reemplaza el del mismo carrito y, si se pasa del tope, el más viejo.
+RESERVA_MAX_POR_CLAVE = int(os.getenv("RESERVA_MAX_POR_CLAVE", 1))
+RESERVA_SWEEP_SECONDS = float(os.getenv("RESERVA_SWEEP_SECONDS", 60))
+RESERVA_SWEEP_BATCH = 1000
+
+_task: Optional[asyncio.Task] = None
+_counters = {"creadas": 0, "reemplazadas": 0, "convertidas": 0, "liberadas": 0, "vencidas_borradas": 0}
+
+
+class ReservaRechazada(Exception):
+    """No alcanzó el stock libre (stock - reservas activas) para alguna variante."""
+
+    def __init__(self, errores: List[cart_schemas.CartItemError]):
+        super().__init__("Stock insuficiente para reservar.")
+        self.errores = errores
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def held_subquery(variante_ids, now: Optional[datetime] = None, excluir_clave: Optional[str] = None):
+    """
+    Unidades reservadas y vigentes por variante (`variante_ids`: lista de ids o un
+    select que los devuelva). Solo lee ix_reservas_variante_expira.
+    Con `excluir_clave` no cuenta las del propio comprador (las va a reemplazar al reservar).
+    """
+    query = (
+        select(ReservaStock.variante_id, func.sum(ReservaStock.cantidad).label("reservado"))
+        .where(ReservaStock.variante_id.in_(variante_ids), ReservaStock.expira_en > (now or _now()))
+    )
+    if excluir_clave is not None:
+        query = query.where(ReservaStock.clave != excluir_clave)
+    return query.group_by(ReservaStock.variante_id).subquery()
+
+
+def held_scalar(variante_id, now: Optional[datetime] = None, excluir_clave: Optional[str] = None):
+    """
+    Lo mismo que held_subquery pero correlacionado con la columna `variante_id` de la
+    query de afuera (0 si no hay reservas): busca en ix_reservas_variante_expira solo
+    para las variantes de esas filas, sin materializar ni agrupar nada.
+    """
+    query = (
+        select(func.coalesce(func.sum(ReservaStock.cantidad), 0))
+        .where(ReservaStock.variante_id == variante_id, ReservaStock.expira_en > (now or _now()))
+    )
+    if excluir_clave is not None:
+        query = query.where(ReservaStock.clave != excluir_clave)
+    return query.scalar_subquery()
+
+
+async def held_by_variant(db: AsyncSession, variante_ids: List[int]) -> Dict[int, int]:
+    """{variante_id: unidades reservadas vigentes}, solo las que tienen alguna."""
+    if not variante_ids:
+        return {}
+    held_q = held_subquery(variante_ids)
+    return dict((await db.execute(select(held_q.c.variante_id, held_q.c.reservado))).all())
+
+
+async def _invalidate_catalog(db: AsyncSession, variante_ids, productos: Optional[Dict[int, int]] = None) -> None:
+    """
+    Cambió el stock libre de estas variantes: el cache del catálogo ya no vale para
+    sus productos. `productos` ({variante_id: producto_id}) ahorra la query si ya se conocen.
+    """
+    productos = productos or {}
+    producto_ids = {productos[v] for v in variante_ids if v in productos}
+    unknown = sorted(v for v in variante_ids if v not in productos)
+    if unknown:
+        producto_ids.update((await db.execute(
+            select(VarianteProducto.producto_id).where(VarianteProducto.id.in_(unknown)).distinct()
+        )).scalars().all())
+    if producto_ids:
+        catalog_cache.invalidate_products(producto_ids, membership_changed=False)
+
+
+async def reserve(db: AsyncSession, cantidades: Dict[int, int], clave: str) -> Tuple[str, datetime]:
+    """
+    Aparta `cantidades` ({variante_id: unidades}) para `clave` en una transacción.
+    Bloquea las variantes en orden de id (igual que el descuento de stock) para que
+    dos checkouts simultáneos no reserven las mismas últimas unidades. Todo o nada.
+    En la misma transacción suelta las reservas anteriores de la clave que sobran
+    (ver _replaced), así un segundo "pagar" no queda bloqueado por el primero.
+
+    Las variantes del modo flash (hot_sku) no se bloquean: ahí el lock por fila es
+    justo lo que la ventana evita. Sus reservas se leen sin FOR UPDATE, así que dos
+    checkouts simultáneos pueden apartar las mismas últimas unidades; no se vende de
+    más igual, porque el descuento real lo decide la ventana al aprobarse el pago.
+    """
+    ids = sorted(cantidades)
+    hot_ids = [variante_id for variante_id in ids if hot_sku.is_hot(variante_id)]
+    cold_ids = [variante_id for variante_id in ids if not hot_sku.is_hot(variante_id)]
+    now = _now()
+    try:
+        variantes = await lock_rows(db, [VarianteProducto.producto_id, VarianteProducto.cantidad_en_stock], VarianteProducto.id, cold_ids)
+        if hot_ids:
+            variantes.update((row[0], tuple(row[1:])) for row in await db.execute(
+                select(VarianteProducto.id, VarianteProducto.producto_id, VarianteProducto.cantidad_en_stock)
+                .where(VarianteProducto.id.in_(hot_ids))
+            ))
+        replaced = await _replaced(db, clave, cantidades, now)
+        replaced_variants = set()
+        if replaced:
+            replaced_variants = set((await db.execute(
+                select(ReservaStock.variante_id).where(ReservaStock.reserva_id.in_(replaced))
+            )).scalars().all())
+            await db.execute(delete(ReservaStock).where(ReservaStock.reserva_id.in_(replaced)))
+        held_q = held_subquery(ids, now)
+        held = dict((await db.execute(select(held_q.c.variante_id, held_q.c.reservado))).all())
+
+        errores = []
+        for variante_id in ids:
+            if variante_id not in variantes:
+                errores.append(cart_schemas.CartItemError(
+                    variante_id=variante_id, error="no_existe", solicitado=cantidades[variante_id],
+                    mensaje=f"El item {variante_id} ya no existe.",
+                ))
+                continue
+            libre = variantes[variante_id][1] - (held.get(variante_id) or 0)
+            if libre < cantidades[variante_id]:
+                errores.append(cart_schemas.CartItemError(
+                    variante_id=variante_id, error="stock_insuficiente", solicitado=cantidades[variante_id],
+                    disponible=max(libre, 0), mensaje=f"Quedan {max(libre, 0)} unidades libres del item {variante_id}.",
+                ))
+        if errores:
+            raise ReservaRechazada(errores)
+
+        reserva_id = str(uuid.uuid4())
+        expira_en = now + timedelta(minutes=RESERVA_TTL_MINUTES)
+        await db.execute(insert(ReservaStock), [
+            {"reserva_id": reserva_id, "clave": clave, "variante_id": variante_id, "cantidad": cantidades[variante_id], "expira_en": expira_en}
+            for variante_id in ids
+        ])
+        if cold_ids:
+            # Ya están bloqueadas: que el Last-Modified del catálogo vea la reserva
+            await db.execute(
+                update(VarianteProducto).where(VarianteProducto.id.in_(cold_ids))
+                .values(version=VarianteProducto.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+    except BaseException:
+        await db.rollback()  # Suelta los FOR UPDATE
+        raise
+    await _invalidate_catalog(db, set(ids) | replaced_variants, {v: row[0] for v, row in variantes.items()})
+    _counters["creadas"] += 1
+    _counters["reemplazadas"] += len(replaced)
+    return reserva_id, expira_en
+
+
+async def _replaced(db: AsyncSession, clave: str, cantidades: Dict[int, int], now: datetime) -> List[str]:
+    """
+    Reservas activas de la clave que el nuevo checkout reemplaza: la del mismo carrito
+    (mismas variantes y cantidades) y las más viejas que pasen RESERVA_MAX_POR_CLAVE.
+    Se bloquean: dos checkouts de la misma clave no se las reparten.
+    """
+    rows = (await db.execute(
+        select(ReservaStock.reserva_id, ReservaStock.variante_id, ReservaStock.cantidad, ReservaStock.expira_en)
+        .where(ReservaStock.clave == clave, ReservaStock.expira_en > now)
+        .with_for_update()
+    )).all()
+    activas: Dict[str, Dict[int, int]] = {}
+    expiran: Dict[str, datetime] = {}
+    for reserva_id, variante_id, cantidad, expira_en in rows:
+        activas.setdefault(reserva_id, {})[variante_id] = cantidad
+        expiran[reserva_id] = expira_en
+
+    replaced = [reserva_id for reserva_id, items in activas.items() if items == cantidades]
+    # El resto, de la más nueva a la más vieja: se quedan las que entran junto a la nueva
+    restantes = sorted((r for r in activas if r not in replaced), key=lambda r: expiran[r], reverse=True)
+    return replaced + restantes[max(RESERVA_MAX_POR_CLAVE - 1, 0):]
+
+
+async def release(db: AsyncSession, reserva_id: str, commit: bool = True, converted: bool = False) -> int:
+    """
+    Borra las filas de un checkout. La usa el guardado de la orden (converted=True,
+    dentro de su transacción, sin commit propio) y la preferencia que no se pudo crear.
+    Convertida, el cache del catálogo lo limpia la orden al descontar el stock.
+    """
+    variante_ids = [] if converted else (await db.execute(
+        select(ReservaStock.variante_id).where(ReservaStock.reserva_id == reserva_id)
+    )).scalars().all()
+    result = await db.execute(delete(ReservaStock).where(ReservaStock.reserva_id == reserva_id))
+    if commit:
+        await db.commit()
+        await _invalidate_catalog(db, variante_ids)
+    if result.rowcount:
+        _counters["convertidas" if converted else "liberadas"] += 1
+    return result.rowcount
+
+
+async def sweep_expired(session_factory=None) -> int:
+    """
+    Borra las reservas vencidas, de a bloques para no tener un DELETE enorme abierto.
+    Ya no contaban desde expira_en; al borrarlas se mueven sus variantes para que el
+    Last-Modified del catálogo refleje el stock que se liberó.
+    """
+    factory = session_factory or AsyncSessionLocal
+    total = 0
+    async with factory() as db:
+        while True:
+            rows = (await db.execute(
+                select(ReservaStock.id, ReservaStock.variante_id).where(ReservaStock.expira_en <= _now()).limit(RESERVA_SWEEP_BATCH)
+            )).all()
+            if not rows:
+                break
+            variante_ids = sorted({variante_id for _, variante_id in rows})
+            # Variantes antes que reservas, el mismo orden que la orden que convierte una
+            await db.execute(
+                update(VarianteProducto).where(VarianteProducto.id.in_(variante_ids))
+                .values(version=VarianteProducto.version + 1)
+                .execution_options(synchronize_session=False)
+            )
+            await db.execute(delete(ReservaStock).where(ReservaStock.id.in_([row_id for row_id, _ in rows])))
+            await db.commit()
+            await _invalidate_catalog(db, variante_ids)
+            total += len(rows)
+    _counters["vencidas_borradas"] += total
+    return total
+
+
+async def run_sweeper(session_factory=None):
+    while True:
+        try:
+            removed = await sweep_expired(session_factory)
+            if removed:
+                logger.info(f"Se liberaron {removed} reservas de stock vencidas.")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error barriendo reservas vencidas: {e!r}", exc_info=True)
+        await asyncio.sleep(RESERVA_SWEEP_SECONDS)
+
+
+def start():
+    """Lo llama el lifespan al arrancar."""
+    global _task
+    _task = asyncio.create_task(run_sweeper(), name="stock-reservations-sweeper")
+
+
+async def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def stats() -> dict:
+    return {**_counters, "ttl_minutes": RESERVA_TTL_MINUTES}
+
+
+def reset():
+    for key in _counters:
+        _counters[key] = 0
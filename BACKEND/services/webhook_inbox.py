@@ -0,0 +1,237 @@
+# En BACKEND/services/webhook_inbox.py
+
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.database import AsyncSessionLocal
+from database.models import WebhookEvento
+from services import order_service
+
+logger = logging.getLogger(__name__)
+
+# El webhook de MP solo inserta acá y responde. Este consumidor, que arranca con
+# el lifespan, drena el inbox con concurrencia acotada: cada evento en su propia
+# sesión, con reintentos con backoff y, agotados los intentos, estado "fallido"
+# (dead letter) para revisarlo a mano desde el panel de admin. La falta de stock
+# no se reintenta: va directo a "fallido".
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 50))
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+WEBHOOK_BACKOFF_SECONDS = float(os.getenv("WEBHOOK_BACKOFF_SECONDS", 10))
+# Si un worker se cae a mitad de un evento, otro lo retoma cuando vence el lease
+WEBHOOK_LEASE_SECONDS = int(os.getenv("WEBHOOK_LEASE_SECONDS", 300))
+# Sin avisos del webhook igual se revisa cada tanto (reintentos vencidos, otros workers)
+WEBHOOK_POLL_SECONDS = float(os.getenv("WEBHOOK_POLL_SECONDS", 5))
+
+CLAIMABLE = ("pendiente", "procesando")
+QUEUE_STATES = ("pendiente", "procesando", "fallido")
+
+Handler = Callable[[AsyncSession, str], Awaitable[str]]
+
+_wakeup = asyncio.Event()
+_task: Optional[asyncio.Task] = None
+_counters = {"encolados": 0, "duplicados": 0, "procesados": 0, "ignorados": 0, "reintentos": 0, "fallidos": 0}
+_depth: Dict[str, int] = {state: 0 for state in QUEUE_STATES}
+
+
+async def _db_now(db: AsyncSession) -> datetime:
+    """
+    La hora según la base. Los vencimientos se comparan contra columnas TIMESTAMP
+    que la base interpreta en la zona de su sesión: con el reloj de la app (UTC)
+    un MySQL en otra zona correría los leases y los backoffs por horas.
+    """
+    return (await db.execute(select(func.now()))).scalar_one()
+
+
+async def enqueue(db: AsyncSession, payment_id: str, payload: dict) -> bool:
+    """
+    Guarda la notificación. Devuelve False si ese pago ya estaba en el inbox.
+    Excepción: si lo habíamos "ignorado" (el pago todavía no estaba aprobado), la
+    nueva notificación lo vuelve a poner en cola, porque seguramente cambió de estado.
+    """
+    db.add(WebhookEvento(payment_id=payment_id, tipo=payload.get("type"), payload=payload, estado="pendiente", proximo_intento_en=func.now()))
+    try:
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        result = await db.execute(
+            update(WebhookEvento)
+            .where(WebhookEvento.payment_id == payment_id, WebhookEvento.estado == "ignorado")
+            .values(estado="pendiente", intentos=0, payload=payload, proximo_intento_en=func.now())
+        )
+        await db.commit()
+        if not result.rowcount:
+            _counters["duplicados"] += 1
+            return False
+    _counters["encolados"] += 1
+    _wakeup.set()
+    return True
+
+
+def _due(now) -> tuple:
+    return (
+        WebhookEvento.estado.in_(CLAIMABLE),
+        WebhookEvento.proximo_intento_en <= now,
+    )
+
+
+def due_query(now):
+    """Los próximos eventos vencidos, en orden: lee solo ix_webhook_inbox_estado_proximo."""
+    return (
+        select(WebhookEvento.id).where(*_due(now))
+        .order_by(WebhookEvento.proximo_intento_en, WebhookEvento.id)
+        .limit(WEBHOOK_BATCH_SIZE)
+    )
+
+
+def depth_query():
+    return (
+        select(WebhookEvento.estado, func.count())
+        .where(WebhookEvento.estado.in_(QUEUE_STATES))
+        .group_by(WebhookEvento.estado)
+    )
+
+
+async def _claim(db: AsyncSession) -> List[int]:
+    """
+    Toma un lote de eventos vencidos con un solo UPDATE condicional: los que otro
+    worker (u otro proceso) tomó entre el SELECT y el UPDATE ya no cumplen el WHERE
+    y quedan afuera. Cada toma lleva su propio lease, así después se leen solo los
+    que efectivamente quedaron para este worker. Son 4 sentencias por lote, no N+1.
+    """
+    now = await _db_now(db)
+    candidates = (await db.execute(due_query(now))).scalars().all()
+    if not candidates:
+        await db.commit()
+        return []
+    lease = str(uuid.uuid4())
+    await db.execute(
+        update(WebhookEvento)
+        .where(WebhookEvento.id.in_(candidates), *_due(now))
+        .values(estado="procesando", lease=lease, proximo_intento_en=now + timedelta(seconds=WEBHOOK_LEASE_SECONDS))
+        .execution_options(synchronize_session=False)
+    )
+    claimed = (await db.execute(
+        select(WebhookEvento.id).where(WebhookEvento.id.in_(candidates), WebhookEvento.lease == lease).order_by(WebhookEvento.id)
+    )).scalars().all()
+    await db.commit()
+    return list(claimed)
+
+
+async def _process(session_factory, event_id: int, handler: Handler):
+    async with session_factory() as db:
+        result = await db.execute(select(WebhookEvento.payment_id, WebhookEvento.intentos).where(WebhookEvento.id == event_id))
+        payment_id, intentos = result.one()
+        try:
+            estado = await handler(db, payment_id)
+            values = {"estado": estado, "ultimo_error": None}
+            _counters["procesados" if estado == "procesado" else "ignorados"] += 1
+        except order_service.StockInsuficiente as e:
+            # Reintentar no va a hacer aparecer stock: directo a revisión manual
+            await db.rollback()
+            logger.error(f"Pago {payment_id} sin stock para armar la orden; queda como fallido: {e}")
+            values = {"estado": "fallido", "intentos": intentos + 1, "ultimo_error": repr(e)[:2000]}
+            _counters["fallidos"] += 1
+        except Exception as e:
+            await db.rollback()
+            intentos += 1
+            if intentos >= WEBHOOK_MAX_ATTEMPTS:
+                logger.error(f"Webhook del pago {payment_id} falló {intentos} veces; queda como fallido: {e!r}")
+                values = {"estado": "fallido"}
+                _counters["fallidos"] += 1
+            else:
+                delay = WEBHOOK_BACKOFF_SECONDS * 2 ** (intentos - 1)
+                logger.warning(f"Webhook del pago {payment_id} falló (intento {intentos}): {e!r}. Reintento en {delay:.0f}s")
+                values = {"estado": "pendiente", "proximo_intento_en": await _db_now(db) + timedelta(seconds=delay)}
+                _counters["reintentos"] += 1
+            values.update(intentos=intentos, ultimo_error=repr(e)[:2000])
+        await db.execute(update(WebhookEvento).where(WebhookEvento.id == event_id).values(**values))
+        await db.commit()
+
+
+async def drain(session_factory=None, handler: Handler = order_service.process_payment_notification) -> int:
+    """Procesa todo lo que esté vencido ahora mismo. Devuelve cuántos eventos se tomaron."""
+    factory = session_factory or AsyncSessionLocal
+    limit = asyncio.Semaphore(WEBHOOK_WORKERS)
+
+    async def run(event_id: int):
+        async with limit:
+            await _process(factory, event_id, handler)
+
+    total = 0
+    while True:
+        async with factory() as db:
+            claimed = await _claim(db)
+        if not claimed:
+            break
+        await asyncio.gather(*(run(event_id) for event_id in claimed))
+        total += len(claimed)
+    await refresh_depth(factory)
+    return total
+
+
+async def refresh_depth(session_factory=None):
+    """Cuántos eventos hay por estado (sin contar los ya procesados/ignorados)."""
+    factory = session_factory or AsyncSessionLocal
+    async with factory() as db:
+        result = await db.execute(depth_query())
+        counts = dict(result.all())
+    for state in QUEUE_STATES:
+        _depth[state] = counts.get(state, 0)
+
+
+async def run_consumer(session_factory=None):
+    while True:
+        try:
+            await drain(session_factory)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error drenando el inbox de webhooks: {e!r}", exc_info=True)
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=WEBHOOK_POLL_SECONDS)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+def start():
+    """Lo llama el lifespan al arrancar."""
+    global _task
+    _task = asyncio.create_task(run_consumer(), name="webhook-inbox")
+
+
+async def stop():
+    """Lo llama el lifespan al apagar. Lo que quede a medias se retoma al vencer el lease."""
+    global _task
+    if _task is not None:
+        _task.cancel()
+        try:
+            await _task
+        except asyncio.CancelledError:
+            pass
+        _task = None
+
+
+def wake():
+    _wakeup.set()
+
+
+def stats() -> dict:
+    return {"profundidad": dict(_depth), **_counters, "consumidor_activo": _task is not None and not _task.done()}
+
+
+def reset():
+    for key in _counters:
+        _counters[key] = 0
+    for state in QUEUE_STATES:
+        _depth[state] = 0
+    _wakeup.clear()
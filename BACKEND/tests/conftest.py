@@ -21,6 +21,8 @@ from database.database import get_db
 from database.models import Producto, Base, Categoria
 from database.database import get_db_nosql
 from utils.security import get_password_hash, create_access_token
+from services import catalog_index, catalog_cache, hot_sku, principal_cache, mercadopago_client, stock_reservations, webhook_inbox
+from tests.fake_mercadopago import FakeMercadoPago
 
 # --- Configuración del Event Loop para la sesión ---
 @pytest.fixture(scope="session")
@@ -41,8 +43,23 @@ class AsyncMongoMockCollection:
         return self._sync_collection.update_one(*args, **kwargs)
     async def delete_one(self, *args, **kwargs):
         return self._sync_collection.delete_one(*args, **kwargs)
-    async def find(self, *args, **kwargs):
-        return self._sync_collection.find(*args, **kwargs)
+    def find(self, *args, **kwargs):
+        # Como en Motor: find no es awaitable, devuelve un cursor con to_list async
+        return AsyncMongoMockCursor(self._sync_collection.find(*args, **kwargs))
+    async def find_one_and_update(self, *args, **kwargs):
+        return self._sync_collection.find_one_and_update(*args, **kwargs)
+    async def find_one_and_delete(self, *args, **kwargs):
+        return self._sync_collection.find_one_and_delete(*args, **kwargs)
+    async def create_indexes(self, *args, **kwargs):
+        return self._sync_collection.create_indexes(*args, **kwargs)
+    async def index_information(self, *args, **kwargs):
+        return self._sync_collection.index_information(*args, **kwargs)
+
+class AsyncMongoMockCursor:
+    def __init__(self, sync_cursor):
+        self._sync_cursor = sync_cursor
+    async def to_list(self, length=None):
+        return list(self._sync_cursor) if length is None else list(self._sync_cursor.limit(length))
 
 class AsyncMongoMock:
     def __init__(self, sync_db):
@@ -102,6 +119,36 @@ async def override_get_db_sql(db_sql: AsyncSession):
     yield
     app.dependency_overrides.pop(get_db, None)
 
+# --- Mercado Pago falso ---
+@pytest_asyncio.fixture(autouse=True)
+async def fake_mercadopago(monkeypatch):
+    """Ningún test sale a la API real: el cliente compartido le habla a un MP en memoria."""
+    monkeypatch.setattr(mercadopago_client, "MERCADOPAGO_BACKOFF_SECONDS", 0.01)
+    fake = FakeMercadoPago()
+    mercadopago_client.set_client(
+        mercadopago_client.MercadoPagoClient("TEST-TOKEN", base_url="http://mp.test", transport=ASGITransport(app=fake.app))
+    )
+    yield fake
+    await mercadopago_client.shutdown()
+
+# --- Estado en memoria del catálogo ---
+@pytest.fixture(autouse=True)
+def reset_catalog_state():
+    """Cada test arranca con una DB nueva, así que el índice en memoria también."""
+    catalog_index.reset()
+    catalog_cache.reset()
+    principal_cache.reset()
+    webhook_inbox.reset()
+    stock_reservations.reset()
+    hot_sku.reset()
+    yield
+    catalog_index.reset()
+    catalog_cache.reset()
+    principal_cache.reset()
+    webhook_inbox.reset()
+    stock_reservations.reset()
+    hot_sku.reset()
+
 # --- Fixture de cliente HTTP (Respeta Lifespan) ---
 @pytest_asyncio.fixture(scope="function")
 async def client() -> AsyncClient:
@@ -0,0 +1,72 @@
+# En tests/fake_mercadopago.py
+#
+# Un Mercado Pago de mentira (app ASGI) para probar el cliente async sin salir a
+# internet: el cliente le habla por httpx.ASGITransport igual que a la API real.
+import itertools
+from typing import List, Optional
+
+from fastapi import FastAPI, Header, Request
+from fastapi.responses import HTMLResponse, JSONResponse, Response
+
+
+class FakeMercadoPago:
+    def __init__(self):
+        self.app = FastAPI()
+        self.calls: List[tuple] = []
+        self.preferences = {}
+        self.payments = {}
+        self._by_idempotency_key = {}
+        self._failures: List[tuple] = []
+        self._ids = itertools.count(1000)
+        self._routes()
+
+    def fail_next(self, times: int, status_code: int = 503, html: bool = False):
+        """
+        Las próximas `times` llamadas responden con `status_code`. Con `html`, el
+        cuerpo es una página de error como la de un proxy, no el JSON de MP.
+        """
+        self._failures.extend([(status_code, html)] * times)
+
+    def add_payment(self, payment: dict):
+        self.payments[str(payment["id"])] = payment
+
+    def _maybe_fail(self) -> Optional[Response]:
+        if self._failures:
+            status_code, html = self._failures.pop(0)
+            if html:
+                return HTMLResponse("<html><body><h1>502 Bad Gateway</h1></body></html>", status_code=status_code)
+            return JSONResponse({"message": "fallo simulado"}, status_code=status_code)
+        return None
+
+    def _routes(self):
+        app = self.app
+
+        @app.middleware("http")
+        async def record(request: Request, call_next):
+            self.calls.append((request.method, request.url.path, request.headers.get("x-idempotency-key")))
+            return self._maybe_fail() or await call_next(request)
+
+        @app.post("/checkout/preferences")
+        async def create_preference(request: Request):
+            data = await request.json()
+            if not data.get("items"):
+                return JSONResponse({"message": "items needed"}, status_code=400)
+            pref_id = f"pref-{next(self._ids)}"
+            self.preferences[pref_id] = data
+            return JSONResponse({"id": pref_id, "init_point": f"https://mp.test/{pref_id}"}, status_code=201)
+
+        @app.get("/v1/payments/{payment_id}")
+        async def get_payment(payment_id: str):
+            if payment_id not in self.payments:
+                return JSONResponse({"message": "Payment not found"}, status_code=404)
+            return self.payments[payment_id]
+
+        @app.post("/v1/payments")
+        async def create_payment(request: Request, x_idempotency_key: str = Header(...)):
+            if x_idempotency_key in self._by_idempotency_key:
+                return self.payments[self._by_idempotency_key[x_idempotency_key]]
+            data = await request.json()
+            payment = {"id": next(self._ids), "status": "approved", "status_detail": "accredited", **data}
+            self.add_payment(payment)
+            self._by_idempotency_key[x_idempotency_key] = str(payment["id"])
+            return JSONResponse(payment, status_code=201)
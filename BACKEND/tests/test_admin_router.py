@@ -0,0 +1,63 @@
+# En tests/test_admin_router.py
+import pytest
+from httpx import AsyncClient
+from fastapi import status
+from sqlalchemy.ext.asyncio import AsyncSession
+from database.models import Producto, Categoria, VarianteProducto, Orden, DetalleOrden
+from utils import fast_json
+
+
+async def _both_paths(client: AsyncClient, url: str, monkeypatch) -> tuple:
+    """Pide lo mismo por response_model y por el camino rápido de fast_json."""
+    monkeypatch.setattr(fast_json, "FAST_JSON_ENABLED", False)
+    standard = await client.get(url)
+    monkeypatch.setattr(fast_json, "FAST_JSON_ENABLED", True)
+    fast = await client.get(url)
+    assert standard.status_code == fast.status_code == status.HTTP_200_OK
+    return standard.json(), fast.json()
+
+@pytest.mark.asyncio
+async def test_sales_fast_path_matches_response_model(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, test_category: Categoria, monkeypatch):
+    producto = Producto(nombre="Buzo", precio=25000.5, sku="SKU-ADMIN-1", stock=10, categoria_id=test_category.id)
+    producto.variantes = [
+        VarianteProducto(tamanio="M", color="Gris", cantidad_en_stock=5),
+        VarianteProducto(tamanio="L", color="Gris", cantidad_en_stock=5),
+    ]
+    db_sql.add(producto)
+    await db_sql.flush()
+    con_detalles = Orden(usuario_id="u-1", monto_total=50001.00, estado="Enviado", estado_pago="pagado")
+    con_detalles.detalles = [
+        DetalleOrden(variante_producto_id=v.id, cantidad=1, precio_en_momento_compra=25000.50)
+        for v in producto.variantes
+    ]
+    sin_detalles = Orden(usuario_id="u-2", monto_total=0, estado=None, estado_pago=None)
+    db_sql.add_all([con_detalles, sin_detalles])
+    await db_sql.commit()
+
+    standard, fast = await _both_paths(admin_authenticated_client, "/api/admin/sales", monkeypatch)
+    assert fast == standard
+    assert [len(orden["detalles"]) for orden in fast] == [2, 0]
+
+@pytest.mark.asyncio
+async def test_users_fast_path_matches_response_model(admin_authenticated_client: AsyncClient, db_nosql, monkeypatch):
+    # Campos que UserOut no tiene (arriba y dentro del teléfono) y otros que faltan y van por default
+    await db_nosql.users.insert_one({
+        "email": "extra@example.com", "name": "Con", "last_name": "Extras", "role": "user",
+        "phone": {"prefix": "+54", "number": "1122334455", "verificado": True},
+        "hashed_password": "x", "creado_en": "2025-01-01", "direcciones": [],
+    })
+    await db_nosql.users.insert_one({"email": "min@example.com", "name": "Sin", "last_name": "Rol"})
+
+    standard, fast = await _both_paths(admin_authenticated_client, "/api/admin/users", monkeypatch)
+    assert fast == standard
+    sin_rol = next(user for user in fast if user["email"] == "min@example.com")
+    assert sin_rol["role"] == "user" and sin_rol["phone"] is None
+
+@pytest.mark.asyncio
+async def test_users_fast_path_validates_required_fields(admin_authenticated_client: AsyncClient, db_nosql, monkeypatch):
+    # Sin last_name el schema no valida: el camino rápido tiene que fallar igual, no inventar un null
+    await db_nosql.users.insert_one({"email": "roto@example.com", "name": "Incompleto"})
+    for enabled in (False, True):
+        monkeypatch.setattr(fast_json, "FAST_JSON_ENABLED", enabled)
+        with pytest.raises(Exception, match="last_name"):
+            await admin_authenticated_client.get("/api/admin/users")
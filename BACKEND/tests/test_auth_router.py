@@ -80,4 +80,57 @@ async def test_get_current_user(authenticated_client: AsyncClient, test_user: di
     # --- FIX ---
     # El schema UserOut no tiene 'username', usamos 'name'
     assert data["name"] == test_user["name"]
-    assert data["email"] == test_user["email"]
\ No newline at end of file
+    assert data["email"] == test_user["email"]
+
+@pytest.mark.asyncio
+async def test_authenticated_requests_reuse_the_cached_user(authenticated_client: AsyncClient):
+    from services import principal_cache
+    for _ in range(5):
+        assert (await authenticated_client.get("/api/auth/me")).status_code == status.HTTP_200_OK
+        assert (await authenticated_client.get("/api/cart/")).status_code == status.HTTP_200_OK
+
+    stats = (await authenticated_client.get("/health/metrics")).json()["principal_cache"]
+    assert stats["mongo_lookups"] == 1
+    assert stats["hits"] == 9
+
+
+@pytest.mark.asyncio
+async def test_role_change_invalidates_the_cached_user(authenticated_client: AsyncClient, db_nosql, test_user: dict):
+    from routers import admin_router
+    from schemas import user_schemas
+    assert (await authenticated_client.get("/api/admin/expenses")).status_code == status.HTTP_403_FORBIDDEN
+
+    # Escribir directo en Mongo no alcanza: el usuario sigue cacheado con el rol viejo
+    await db_nosql.users.update_one({"_id": test_user["_id"]}, {"$set": {"role": "admin"}})
+    assert (await authenticated_client.get("/api/admin/expenses")).status_code == status.HTTP_403_FORBIDDEN
+
+    # Por el endpoint de admin, el cambio vale desde el próximo request
+    await admin_router.update_user_role(str(test_user["_id"]), user_schemas.UserUpdateRole(role="admin"), db=db_nosql)
+    assert (await authenticated_client.get("/api/admin/expenses")).status_code == status.HTTP_200_OK
+
+
+@pytest.mark.asyncio
+async def test_login_returns_503_when_hashing_pool_is_saturated(client: AsyncClient, test_user: dict, monkeypatch):
+    from utils import security
+    monkeypatch.setattr(security, "PASSWORD_HASH_MAX_PENDING", 0)
+    response = await client.post("/api/auth/login", data={"username": test_user["email"], "password": "password"})
+    assert response.status_code == status.HTTP_503_SERVICE_UNAVAILABLE
+    assert response.headers["retry-after"] == "1"
+
+
+@pytest.mark.asyncio
+async def test_login_rehashes_password_when_cost_changes(client: AsyncClient, db_nosql, test_user: dict, monkeypatch):
+    from passlib.context import CryptContext
+    from utils import security
+    monkeypatch.setattr(security, "PASSWORD_REHASH_ON_LOGIN", True)
+    monkeypatch.setattr(security, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=5))
+    old_hash = test_user["hashed_password"]
+
+    response = await client.post("/api/auth/login", data={"username": test_user["email"], "password": "password"})
+    assert response.status_code == status.HTTP_200_OK
+    new_hash = (await db_nosql.users.find_one({"_id": test_user["_id"]}))["hashed_password"]
+    assert new_hash != old_hash and new_hash.startswith("$2b$05$")
+
+    # Con el hash ya al día no se vuelve a escribir
+    await client.post("/api/auth/login", data={"username": test_user["email"], "password": "password"})
+    assert (await db_nosql.users.find_one({"_id": test_user["_id"]}))["hashed_password"] == new_hash
@@ -45,3 +45,89 @@ async def test_remove_item_from_cart(authenticated_client: AsyncClient, test_var
     assert response.status_code == status.HTTP_200_OK
     data = response.json()
     assert len(data["items"]) == 0
+
+@pytest.mark.asyncio
+async def test_add_same_item_twice_increments_quantity(authenticated_client: AsyncClient, test_variant: dict):
+    await authenticated_client.post("/api/cart/items", json=test_variant)
+    other = {**test_variant, "variante_id": test_variant["variante_id"] + 1, "name": "Otro"}
+    await authenticated_client.post("/api/cart/items", json=other)
+    response = await authenticated_client.post("/api/cart/items", json={**test_variant, "quantity": 2})
+    assert response.status_code == status.HTTP_200_OK
+    items = {i["variante_id"]: i for i in response.json()["items"]}
+    assert items[test_variant["variante_id"]]["quantity"] == test_variant["quantity"] + 2
+    assert items[test_variant["variante_id"]]["name"] == test_variant["name"]
+    assert items[other["variante_id"]]["quantity"] == other["quantity"]
+
+@pytest.mark.asyncio
+async def test_remove_item_without_cart_is_404(authenticated_client: AsyncClient):
+    response = await authenticated_client.delete("/api/cart/items/123")
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+@pytest.mark.asyncio
+async def test_batch_cart_operations(authenticated_client: AsyncClient, test_variant: dict):
+    vid = test_variant["variante_id"]
+    otro = {**test_variant, "variante_id": vid + 1, "name": "Otro"}
+    tercero = {**test_variant, "variante_id": vid + 2, "name": "Tercero"}
+    response = await authenticated_client.patch("/api/cart/", json={"operations": [
+        {"op": "add", "item": test_variant},
+        {"op": "add", "item": otro},
+        {"op": "add", "item": tercero},
+        {"op": "increment", "variante_id": vid, "delta": 4},
+        {"op": "set_quantity", "variante_id": otro["variante_id"], "quantity": 7},
+        {"op": "remove", "variante_id": tercero["variante_id"]},
+        {"op": "increment", "variante_id": 999, "delta": 1},  # No está: no pasa nada
+    ]})
+    assert response.status_code == status.HTTP_200_OK
+    items = {i["variante_id"]: i["quantity"] for i in response.json()["items"]}
+    assert items == {vid: test_variant["quantity"] + 4, otro["variante_id"]: 7}
+
+    response = await authenticated_client.patch("/api/cart/", json={"operations": [
+        {"op": "increment", "variante_id": vid, "delta": -100},
+        {"op": "set_quantity", "variante_id": otro["variante_id"], "quantity": 2},
+    ]})
+    assert [(i["variante_id"], i["quantity"]) for i in response.json()["items"]] == [(otro["variante_id"], 2)]
+
+    response = await authenticated_client.patch("/api/cart/", json={"operations": [{"op": "clear"}]})
+    assert response.json()["items"] == []
+    assert (await authenticated_client.get("/api/cart/")).json()["items"] == []
+
+@pytest.mark.asyncio
+async def test_batch_cart_rejects_invalid_operations(authenticated_client: AsyncClient):
+    response = await authenticated_client.patch("/api/cart/", json={"operations": [{"op": "explode"}]})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+    response = await authenticated_client.patch("/api/cart/", json={"operations": []})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+@pytest.mark.asyncio
+async def test_merge_guest_cart_into_user_cart(authenticated_client: AsyncClient, db_nosql, test_user: dict, test_variant: dict):
+    other = {**test_variant, "variante_id": test_variant["variante_id"] + 1, "quantity": 3}
+    await db_nosql.carts.insert_one({"guest_session_id": "guest-1", "items": [{**test_variant, "quantity": 2}, other, {"roto": True}]})
+    await authenticated_client.post("/api/cart/items", json=test_variant)
+
+    response = await authenticated_client.post("/api/cart/merge", headers={"X-Guest-Session-ID": "guest-1"})
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["user_id"] == str(test_user["_id"])
+    assert {item["variante_id"]: item["quantity"] for item in data["items"]} == {
+        test_variant["variante_id"]: 3, other["variante_id"]: 3
+    }
+    assert await db_nosql.carts.find_one({"guest_session_id": "guest-1"}) is None
+
+    # Repetir el merge no vuelve a sumar
+    again = await authenticated_client.post("/api/cart/merge", headers={"X-Guest-Session-ID": "guest-1"})
+    assert again.json()["items"] == data["items"]
+
+@pytest.mark.asyncio
+async def test_merge_requires_login(client: AsyncClient):
+    response = await client.post("/api/cart/merge", headers={"X-Guest-Session-ID": "guest-1"})
+    assert response.status_code in (status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN)
+
+@pytest.mark.asyncio
+async def test_cart_indexes_are_created(db_nosql):
+    from services import cart_service
+    await cart_service.ensure_indexes(db_nosql)
+    await cart_service.ensure_indexes(db_nosql)  # Idempotente
+    indexes = await db_nosql.carts.index_information()
+    assert indexes["ux_carts_user_id"]["unique"]
+    assert indexes["ux_carts_guest_session_id"]["unique"]
+    assert indexes["ttl_carts_guest_last_updated"]["expireAfterSeconds"] == cart_service.GUEST_CART_TTL_DAYS * 24 * 3600
@@ -0,0 +1,115 @@
+# En tests/test_catalog_index.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from schemas.product_schemas import ProductFilters
+from services.catalog_index import CatalogIndex, fold, tokenize
+
+
+def _producto(id, nombre, descripcion=None, material=None, color=None, talle=None, precio=10, categoria_id=1):
+    return SimpleNamespace(id=id, nombre=nombre, descripcion=descripcion, material=material,
+                           color=color, talle=talle, precio=precio, categoria_id=categoria_id)
+
+def _index(*productos) -> CatalogIndex:
+    index = CatalogIndex()
+    index._load_rows(productos)
+    return index
+
+
+def test_tokenize_folds_accents_plurals_and_stopwords():
+    assert fold("Algodón ÑANDÚ") == "algodon nandu"
+    assert tokenize("Remeras de Algodón") == ["remera", "algodon"]
+    assert tokenize("Pantalones") == ["pantalon"]
+
+def test_search_ranks_name_matches_above_description_matches():
+    index = _index(
+        _producto(1, "Campera de jean", descripcion="Ideal para usar con una remera"),
+        _producto(2, "Remera oversize"),
+    )
+    ids, total = index.search("remera", ProductFilters())
+    assert ids == [2, 1]
+    assert total == 2
+
+def test_search_treats_last_term_as_prefix_and_requires_all_terms():
+    index = _index(
+        _producto(1, "Remera básica", color="Negro"),
+        _producto(2, "Remera estampada", color="Blanco"),
+        _producto(3, "Buzo negro"),
+    )
+    assert index.search("remera neg", ProductFilters())[0] == [1]
+    assert index.search("REMERAS basicas", ProductFilters())[0] == [1]
+    assert index.search("campera", ProductFilters()) == ([], 0)
+
+def test_search_combines_with_catalog_filters():
+    index = _index(
+        _producto(1, "Remera", material="Algodón", precio=100, categoria_id=1),
+        _producto(2, "Remera", material="Poliéster", precio=50, categoria_id=1),
+        _producto(3, "Remera", material="Algodón", precio=50, categoria_id=2),
+    )
+    ids, _ = index.search("remera", ProductFilters(material="algodon", precio_max=80))
+    assert ids == [3]
+
+def test_upsert_and_remove_keep_index_in_sync():
+    index = _index(_producto(1, "Remera"))
+    index.upsert(_producto(1, "Buzo"))
+    index.upsert(_producto(2, "Remera"))
+    assert index.search("buzo", ProductFilters())[0] == [1]
+    assert index.search("remera", ProductFilters())[0] == [2]
+
+    index.remove(2)
+    assert index.search("remera", ProductFilters()) == ([], 0)
+
+def test_facets_count_each_field_without_its_own_filter():
+    index = _index(
+        _producto(1, "Remera", material="Algodón", color="Negro", talle="M", precio=10, categoria_id=1),
+        _producto(2, "Remera", material="Algodón", color="Blanco", talle="L", precio=20, categoria_id=1),
+        _producto(3, "Buzo", material="Lana", color="Negro", talle="M", precio=40, categoria_id=2),
+    )
+    facets = index.facets(ProductFilters(color="negro"), price_buckets=3)
+
+    assert facets["total"] == 2
+    # El color no se filtra a sí mismo, así se puede ofrecer "Blanco (1)"
+    assert facets["color"] == [{"valor": "Negro", "cantidad": 2}, {"valor": "Blanco", "cantidad": 1}]
+    assert facets["material"] == [{"valor": "Algodón", "cantidad": 1}, {"valor": "Lana", "cantidad": 1}]
+    assert facets["categoria_id"] == [{"valor": 1, "cantidad": 1}, {"valor": 2, "cantidad": 1}]
+    assert [b["cantidad"] for b in facets["precio"]] == [1, 0, 1]
+
+def test_facets_follow_upserts_and_removals():
+    index = _index(_producto(1, "Remera", color="Negro", precio=10))
+    index.facets(ProductFilters(precio_max=15))  # Deja calculados los bitmaps de precio
+
+    index.upsert(_producto(2, "Remera", color="Negro", precio=12))
+    facets = index.facets(ProductFilters(precio_max=15))
+    assert facets["total"] == 2
+    assert facets["color"] == [{"valor": "Negro", "cantidad": 2}]
+
+    index.upsert(_producto(1, "Remera", color="Rojo", precio=10))
+    index.remove(2)
+    facets = index.facets(ProductFilters(precio_max=15))
+    assert facets["total"] == 1
+    assert facets["color"] == [{"valor": "Rojo", "cantidad": 1}]
+
+
+@pytest.mark.asyncio
+async def test_changes_while_the_rebuild_query_is_in_flight_are_not_lost():
+    index = _index(_producto(1, "Remera"), _producto(2, "Buzo"))
+    query_sent, release = asyncio.Event(), asyncio.Event()
+
+    class SlowDB:
+        async def execute(self, statement):
+            query_sent.set()
+            await release.wait()
+            # La foto es de antes de los cambios del admin
+            return SimpleNamespace(all=lambda: [_producto(1, "Remera"), _producto(2, "Buzo")])
+
+    rebuild = asyncio.create_task(index._rebuild(SlowDB()))
+    await query_sent.wait()
+    index.upsert(_producto(3, "Campera"))
+    index.remove(2)
+    release.set()
+    await rebuild
+
+    assert index.search("campera", ProductFilters())[0] == [3]
+    assert index.search("buzo", ProductFilters()) == ([], 0)
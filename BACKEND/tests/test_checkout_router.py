@@ -0,0 +1,282 @@
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from fastapi import status
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Producto, VarianteProducto
+
+
+@pytest_asyncio.fixture
+async def variants(db_sql: AsyncSession, test_category):
+    producto = Producto(nombre="Remera Checkout", precio=1500, sku="CHK-1", stock=0, categoria_id=test_category.id)
+    db_sql.add(producto)
+    await db_sql.flush()
+    rows = [
+        VarianteProducto(producto_id=producto.id, tamanio=talle, color="Negro", cantidad_en_stock=stock)
+        for talle, stock in (("S", 5), ("M", 1), ("L", 0))
+    ]
+    db_sql.add_all(rows)
+    await db_sql.flush()
+    ids = [row.id for row in rows]
+    await db_sql.commit()
+    return ids
+
+
+def _item(variante_id, quantity, price=1.0):
+    return {"variante_id": variante_id, "quantity": quantity, "price": price, "name": "lo que diga el cliente"}
+
+
+@pytest.mark.asyncio
+async def test_create_preference_uses_db_prices_in_one_query(client: AsyncClient, db_sql, variants, fake_mercadopago):
+    statements = []
+    engine = db_sql.bind.sync_engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        response = await client.post("/api/checkout/create_preference", json={
+            "guest_session_id": "guest-1", "items": [_item(variants[0], 2), _item(variants[1], 1)],
+        })
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert response.status_code == status.HTTP_200_OK
+    sent = fake_mercadopago.preferences[response.json()["preference_id"]]
+    assert [(i["unit_price"], i["title"], i["quantity"]) for i in sent["items"]] == [
+        (1500.0, "Remera Checkout", 2), (1500.0, "Remera Checkout", 1)
+    ]
+    # Validación (un IN para todo el carrito) + lock de la reserva: no depende de la cantidad de items
+    assert len([s for s in statements if "FROM variantes_productos" in s]) == 2
+
+
+@pytest.mark.asyncio
+async def test_create_preference_reports_every_shortfall(client: AsyncClient, variants, fake_mercadopago):
+    response = await client.post("/api/checkout/create_preference", json={
+        "guest_session_id": "guest-1",
+        "items": [_item(variants[0], 2), _item(variants[1], 1), _item(variants[1], 1), _item(variants[2], 1), _item(99999, 1)],
+    })
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    errores = {e["variante_id"]: (e["error"], e["solicitado"], e["disponible"]) for e in response.json()["detail"]["errores"]}
+    assert errores == {
+        variants[1]: ("stock_insuficiente", 2, 1),  # Las dos líneas de la misma variante se suman
+        variants[2]: ("stock_insuficiente", 1, 0),
+        99999: ("no_existe", 1, 0),
+    }
+    assert fake_mercadopago.calls == []  # Ni se llegó a llamar a Mercado Pago
+
+
+@pytest.mark.asyncio
+async def test_validate_stored_cart(client: AsyncClient, db_nosql, variants):
+    await db_nosql.carts.insert_one({"guest_session_id": "guest-1", "items": [_item(variants[0], 2, price=1500), _item(variants[2], 1)]})
+    response = await client.post("/api/cart/validate", headers={"X-Guest-Session-ID": "guest-1"})
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["valido"] is False
+    assert data["total"] == 3000
+    assert [(i["variante_id"], i["precio_cambio"]) for i in data["items"]] == [(variants[0], False)]
+    assert [e["variante_id"] for e in data["errores"]] == [variants[2]]
+
+
+@pytest.mark.asyncio
+async def test_create_preference_retries_when_mercadopago_fails(client: AsyncClient, variants, fake_mercadopago):
+    fake_mercadopago.fail_next(2, status_code=503)
+    response = await client.post("/api/checkout/create_preference", json={"guest_session_id": "g", "items": [_item(variants[0], 1)]})
+    assert response.status_code == status.HTTP_200_OK
+    assert len(fake_mercadopago.calls) == 3
+    assert len({key for _, _, key in fake_mercadopago.calls}) == 1  # Los reintentos llevan la misma clave de idempotencia
+
+    fake_mercadopago.fail_next(3, status_code=503)
+    response = await client.post("/api/checkout/create_preference", json={"guest_session_id": "g", "items": [_item(variants[0], 1)]})
+    assert response.status_code == status.HTTP_502_BAD_GATEWAY
+
+
+@pytest.mark.asyncio
+async def test_create_preference_does_not_retry_client_errors(client: AsyncClient, variants, fake_mercadopago):
+    fake_mercadopago.fail_next(1, status_code=400)
+    response = await client.post("/api/checkout/create_preference", json={"guest_session_id": "g", "items": [_item(variants[0], 1)]})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert len(fake_mercadopago.calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_process_payment_is_idempotent_per_card_token(client: AsyncClient, fake_mercadopago):
+    first = await client.post("/payments/process-payment", json={"token": "card-tok-1"})
+    second = await client.post("/payments/process-payment", json={"token": "card-tok-1"})
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+    assert first.json()["payment_id"] == second.json()["payment_id"]
+    assert len(fake_mercadopago.payments) == 1
+
+
+@pytest.mark.asyncio
+async def test_preference_reserves_stock_until_payment(client: AsyncClient, db_sql, db_nosql, variants, fake_mercadopago):
+    from datetime import datetime, timedelta
+    from sqlalchemy import select, update
+    from sqlalchemy.orm import sessionmaker
+    from database.models import ReservaStock
+    from services import order_service, stock_reservations
+
+    # La variante M tiene 1 unidad: el primero la reserva y el segundo ya no la ve
+    first = await client.post("/api/checkout/create_preference", json={"guest_session_id": "a", "items": [_item(variants[1], 1)]})
+    assert first.status_code == status.HTTP_200_OK
+    sent = fake_mercadopago.preferences[first.json()["preference_id"]]
+    assert sent["metadata"] == {"reserva_id": first.json()["reserva_id"]}
+    assert sent["expires"] is True
+
+    second = await client.post("/api/checkout/create_preference", json={"guest_session_id": "b", "items": [_item(variants[1], 1)]})
+    assert second.status_code == status.HTTP_400_BAD_REQUEST
+    assert second.json()["detail"]["errores"][0]["disponible"] == 0
+    await db_nosql.carts.insert_one({"guest_session_id": "b", "items": [_item(variants[1], 1)]})
+    validation = (await client.post("/api/cart/validate", headers={"X-Guest-Session-ID": "b"})).json()
+    assert (validation["valido"], validation["errores"][0]["disponible"]) == (False, 0)
+
+    # Vencida, la reserva deja de contar aunque el barrendero no haya pasado
+    await db_sql.execute(update(ReservaStock).values(expira_en=datetime.utcnow() - timedelta(seconds=1)))
+    await db_sql.commit()
+    third = await client.post("/api/checkout/create_preference", json={"guest_session_id": "c", "items": [_item(variants[1], 1)]})
+    assert third.status_code == status.HTTP_200_OK
+    assert await stock_reservations.sweep_expired(sessionmaker(bind=db_sql.bind, class_=AsyncSession)) == 1
+
+    # El pago aprobado convierte la reserva: baja el stock y desaparece la reserva
+    await order_service.save_order_and_update_stock({
+        "external_reference": "c", "transaction_amount": 1500, "metadata": {"reserva_id": third.json()["reserva_id"]},
+        "additional_info": {"items": [{"id": str(variants[1]), "quantity": "1", "unit_price": "1500"}]},
+    }, db_sql, "mp-c")
+    assert (await db_sql.execute(select(ReservaStock.id))).all() == []
+    assert stock_reservations.stats()["convertidas"] == 1
+
+
+@pytest.mark.asyncio
+async def test_reservation_is_released_when_mercadopago_fails(client: AsyncClient, db_sql, variants, fake_mercadopago):
+    from sqlalchemy import select
+    from database.models import ReservaStock
+    fake_mercadopago.fail_next(1, status_code=400)
+    response = await client.post("/api/checkout/create_preference", json={"guest_session_id": "a", "items": [_item(variants[0], 1)]})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert (await db_sql.execute(select(ReservaStock.id))).all() == []
+
+
+
+@pytest.mark.asyncio
+async def test_second_checkout_of_the_same_cart_replaces_its_hold(client: AsyncClient, db_sql, variants, fake_mercadopago):
+    from sqlalchemy import select
+    from database.models import ReservaStock
+    from services import stock_reservations
+
+    cart = {"guest_session_id": "a", "items": [_item(variants[1], 1)]}
+    first = await client.post("/api/checkout/create_preference", json=cart)
+    # La única unidad de M la tiene el mismo comprador: volver a tocar "pagar" no lo bloquea
+    second = await client.post("/api/checkout/create_preference", json=cart)
+    assert first.status_code == second.status_code == status.HTTP_200_OK
+
+    holds = (await db_sql.execute(select(ReservaStock.reserva_id, ReservaStock.clave, ReservaStock.cantidad))).all()
+    assert holds == [(second.json()["reserva_id"], "a", 1)]
+    assert stock_reservations.stats()["reemplazadas"] == 1
+    # Otro comprador sigue sin verla
+    other = await client.post("/api/checkout/create_preference", json={"guest_session_id": "b", "items": [_item(variants[1], 1)]})
+    assert other.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_holds_per_buyer_are_capped(client: AsyncClient, db_sql, variants, fake_mercadopago, monkeypatch):
+    from sqlalchemy import func, select
+    from database.models import ReservaStock
+    from services import stock_reservations
+    monkeypatch.setattr(stock_reservations, "RESERVA_MAX_POR_CLAVE", 2)
+
+    ids = []
+    for quantity in (1, 2, 3):  # Tres carritos distintos del mismo comprador
+        response = await client.post("/api/checkout/create_preference", json={"guest_session_id": "a", "items": [_item(variants[0], quantity)]})
+        assert response.status_code == status.HTTP_200_OK
+        ids.append(response.json()["reserva_id"])
+
+    active = set((await db_sql.execute(select(ReservaStock.reserva_id))).scalars().all())
+    assert active == set(ids[1:])  # Se soltó la más vieja
+    assert (await db_sql.execute(select(func.sum(ReservaStock.cantidad)))).scalar_one() == 5
+
+
+@pytest.mark.asyncio
+async def test_catalog_shows_stock_net_of_active_holds(client: AsyncClient, db_sql, variants, fake_mercadopago):
+    from datetime import datetime
+    from sqlalchemy import select, update
+    from database.models import ReservaStock
+    from services import catalog_cache
+    producto_id = (await db_sql.execute(select(VarianteProducto.producto_id).where(VarianteProducto.id == variants[1]))).scalar_one()
+    await db_sql.execute(update(Producto).values(actualizado_en=datetime(2020, 1, 1)))
+    await db_sql.execute(update(VarianteProducto).values(actualizado_en=datetime(2020, 1, 1)))
+    await db_sql.commit()
+
+    def stock(payload):
+        return {v["id"]: v["cantidad_en_stock"] for v in payload["variantes"]}
+
+    listing = await client.get("/api/products/")
+    assert stock(listing.json()[0]) == {variants[0]: 5, variants[1]: 1, variants[2]: 0}
+    assert (await client.get("/api/products/?view=card")).json()[0]["en_stock"] is True
+
+    # S: 3 de 5 reservadas; M: su única unidad reservada
+    reserved = await client.post("/api/checkout/create_preference", json={
+        "guest_session_id": "a", "items": [_item(variants[0], 3), _item(variants[1], 1)],
+    })
+    assert reserved.status_code == status.HTTP_200_OK
+
+    detail = await client.get(f"/api/products/{producto_id}")
+    assert stock(detail.json()) == {variants[0]: 2, variants[1]: 0, variants[2]: 0}
+    assert stock((await client.get("/api/products/")).json()[0]) == {variants[0]: 2, variants[1]: 0, variants[2]: 0}
+    # Ninguno de los dos validadores deja pasar la versión vieja
+    for url in ("/api/products/", f"/api/products/{producto_id}"):
+        assert (await client.get(url, headers={"If-Modified-Since": listing.headers["Last-Modified"]})).status_code == status.HTTP_200_OK
+    assert (await client.get("/api/products/", headers={"If-None-Match": listing.headers["ETag"]})).status_code == status.HTTP_200_OK
+
+    # Con todo reservado, la grilla ya no lo ofrece
+    await client.post("/api/checkout/create_preference", json={"guest_session_id": "b", "items": [_item(variants[0], 2)]})
+    assert (await client.get("/api/products/?view=card")).json()[0]["en_stock"] is False
+
+    # Vencidas, vuelven a estar disponibles aunque el barrendero no haya pasado
+    await db_sql.execute(update(ReservaStock).values(expira_en=datetime(2020, 1, 1)))
+    await db_sql.commit()
+    catalog_cache.reset()  # Otro worker, o el TTL: el cache local no se entera de un vencimiento
+    assert (await client.get("/api/products/?view=card")).json()[0]["en_stock"] is True
+    assert stock((await client.get(f"/api/products/{producto_id}")).json())[variants[0]] == 5
+
+
+@pytest.mark.asyncio
+async def test_hot_variants_are_held_without_a_row_lock(client: AsyncClient, db_sql, variants, fake_mercadopago, monkeypatch):
+    from sqlalchemy import select
+    from database.models import ReservaStock
+    from services import hot_sku, stock_reservations
+    monkeypatch.setattr(hot_sku, "HOT_SKU_VARIANT_IDS", {variants[1]})
+    locked = []
+    real_lock_rows = stock_reservations.lock_rows
+    async def spy(db, columns, id_column, ids):
+        locked.extend(ids)
+        return await real_lock_rows(db, columns, id_column, ids)
+    monkeypatch.setattr(stock_reservations, "lock_rows", spy)
+
+    response = await client.post("/api/checkout/create_preference", json={
+        "guest_session_id": "a", "items": [_item(variants[0], 1), _item(variants[1], 1)],
+    })
+    assert response.status_code == status.HTTP_200_OK
+    assert locked == [variants[0]]  # La caliente la decide la ventana, no un FOR UPDATE
+    held = dict((await db_sql.execute(select(ReservaStock.variante_id, ReservaStock.cantidad))).all())
+    assert held == {variants[0]: 1, variants[1]: 1}
+
+    # Igual cuenta: otro comprador ya no ve la única unidad
+    other = await client.post("/api/checkout/create_preference", json={"guest_session_id": "b", "items": [_item(variants[1], 1)]})
+    assert other.status_code == status.HTTP_400_BAD_REQUEST
+
+
+@pytest.mark.asyncio
+async def test_non_json_error_page_from_mercadopago_is_a_502(client: AsyncClient, variants, fake_mercadopago):
+    from services import mercadopago_client
+    # Un proxy delante de MP contesta HTML: se reintenta y, si sigue, es un 502 nuestro (no un 500)
+    fake_mercadopago.fail_next(3, status_code=502, html=True)
+    response = await client.post("/api/checkout/create_preference", json={"guest_session_id": "g", "items": [_item(variants[0], 1)]})
+    assert response.status_code == status.HTTP_502_BAD_GATEWAY
+    assert len(fake_mercadopago.calls) == 3
+
+    fake_mercadopago.fail_next(1, status_code=400, html=True)
+    with pytest.raises(mercadopago_client.MercadoPagoError) as exc_info:
+        await mercadopago_client.get_client().get_payment("1")
+    assert exc_info.value.status_code == 400
+    assert exc_info.value.payload["body"].startswith("<html>")
+    assert len(fake_mercadopago.calls) == 4  # Un 400 no se reintenta
@@ -0,0 +1,221 @@
+# En tests/test_cloudinary_service.py
+import asyncio
+import io
+import json
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import cloudinary
+import cloudinary.exceptions
+import pytest
+from urllib3.exceptions import ReadTimeoutError
+from fastapi import HTTPException, UploadFile
+
+from services import cloudinary_service
+
+
+def _files(*names):
+    return [UploadFile(file=io.BytesIO(b"\xff\xd8" + name.encode() * 100), filename=name) for name in names]
+
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(cloudinary_service, "UPLOAD_BACKOFF_SECONDS", 0.01)
+
+
+@pytest.fixture
+def sdk_http(monkeypatch):
+    """
+    Deja correr el uploader real del SDK y reemplaza solo su cliente HTTP (urllib3):
+    así los errores llegan envueltos igual que en producción.
+    """
+    config = cloudinary.config()
+    for name, value in (("cloud_name", "test"), ("api_key", "key"), ("api_secret", "secret")):
+        monkeypatch.setattr(config, name, value, raising=False)
+    requests = []
+
+    def install(respond):
+        def request(method, url, fields, headers, **kw):
+            requests.append({"file": dict(fields)["file"], **kw})
+            return respond(len(requests))
+        monkeypatch.setattr(cloudinary_service.cloudinary.uploader._http, "request", request)
+        return requests
+    return install
+
+
+def _response(status_code: int, body) -> SimpleNamespace:
+    data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+    return SimpleNamespace(status=status_code, data=data)
+
+
+def _read_timeout():
+    return ReadTimeoutError(None, "https://api.cloudinary.com/v1_1/test/image/upload", "Read timed out.")
+
+
+@pytest.mark.asyncio
+async def test_upload_images_runs_in_parallel_without_blocking_the_loop(monkeypatch):
+    def slow_upload(stream, **options):
+        time.sleep(0.3)  # Bloqueante, como el SDK real
+        return {"secure_url": f"https://cdn/{len(stream.read())}", "public_id": "x"}
+    monkeypatch.setattr(cloudinary_service.cloudinary.uploader, "upload", slow_upload)
+
+    ticks = 0
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+    task = asyncio.create_task(ticker())
+
+    start = time.perf_counter()
+    urls = await cloudinary_service.upload_images(_files("a.jpg", "b.jpg", "c.jpg"))
+    elapsed = time.perf_counter() - start
+    task.cancel()
+
+    assert len(urls) == 3
+    assert elapsed < 0.6  # ~ la más lenta, no la suma (0.9s)
+    assert ticks >= 15  # El loop siguió atendiendo mientras se subía
+
+
+@pytest.mark.asyncio
+async def test_upload_images_retries_transient_errors(sdk_http):
+    def respond(attempt):
+        if attempt == 1:
+            raise _read_timeout()  # El SDK lo envuelve en cloudinary.exceptions.Error
+        if attempt == 2:
+            return _response(502, "<html>502 Bad Gateway</html>")
+        return _response(200, {"secure_url": "https://cdn/ok.jpg", "public_id": "ok"})
+    requests = sdk_http(respond)
+
+    assert await cloudinary_service.upload_images(_files("a.jpg")) == ["https://cdn/ok.jpg"]
+    assert len(requests) == 3
+    # Cada intento manda el archivo entero, leído desde el principio
+    assert requests[0]["file"] == requests[2]["file"]
+    assert requests[0]["file"][1].startswith(b"\xff\xd8a.jpg")
+
+
+@pytest.mark.asyncio
+async def test_upload_images_does_not_retry_errors_reported_by_the_api(sdk_http):
+    requests = sdk_http(lambda attempt: _response(400, {"error": {"message": "Invalid image file"}}))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await cloudinary_service.upload_images(_files("a.jpg"))
+    assert "Invalid image file" in exc_info.value.detail
+    assert len(requests) == 1
+
+
+def test_retryable_classification():
+    def wrapped(cause, message):
+        try:
+            raise cause
+        except Exception:
+            try:
+                raise cloudinary.exceptions.Error(message)
+            except cloudinary.exceptions.Error as error:
+                return error
+
+    assert cloudinary_service._is_retryable(wrapped(_read_timeout(), "Unexpected error - ReadTimeoutError(...)"))
+    assert cloudinary_service._is_retryable(wrapped(ConnectionResetError(), "Socket error: ConnectionResetError()"))
+    assert cloudinary_service._is_retryable(cloudinary.exceptions.Error("Error parsing server response (503) - b'<html>'. Got - ..."))
+    assert cloudinary_service._is_retryable(cloudinary.exceptions.Error("Rate Limit Exceeded"))
+    assert not cloudinary_service._is_retryable(cloudinary.exceptions.Error("Error parsing server response (404) - b'<html>'. Got - ..."))
+    assert not cloudinary_service._is_retryable(cloudinary.exceptions.Error("Invalid image file"))
+    assert not cloudinary_service._is_retryable(ValueError("bug"))
+
+
+@pytest.mark.asyncio
+async def test_upload_images_does_not_retry_bad_requests_and_cleans_up(monkeypatch):
+    calls, destroyed = [], []
+    def upload(stream, **options):
+        calls.append(1)
+        if b"bad" in stream.read():
+            raise cloudinary.exceptions.BadRequest("Invalid image file")
+        return {"secure_url": "https://cdn/good.jpg", "public_id": "good"}
+    monkeypatch.setattr(cloudinary_service.cloudinary.uploader, "upload", upload)
+    monkeypatch.setattr(cloudinary_service.cloudinary.uploader, "destroy", lambda public_id: destroyed.append(public_id))
+
+    with pytest.raises(HTTPException) as exc_info:
+        await cloudinary_service.upload_images(_files("good.jpg", "bad.jpg"))
+    assert "bad.jpg" in exc_info.value.detail
+    assert len(calls) == 2  # Un intento por archivo: un 400 no se reintenta
+    assert destroyed == ["good"]  # La que sí subió no queda huérfana
+
+
+@pytest.mark.asyncio
+async def test_upload_images_times_out(monkeypatch, sdk_http):
+    monkeypatch.setattr(cloudinary_service, "UPLOAD_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(cloudinary_service, "UPLOAD_MAX_ATTEMPTS", 2)
+    active, overlaps = [], []
+    def respond(attempt):
+        # El timeout lo aplica urllib3 y el SDK lo tira al terminar el intento
+        overlaps.append(len(active))
+        active.append(1)
+        time.sleep(0.1)
+        active.pop()
+        raise _read_timeout()
+    requests = sdk_http(respond)
+
+    with pytest.raises(HTTPException):
+        await cloudinary_service.upload_images(_files("a.jpg"))
+    assert [r["timeout"] for r in requests] == [0.05, 0.05]
+    assert overlaps == [0, 0]  # El reintento no arranca mientras el intento anterior sigue leyendo
+
+
+@pytest.mark.asyncio
+async def test_large_files_are_uploaded_in_chunks(monkeypatch):
+    monkeypatch.setattr(cloudinary_service, "LARGE_FILE_BYTES", 100)
+    received = {}
+    def upload_large(stream, chunk_size, **options):
+        with stream:  # El SDK lo cierra al salir; el wrapper no tiene que cerrar el archivo real
+            received["size"] = len(stream.read())
+        return {"secure_url": "https://cdn/big.jpg", "public_id": "big"}
+    monkeypatch.setattr(cloudinary_service.cloudinary.uploader, "upload_large", upload_large)
+
+    files = _files("big.jpg")
+    assert await cloudinary_service.upload_images(files) == ["https://cdn/big.jpg"]
+    assert received["size"] == 2 + 7 * 100
+    assert not files[0].file.closed
+
+
+@pytest.mark.asyncio
+async def test_same_content_is_uploaded_only_once(monkeypatch, db_sql):
+    uploads = []
+    def upload(stream, **options):
+        uploads.append(stream.read())
+        return {"secure_url": f"https://cdn/{len(uploads)}.jpg", "public_id": f"void_ecommerce_products/{len(uploads)}"}
+    monkeypatch.setattr(cloudinary_service.cloudinary.uploader, "upload", upload)
+
+    # Dentro del mismo pedido: dos archivos con el mismo contenido (distinto nombre) suben una vez
+    first = await cloudinary_service.upload_images(_files("a.jpg", "b.jpg") + [UploadFile(file=io.BytesIO(b"\xff\xd8" + b"a.jpg" * 100), filename="copia.jpg")], db=db_sql)
+    assert first == ["https://cdn/1.jpg", "https://cdn/2.jpg", "https://cdn/1.jpg"]
+    assert len(uploads) == 2
+
+    # En otro pedido, la misma foto reutiliza la URL sin subir nada
+    second = await cloudinary_service.upload_images(_files("b.jpg", "c.jpg"), db=db_sql)
+    assert second == ["https://cdn/2.jpg", "https://cdn/3.jpg"]
+    assert len(uploads) == 3
+
+
+@pytest.mark.asyncio
+async def test_image_index_listing_and_prune(monkeypatch, admin_authenticated_client, db_sql, test_product_sql):
+    from sqlalchemy import update
+    from database.models import ImagenSubida, Producto
+    monkeypatch.setattr(cloudinary_service.cloudinary.uploader, "upload",
+                        lambda stream, **o: {"secure_url": f"https://cdn/{stream.read()[2:7].decode()}", "public_id": "p"})
+    product_id = test_product_sql.id
+    await cloudinary_service.upload_images(_files("a.jpg", "b.jpg"), db=db_sql)
+    await db_sql.execute(update(Producto).where(Producto.id == product_id).values(urls_imagenes=["https://cdn/a.jpg"]))
+    await db_sql.execute(update(ImagenSubida).values(ultimo_uso_en=datetime(2020, 1, 1)))
+    await db_sql.commit()
+
+    listing = await admin_authenticated_client.get("/api/admin/images")
+    assert sorted(img["url"] for img in listing.json()) == ["https://cdn/a.jpg", "https://cdn/b.jpg"]
+
+    pruned = await admin_authenticated_client.delete("/api/admin/images/prune?unused_days=30")
+    assert pruned.status_code == 200
+    assert pruned.json()["eliminadas"] == 1
+    assert [img["url"] for img in pruned.json()["imagenes"]] == ["https://cdn/b.jpg"]  # a.jpg la usa un producto
+
+    listing = await admin_authenticated_client.get("/api/admin/images")
+    assert [img["url"] for img in listing.json()] == ["https://cdn/a.jpg"]
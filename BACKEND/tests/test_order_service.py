@@ -0,0 +1,223 @@
+# En tests/test_order_service.py
+import asyncio
+
+import pytest
+import pytest_asyncio
+from fastapi import HTTPException
+from sqlalchemy import event, func, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Base, Categoria, DescuentoFlash, DetalleOrden, Orden, Producto, VarianteProducto
+from services import hot_sku, order_service
+
+
+def _payment(payment_id, *lines):
+    return {
+        "id": payment_id, "status": "approved", "external_reference": f"user-{payment_id}", "transaction_amount": 100,
+        "additional_info": {"items": [{"id": str(v), "quantity": str(q), "unit_price": "100"} for v, q in lines]},
+    }
+
+
+@pytest_asyncio.fixture
+async def variants(db_sql: AsyncSession, test_category):
+    producto = Producto(nombre="Buzo", precio=100, sku="ORD-1", stock=0, categoria_id=test_category.id)
+    db_sql.add(producto)
+    await db_sql.flush()
+    rows = [VarianteProducto(producto_id=producto.id, tamanio=t, color="Gris", cantidad_en_stock=s) for t, s in (("S", 5), ("M", 2))]
+    db_sql.add_all(rows)
+    await db_sql.flush()
+    ids = [row.id for row in rows]
+    await db_sql.commit()
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_order_is_saved_with_one_update_and_one_insert(db_sql, variants):
+    s, m = variants
+    statements = []
+    engine = db_sql.bind.sync_engine
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[0])
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        # Las líneas vienen desordenadas y con una variante repetida
+        await order_service.save_order_and_update_stock(_payment(1, (m, 1), (s, 2), (s, 1)), db_sql, "1")
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+
+    assert statements.count("UPDATE") == 1
+    assert statements.count("INSERT") == 2  # La orden y todos sus detalles de una vez
+    stocks = dict((await db_sql.execute(select(VarianteProducto.id, VarianteProducto.cantidad_en_stock))).all())
+    assert stocks == {s: 2, m: 1}
+    assert (await db_sql.execute(select(func.count()).select_from(DetalleOrden))).scalar_one() == 3
+
+
+@pytest.mark.asyncio
+async def test_shortfall_on_any_line_touches_nothing(db_sql, variants):
+    s, m = variants
+    with pytest.raises(order_service.StockInsuficiente):
+        await order_service.save_order_and_update_stock(_payment(2, (s, 1), (m, 3)), db_sql, "2")
+    stocks = dict((await db_sql.execute(select(VarianteProducto.id, VarianteProducto.cantidad_en_stock))).all())
+    assert stocks == {s: 5, m: 2}
+    assert (await db_sql.execute(select(func.count()).select_from(Orden))).scalar_one() == 0
+
+
+@pytest_asyncio.fixture
+async def file_db(tmp_path):
+    """Base SQLite en archivo: cada sesión usa su propia conexión, como en producción."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'stress.db'}", connect_args={"timeout": 30})
+    factory = sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with factory() as db:
+        db.add(Categoria(id=1, nombre="Drop"))
+        db.add(Producto(id=1, nombre="Hot", precio=100, sku="HOT", stock=0, categoria_id=1))
+        db.add(VarianteProducto(id=1, producto_id=1, tamanio="M", color="Negro", cantidad_en_stock=10))
+        db.add(VarianteProducto(id=2, producto_id=1, tamanio="L", color="Negro", cantidad_en_stock=100))
+        await db.commit()
+    yield factory
+    await engine.dispose()
+
+
+async def _fire_webhooks(factory, fake_mercadopago, count: int) -> list:
+    for payment_id in range(1, count + 1):
+        # La mitad de los pagos trae también otra variante, en orden inverso
+        lines = [(1, 1), (2, 1)] if payment_id % 2 else [(2, 1), (1, 1)]
+        fake_mercadopago.add_payment(_payment(payment_id, *lines))
+
+    async def webhook(payment_id):
+        async with factory() as db:
+            try:
+                return await order_service.process_payment_notification(db, str(payment_id))
+            except order_service.StockInsuficiente:
+                return "fallido"
+
+    return await asyncio.gather(*(webhook(payment_id) for payment_id in range(1, count + 1)))
+
+
+async def _stock_summary(factory) -> dict:
+    async with factory() as db:
+        return {
+            "hot": (await db.get(VarianteProducto, 1)).cantidad_en_stock,
+            "other": (await db.get(VarianteProducto, 2)).cantidad_en_stock,
+            "orders": (await db.execute(select(func.count()).select_from(Orden))).scalar_one(),
+            "sold_hot": (await db.execute(select(func.coalesce(func.sum(DetalleOrden.cantidad), 0)).where(DetalleOrden.variante_producto_id == 1))).scalar_one(),
+        }
+
+
+@pytest.mark.asyncio
+async def test_parallel_webhooks_never_oversell_a_hot_variant(file_db, fake_mercadopago):
+    """Muchos pagos aprobados a la vez contra la misma variante, cada uno con su conexión."""
+    results = await _fire_webhooks(file_db, fake_mercadopago, 40)
+    summary = await _stock_summary(file_db)
+
+    assert results.count("procesado") == summary["orders"] > 0
+    assert summary["hot"] >= 0
+    assert summary["sold_hot"] + summary["hot"] == 10  # Ni una unidad de más ni de menos
+    assert summary["other"] == 100 - summary["orders"]  # Las órdenes fallidas no descontaron la otra variante
+
+
+@pytest.mark.asyncio
+async def test_flash_mode_groups_decrements_per_window(file_db, fake_mercadopago, monkeypatch):
+    monkeypatch.setattr(hot_sku, "HOT_SKU_VARIANT_IDS", {1})
+    monkeypatch.setattr(hot_sku, "HOT_SKU_WINDOW_MS", 20)
+    monkeypatch.setattr(hot_sku, "AsyncSessionLocal", file_db)
+
+    results = await _fire_webhooks(file_db, fake_mercadopago, 40)
+    summary = await _stock_summary(file_db)
+    stats = hot_sku.stats()
+
+    assert results.count("procesado") == summary["orders"] == 10  # Cada orden recibió su propio sí/no
+    assert (summary["hot"], summary["sold_hot"], summary["other"]) == (0, 10, 90)
+    assert (stats["aceptados"], stats["rechazados"]) == (10, 30)
+    assert stats["ventanas"] < 10  # Muchos pedidos por UPDATE, no uno por orden
+
+
+@pytest.mark.asyncio
+async def test_flash_mode_returns_stock_when_the_order_fails(file_db, monkeypatch):
+    monkeypatch.setattr(hot_sku, "HOT_SKU_VARIANT_IDS", {1})
+    monkeypatch.setattr(hot_sku, "AsyncSessionLocal", file_db)
+
+    async with file_db() as db:
+        await order_service.save_order_and_update_stock(_payment(1, (1, 2)), db, "1")
+    async with file_db() as db:
+        with pytest.raises(HTTPException):  # Mismo payment_id: la orden choca con el índice único
+            await order_service.save_order_and_update_stock(_payment(1, (1, 2)), db, "1")
+
+    summary = await _stock_summary(file_db)
+    assert (summary["hot"], summary["orders"]) == (8, 1)
+    assert hot_sku.stats()["devueltos"] == 1
+    async with file_db() as db:
+        assert (await db.execute(select(func.count()).select_from(DescuentoFlash))).scalar_one() == 0
+
+
+@pytest.mark.asyncio
+async def test_flash_window_db_error_is_retryable_not_out_of_stock(file_db, monkeypatch):
+    monkeypatch.setattr(hot_sku, "HOT_SKU_VARIANT_IDS", {1})
+    monkeypatch.setattr(hot_sku, "AsyncSessionLocal", file_db)
+
+    async def deadlock(*args):
+        raise OperationalError("UPDATE variantes_productos", {}, Exception("Deadlock found"))
+    monkeypatch.setattr(hot_sku, "_apply", deadlock)
+
+    async with file_db() as db:
+        # No es StockInsuficiente: el inbox lo reintenta en vez de mandarlo a fallido
+        with pytest.raises(HTTPException):
+            await order_service.save_order_and_update_stock(_payment(1, (1, 1)), db, "1")
+    assert hot_sku.stats()["ventanas_fallidas"] == 1
+    assert (await _stock_summary(file_db))["hot"] == 10
+
+
+@pytest.mark.asyncio
+async def test_flash_decrement_orphaned_by_a_crash_is_reconciled(file_db, monkeypatch):
+    monkeypatch.setattr(hot_sku, "AsyncSessionLocal", file_db)
+    monkeypatch.setattr(hot_sku, "HOT_SKU_RECONCILE_AFTER_SECONDS", 0)
+
+    # El descuento se commiteó y el proceso "se cayó" antes de guardar la orden
+    assert await hot_sku.decrement(1, 3, "lote-1", "mp-1") == (True, 1)
+    assert (await _stock_summary(file_db))["hot"] == 7
+
+    await asyncio.sleep(0.01)
+    assert await hot_sku.reconcile() == 1
+    assert (await _stock_summary(file_db))["hot"] == 10
+    assert await hot_sku.reconcile() == 0  # No se devuelve dos veces
+
+    # Una orden que llegue tarde para ese lote ya no puede usar esas unidades
+    async with file_db() as db:
+        with pytest.raises(hot_sku.VentanaFallida):
+            await hot_sku.confirm(db, "lote-1", 1)
+
+
+@pytest.mark.asyncio
+async def test_runtime_orphan_is_reconciled_without_a_restart(file_db, monkeypatch):
+    monkeypatch.setattr(hot_sku, "AsyncSessionLocal", file_db)
+    monkeypatch.setattr(hot_sku, "HOT_SKU_RECONCILE_AFTER_SECONDS", 0)
+    monkeypatch.setattr(hot_sku, "HOT_SKU_RECONCILE_EVERY_SECONDS", 0.02)
+    hot_sku.start()
+    try:
+        # Con el proceso ya andando: la orden no se guardó y la devolución también falló
+        monkeypatch.setattr(hot_sku, "restore", _failing_restore(hot_sku.restore))
+        assert await hot_sku.decrement(1, 3, "lote-1", "mp-1") == (True, 1)
+        await order_service._undo_hot("lote-1")
+        assert (await _stock_summary(file_db))["hot"] == 7
+
+        for _ in range(100):
+            if (await _stock_summary(file_db))["hot"] == 10:
+                break
+            await asyncio.sleep(0.01)
+        assert (await _stock_summary(file_db))["hot"] == 10
+        assert hot_sku.stats()["reconciliados"] == 1
+    finally:
+        await hot_sku.stop()
+
+
+def _failing_restore(restore):
+    """La primera devolución (la de _undo_hot) falla; las de la reconciliación andan."""
+    calls = []
+    async def flaky(lote, session_factory=None):
+        calls.append(lote)
+        if len(calls) == 1:
+            raise ConnectionError("se cayó la base")
+        return await restore(lote, session_factory)
+    return flaky
@@ -4,6 +4,7 @@ from httpx import AsyncClient
 from fastapi import status
 from sqlalchemy.ext.asyncio import AsyncSession
 from database.models import Producto, Categoria
+from services import catalog_cache
 
 @pytest.mark.asyncio
 async def test_get_products(client: AsyncClient, test_product_sql: Producto):
@@ -69,4 +70,526 @@ async def test_delete_product_as_admin(admin_authenticated_client: AsyncClient,
 @pytest.mark.asyncio
 async def test_delete_product_not_found(admin_authenticated_client: AsyncClient):
     response = await admin_authenticated_client.delete("/api/products/99999")
-    assert response.status_code == status.HTTP_404_NOT_FOUND
\ No newline at end of file
+    assert response.status_code == status.HTTP_404_NOT_FOUND
+
+# --- Paginación por cursor (keyset) ---
+
+async def _seed_products(db_sql: AsyncSession, category: Categoria, precios: list) -> list:
+    productos = [
+        Producto(nombre=f"Producto {i:02d}", precio=precio, sku=f"SKU-PAGE-{i:02d}", stock=1, categoria_id=category.id)
+        for i, precio in enumerate(precios)
+    ]
+    db_sql.add_all(productos)
+    await db_sql.commit()
+    return productos
+
+async def _walk_pages(client: AsyncClient, params: dict) -> list:
+    seen, cursor = [], ""
+    while cursor is not None:
+        response = await client.get("/api/products/", params={**params, "cursor": cursor})
+        assert response.status_code == status.HTTP_200_OK
+        seen.extend(p["id"] for p in response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+    return seen
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("sort_by", [None, "precio_asc", "precio_desc", "nombre_asc", "nombre_desc"])
+async def test_get_products_cursor_walks_every_product_once(client: AsyncClient, db_sql: AsyncSession, test_category: Categoria, sort_by):
+    # Precios repetidos a propósito para ejercitar el desempate por id
+    productos = await _seed_products(db_sql, test_category, [30, 10, 20, 10, 30, 20, 10])
+    params = {"limit": 3, **({"sort_by": sort_by} if sort_by else {})}
+
+    seen = await _walk_pages(client, params)
+
+    full = await client.get("/api/products/", params={**params, "limit": 100})
+    assert seen == [p["id"] for p in full.json()]
+    assert sorted(seen) == sorted(p.id for p in productos)
+
+@pytest.mark.asyncio
+async def test_get_products_cursor_rejects_mismatched_sort(client: AsyncClient, db_sql: AsyncSession, test_category: Categoria):
+    await _seed_products(db_sql, test_category, [1, 2, 3])
+    first = await client.get("/api/products/", params={"limit": 1, "cursor": "", "sort_by": "precio_asc"})
+    next_cursor = first.headers["X-Next-Cursor"]
+
+    response = await client.get("/api/products/", params={"limit": 1, "cursor": next_cursor, "sort_by": "nombre_asc"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = await client.get("/api/products/", params={"cursor": "no-es-un-cursor"})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+# --- Búsqueda ---
+
+@pytest.mark.asyncio
+async def test_search_products(client: AsyncClient, db_sql: AsyncSession, test_category: Categoria):
+    db_sql.add_all([
+        Producto(nombre="Campera de Algodón", precio=50, sku="SKU-SEARCH-1", stock=1, categoria_id=test_category.id),
+        Producto(nombre="Remera", descripcion="Tela de algodon peinado", precio=20, sku="SKU-SEARCH-2", stock=1, categoria_id=test_category.id),
+        Producto(nombre="Buzo", precio=30, sku="SKU-SEARCH-3", stock=1, categoria_id=test_category.id),
+    ])
+    await db_sql.commit()
+
+    response = await client.get("/api/products/search", params={"q": "ALGODÓN"})
+    assert response.status_code == status.HTTP_200_OK
+    assert [p["nombre"] for p in response.json()] == ["Campera de Algodón", "Remera"]
+    assert response.headers["X-Total-Count"] == "2"
+
+    response = await client.get("/api/products/search", params={"q": "algodon", "precio": 25})
+    assert [p["nombre"] for p in response.json()] == ["Remera"]
+
+@pytest.mark.asyncio
+async def test_search_sees_admin_updates_and_deletes(admin_authenticated_client: AsyncClient, test_product_sql: Producto):
+    response = await admin_authenticated_client.get("/api/products/search", params={"q": "test product"})
+    assert [p["id"] for p in response.json()] == [test_product_sql.id]
+
+    await admin_authenticated_client.put(f"/api/products/{test_product_sql.id}", json={"nombre": "Pantalón cargo"})
+    response = await admin_authenticated_client.get("/api/products/search", params={"q": "pantalon"})
+    assert [p["id"] for p in response.json()] == [test_product_sql.id]
+
+    await admin_authenticated_client.delete(f"/api/products/{test_product_sql.id}")
+    response = await admin_authenticated_client.get("/api/products/search", params={"q": "pantalon"})
+    assert response.json() == []
+
+
+# --- Facetas ---
+
+@pytest.mark.asyncio
+async def test_get_product_facets(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, test_category: Categoria):
+    db_sql.add_all([
+        Producto(nombre="Remera", color="Negro", material="Algodón", precio=10, sku="SKU-FACET-1", stock=1, categoria_id=test_category.id),
+        Producto(nombre="Buzo", color="Negro", material="Lana", precio=30, sku="SKU-FACET-2", stock=1, categoria_id=test_category.id),
+    ])
+    await db_sql.commit()
+
+    response = await admin_authenticated_client.get("/api/products/facets", params={"material": "algodon"})
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["total"] == 1
+    assert data["color"] == [{"valor": "Negro", "cantidad": 1}]
+    assert data["material"] == [{"valor": "Algodón", "cantidad": 1}, {"valor": "Lana", "cantidad": 1}]
+
+    # Después de un cambio del admin los conteos se actualizan sin reconstruir nada
+    buzo_id = (await admin_authenticated_client.get("/api/products/search", params={"q": "buzo"})).json()[0]["id"]
+    await admin_authenticated_client.put(f"/api/products/{buzo_id}", json={"material": "Algodón peinado"})
+    data = (await admin_authenticated_client.get("/api/products/facets", params={"material": "algodon"})).json()
+    assert data["total"] == 2
+    assert data["color"] == [{"valor": "Negro", "cantidad": 2}]
+
+
+# --- Cache del catálogo ---
+
+@pytest.mark.asyncio
+async def test_product_detail_is_served_from_cache_until_admin_writes(admin_authenticated_client: AsyncClient, test_product_sql: Producto):
+    url = f"/api/products/{test_product_sql.id}"
+    await admin_authenticated_client.get(url)
+    await admin_authenticated_client.get(url)
+    stats = (await admin_authenticated_client.get("/health/metrics")).json()["catalog_cache"]["products"]
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+    await admin_authenticated_client.put(url, json={"precio": 42.5})
+    assert (await admin_authenticated_client.get(url)).json()["precio"] == 42.5
+
+    await admin_authenticated_client.post(f"{url}/variants", json={
+        "id": 0, "producto_id": test_product_sql.id, "tamanio": "M", "color": "Negro", "cantidad_en_stock": 3
+    })
+    assert len((await admin_authenticated_client.get(url)).json()["variantes"]) == 1
+
+@pytest.mark.asyncio
+async def test_product_list_cache_is_invalidated_by_admin_writes(admin_authenticated_client: AsyncClient, test_product_sql: Producto):
+    first = (await admin_authenticated_client.get("/api/products/")).json()
+    assert [p["nombre"] for p in first] == ["Test Product SQL"]
+
+    await admin_authenticated_client.put(f"/api/products/{test_product_sql.id}", json={"descripcion": "Nueva"})
+    data = (await admin_authenticated_client.get("/api/products/")).json()
+    assert data[0]["descripcion"] == "Nueva"
+
+    await admin_authenticated_client.delete(f"/api/products/{test_product_sql.id}")
+    assert (await admin_authenticated_client.get("/api/products/")).json() == []
+
+@pytest.mark.asyncio
+async def test_read_that_races_an_invalidation_is_not_cached(client: AsyncClient, test_product_sql: Producto, monkeypatch):
+    from routers import products_router
+    product_id = test_product_sql.id
+    urls = ["/api/products/", f"/api/products/{product_id}"]
+    real_held = products_router._held
+    async def racing_write(db, products):
+        # Un admin escribe entre la lectura de la base y el guardado en el cache
+        catalog_cache.invalidate_products([product_id])
+        return await real_held(db, products)
+    monkeypatch.setattr(products_router, "_held", racing_write)
+    for url in urls:
+        assert (await client.get(url)).status_code == status.HTTP_200_OK
+    assert catalog_cache.stats()["descartadas_por_invalidacion"] == 2
+
+    monkeypatch.setattr(products_router, "_held", real_held)
+    for url in urls:
+        await client.get(url)  # Lo leído antes de la invalidación no quedó guardado
+        await client.get(url)
+    stats = catalog_cache.stats()
+    assert (stats["lists"]["misses"], stats["lists"]["hits"]) == (2, 1)
+    assert (stats["products"]["misses"], stats["products"]["hits"]) == (2, 1)
+
+
+# --- GET condicionales (ETag / Last-Modified) ---
+
+@pytest.mark.asyncio
+async def test_product_detail_conditional_get(admin_authenticated_client: AsyncClient, test_product_sql: Producto):
+    url = f"/api/products/{test_product_sql.id}"
+    first = await admin_authenticated_client.get(url)
+    etag = first.headers["ETag"]
+    assert "Last-Modified" in first.headers
+
+    response = await admin_authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+    assert response.content == b""
+
+    response = await admin_authenticated_client.get(url, headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    await admin_authenticated_client.put(url, json={"precio": 77.0})
+    response = await admin_authenticated_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["ETag"] != etag
+
+@pytest.mark.asyncio
+async def test_product_list_conditional_get(admin_authenticated_client: AsyncClient, test_product_sql: Producto):
+    first = await admin_authenticated_client.get("/api/products/")
+    etag = first.headers["ETag"]
+
+    response = await admin_authenticated_client.get("/api/products/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # Sin cache (otro worker, o TTL vencido) el validador sale de los agregados y coincide
+    catalog_cache.reset()
+    response = await admin_authenticated_client.get("/api/products/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # Cambia el stock de una variante: el listado deja de estar vigente
+    await admin_authenticated_client.post(f"/api/products/{test_product_sql.id}/variants", json={
+        "id": 0, "producto_id": test_product_sql.id, "tamanio": "S", "color": "Rojo", "cantidad_en_stock": 1
+    })
+    response = await admin_authenticated_client.get("/api/products/", headers={"If-None-Match": etag})
+    assert response.status_code == status.HTTP_200_OK
+
+@pytest.mark.asyncio
+async def test_variant_stock_changes_move_both_validators(client: AsyncClient, db_sql: AsyncSession, test_product_sql: Producto):
+    from datetime import datetime
+    from sqlalchemy import update
+    from database.models import VarianteProducto
+    product_id = test_product_sql.id
+    db_sql.add_all([
+        VarianteProducto(id=1, producto_id=product_id, tamanio="S", color="Negro", cantidad_en_stock=5),
+        VarianteProducto(id=2, producto_id=product_id, tamanio="M", color="Negro", cantidad_en_stock=5),
+    ])
+    await db_sql.commit()
+    # Todo "viejo", para que el Last-Modified de después no caiga en el mismo segundo
+    await db_sql.execute(update(Producto).values(actualizado_en=datetime(2020, 1, 1)))
+    await db_sql.execute(update(VarianteProducto).values(actualizado_en=datetime(2020, 1, 1)))
+    await db_sql.commit()
+
+    urls = ["/api/products/", f"/api/products/{product_id}"]
+    before = {url: await client.get(url) for url in urls}
+    assert all(r.headers["Last-Modified"] == "Wed, 01 Jan 2020 00:00:00 GMT" for r in before.values())
+
+    # +2 en la variante 1 y -1 en la 2: con sum(stock * id) el checksum quedaba igual.
+    # Es un UPDATE de Core, como el descuento de una orden: no toca el producto.
+    for variante_id, delta in ((1, 2), (2, -1)):
+        await db_sql.execute(
+            update(VarianteProducto).where(VarianteProducto.id == variante_id)
+            .values(cantidad_en_stock=VarianteProducto.cantidad_en_stock + delta)
+        )
+    await db_sql.commit()
+    catalog_cache.reset()  # Como en otro worker: los validadores salen de la base
+
+    for url in urls:
+        response = await client.get(url, headers={"If-Modified-Since": before[url].headers["Last-Modified"]})
+        assert response.status_code == status.HTTP_200_OK, url
+        catalog_cache.reset()
+        response = await client.get(url, headers={"If-None-Match": before[url].headers["ETag"]})
+        assert response.status_code == status.HTTP_200_OK, url
+
+@pytest.mark.asyncio
+async def test_product_list_fast_json_matches_schema_and_compresses(client: AsyncClient, db_sql: AsyncSession, test_category: Categoria, monkeypatch):
+    from schemas import product_schemas
+    from utils import fast_json
+    monkeypatch.setattr(fast_json, "FAST_JSON_ENABLED", True)
+    productos = [
+        Producto(nombre=f"Remera {i}", descripcion="Algodón peinado " * 5, precio=1000 + i, sku=f"SKU-FAST-{i}",
+                 stock=5, material="Algodón", talle="M", color="Negro", categoria_id=test_category.id)
+        for i in range(20)
+    ]
+    db_sql.add_all(productos)
+    await db_sql.commit()
+
+    response = await client.get("/api/products/?limit=20", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["vary"]
+
+    # Sin comprimir va el ETag fuerte; comprimido, el mismo pero débil (y ambos validan el 304)
+    plain = await client.get("/api/products/?limit=20", headers={"Accept-Encoding": "identity"})
+    assert "content-encoding" not in plain.headers
+    assert response.headers["etag"] == "W/" + plain.headers["etag"]
+    for etag in (response.headers["etag"], plain.headers["etag"]):
+        again = await client.get("/api/products/?limit=20", headers={"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert again.status_code == status.HTTP_304_NOT_MODIFIED
+
+    # Mismo JSON que hubiese armado response_model
+    for producto in productos:
+        await db_sql.refresh(producto, ["variantes"])
+    esperado = [product_schemas.Product.model_validate(p).model_dump(mode="json") for p in productos]
+    assert response.json() == esperado
+
+    assert fast_json.negotiate_encoding("gzip;q=0, identity") is None
+    assert fast_json.negotiate_encoding("deflate, gzip;q=0.5") == "gzip"
+
+@pytest.mark.asyncio
+async def test_get_products_card_view(client: AsyncClient, db_sql: AsyncSession, test_category: Categoria):
+    from database.models import VarianteProducto
+    con_variantes = Producto(nombre="Buzo", precio=5000, sku="SKU-CARD-1", stock=0, categoria_id=test_category.id,
+                             descripcion="No debería viajar", urls_imagenes=["https://img/1.jpg", "https://img/2.jpg"])
+    agotado = Producto(nombre="Gorra", precio=1500, sku="SKU-CARD-2", stock=10, categoria_id=test_category.id)
+    sin_variantes = Producto(nombre="Media", precio=800, sku="SKU-CARD-3", stock=3, categoria_id=test_category.id)
+    db_sql.add_all([con_variantes, agotado, sin_variantes])
+    await db_sql.flush()
+    db_sql.add_all([
+        VarianteProducto(producto_id=con_variantes.id, tamanio="M", color="Negro", cantidad_en_stock=0),
+        VarianteProducto(producto_id=con_variantes.id, tamanio="L", color="Negro", cantidad_en_stock=2),
+        VarianteProducto(producto_id=agotado.id, tamanio="U", color="Rojo", cantidad_en_stock=0),
+    ])
+    ids = [con_variantes.id, agotado.id, sin_variantes.id]
+    await db_sql.commit()
+
+    response = await client.get("/api/products/?view=card&sort_by=nombre_asc")
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json() == [
+        {"id": ids[0], "nombre": "Buzo", "precio": 5000.0, "imagen": "https://img/1.jpg", "en_stock": True},
+        {"id": ids[1], "nombre": "Gorra", "precio": 1500.0, "imagen": None, "en_stock": False},
+        {"id": ids[2], "nombre": "Media", "precio": 800.0, "imagen": None, "en_stock": True},
+    ]
+
+    # El modo cursor también funciona con la proyección liviana
+    first = await client.get("/api/products/?view=card&sort_by=nombre_asc&limit=2&cursor=")
+    assert [p["nombre"] for p in first.json()] == ["Buzo", "Gorra"]
+    second = await client.get(f"/api/products/?view=card&sort_by=nombre_asc&limit=2&cursor={first.headers['x-next-cursor']}")
+    assert [p["nombre"] for p in second.json()] == ["Media"]
+
+    response = await client.get("/api/products/?view=otra")
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+@pytest.mark.asyncio
+async def test_import_products_csv(admin_authenticated_client: AsyncClient, test_product_sql: Producto, test_category: Categoria, monkeypatch):
+    from services import product_import
+    monkeypatch.setattr(product_import, "IMPORT_CHUNK_SIZE", 2)
+    cat = test_category.id
+    csv_body = (
+        "nombre,precio,sku,stock,categoria_id,color,urls_imagenes,variantes\n"
+        f"Remera Lisa,1000,IMP-1,5,{cat},Negro,https://img/a.jpg|https://img/b.jpg,M/Negro/3;L/Negro/2\n"
+        f"Remera Rayada,abc,IMP-2,5,{cat},,,\n"                       # precio inválido
+        f"Duplicada,500,{test_product_sql.sku},1,{cat},,,\n"          # SKU que ya existe en la base
+        f"Buzo,2000,IMP-3,1,{cat},,,S/Gris/1\n"
+        f"Otra vez,2000,IMP-3,1,{cat},,,\n"                           # SKU repetido en el archivo
+        "Sin categoria,100,IMP-4,1,99999,,,\n"
+        f"Rota,100,IMP-5,1,{cat},,,M/Negro\n"                          # variante mal formada
+    )
+    response = await admin_authenticated_client.post(
+        "/api/products/import", files={"file": ("catalogo.csv", csv_body.encode(), "text/csv")}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    summary = response.json()
+    assert summary["procesadas"] == 7
+    assert summary["creados"] == 2
+    assert summary["variantes_creadas"] == 3
+    assert summary["con_error"] == 5
+    assert summary["lotes"] == 2
+    assert sorted(e["fila"] for e in summary["errores"]) == [2, 3, 5, 6, 7]
+
+    listing = await admin_authenticated_client.get("/api/products/?limit=100")
+    by_sku = {p["sku"]: p for p in listing.json()}
+    assert by_sku["IMP-1"]["urls_imagenes"] == ["https://img/a.jpg", "https://img/b.jpg"]
+    assert sorted(v["tamanio"] for v in by_sku["IMP-1"]["variantes"]) == ["L", "M"]
+    assert "IMP-2" not in by_sku
+
+@pytest.mark.asyncio
+async def test_import_products_jsonl(admin_authenticated_client: AsyncClient, test_category: Categoria):
+    lines = [
+        '{"nombre": "Campera", "precio": 9000, "sku": "JL-1", "stock": 2, "categoria_id": %d, "variantes": [{"tamanio": "M", "color": "Azul", "cantidad_en_stock": 2}]}' % test_category.id,
+        "esto no es json",
+        "",
+    ]
+    response = await admin_authenticated_client.post(
+        "/api/products/import", files={"file": ("catalogo.jsonl", "\n".join(lines).encode(), "application/octet-stream")}
+    )
+    assert response.status_code == status.HTTP_200_OK
+    summary = response.json()
+    assert (summary["creados"], summary["variantes_creadas"], summary["con_error"]) == (1, 1, 1)
+
+    search = await admin_authenticated_client.get("/api/products/search?q=campera")
+    assert [p["sku"] for p in search.json()] == ["JL-1"]
+
+@pytest.mark.asyncio
+async def test_import_products_streams_progress(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, test_category: Categoria, monkeypatch):
+    import json
+    from sqlalchemy.orm import sessionmaker
+    from services import product_import
+    monkeypatch.setattr(product_import, "IMPORT_CHUNK_SIZE", 2)
+    # El stream abre su propia sesión (la del request ya se cerró): la apuntamos a la base de test
+    monkeypatch.setattr(product_import, "AsyncSessionLocal", sessionmaker(bind=db_sql.bind, class_=AsyncSession, expire_on_commit=False))
+    csv_body = "nombre,precio,sku,stock,categoria_id\n" + "".join(
+        f"Remera {i},1000,NDJ-{i},1,{test_category.id}\n" for i in range(5)
+    ) + "Rota,abc,NDJ-X,1,1\n"
+
+    response = await admin_authenticated_client.post(
+        "/api/products/import", files={"file": ("catalogo.csv", csv_body.encode(), "text/csv")},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == status.HTTP_200_OK
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    events = [json.loads(line) for line in response.text.splitlines()]
+    assert [e["tipo"] for e in events] == ["progreso", "progreso", "progreso", "resumen"]
+    assert [e["creados"] for e in events] == [2, 4, 5, 5]
+    assert "errores" not in events[0]
+    assert (events[-1]["procesadas"], events[-1]["con_error"], events[-1]["errores"][0]["fila"]) == (6, 1, 6)
+
+    # Lo importado ya se ve en el catálogo (índice y caché invalidados al cerrar el stream)
+    search = await admin_authenticated_client.get("/api/products/search?q=remera")
+    assert sorted(p["sku"] for p in search.json()) == [f"NDJ-{i}" for i in range(5)]
+
+@pytest.mark.asyncio
+async def test_import_products_as_user_forbidden(authenticated_client: AsyncClient):
+    files = {"file": ("catalogo.csv", b"nombre\n", "text/csv")}
+    response = await authenticated_client.post("/api/products/import", files=files)
+    assert response.status_code == status.HTTP_403_FORBIDDEN
+
+@pytest.mark.asyncio
+async def test_import_products_unknown_format(admin_authenticated_client: AsyncClient):
+    files = {"file": ("catalogo.xlsx", b"x", "application/octet-stream")}
+    response = await admin_authenticated_client.post("/api/products/import", files=files)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+async def _seed_variants(db_sql: AsyncSession, product_id: int, stocks: list) -> list:
+    from database.models import VarianteProducto
+    variants = [VarianteProducto(producto_id=product_id, tamanio=f"T{i}", color="Negro", cantidad_en_stock=s) for i, s in enumerate(stocks)]
+    db_sql.add_all(variants)
+    await db_sql.flush()
+    ids = [v.id for v in variants]
+    await db_sql.commit()
+    return ids
+
+@pytest.mark.asyncio
+async def test_bulk_update_stock_and_prices(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, test_product_sql: Producto):
+    product_id, palabra = test_product_sql.id, test_product_sql.nombre.split()[0]
+    v1, v2 = await _seed_variants(db_sql, product_id, [5, 10])
+    await admin_authenticated_client.get(f"/api/products/{product_id}")  # Queda en cache
+
+    response = await admin_authenticated_client.patch("/api/products/bulk", json={
+        "variantes": [{"variante_id": v1, "cantidad_en_stock": 20}, {"variante_id": v2, "delta": -4}],
+        "precios": [{"producto_id": product_id, "precio": 42.5}],
+    })
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["variantes"] == [
+        {"variante_id": v1, "producto_id": product_id, "antes": 5, "despues": 20},
+        {"variante_id": v2, "producto_id": product_id, "antes": 10, "despues": 6},
+    ]
+    assert data["precios"][0]["despues"] == 42.5
+
+    detail = (await admin_authenticated_client.get(f"/api/products/{product_id}")).json()
+    assert detail["precio"] == 42.5
+    assert {v["id"]: v["cantidad_en_stock"] for v in detail["variantes"]} == {v1: 20, v2: 6}
+    search = await admin_authenticated_client.get(f"/api/products/search?q={palabra}&precio=40")
+    assert search.json() == []  # El índice ya tiene el precio nuevo
+
+@pytest.mark.asyncio
+async def test_bulk_update_is_all_or_nothing(admin_authenticated_client: AsyncClient, db_sql: AsyncSession, test_product_sql: Producto):
+    product_id, precio = test_product_sql.id, float(test_product_sql.precio)
+    (v1,) = await _seed_variants(db_sql, product_id, [3])
+    response = await admin_authenticated_client.patch("/api/products/bulk", json={
+        "variantes": [{"variante_id": v1, "cantidad_en_stock": 50}, {"variante_id": v1 + 999, "delta": 1}],
+        "precios": [{"producto_id": product_id, "precio": 1.0}],
+    })
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert response.json()["detail"]["errores"] == [{"variante_id": v1 + 999, "error": "La variante no existe."}]
+
+    response = await admin_authenticated_client.patch("/api/products/bulk", json={"variantes": [{"variante_id": v1, "delta": -4}]})
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = await admin_authenticated_client.patch("/api/products/bulk", json={"variantes": [{"variante_id": v1, "delta": 1, "cantidad_en_stock": 1}]})
+    assert response.status_code == status.HTTP_422_UNPROCESSABLE_ENTITY
+
+    detail = (await admin_authenticated_client.get(f"/api/products/{product_id}")).json()
+    assert detail["variantes"][0]["cantidad_en_stock"] == 3
+    assert detail["precio"] == precio
+
+@pytest.fixture
+def cloudinary_credentials():
+    import cloudinary
+    config = cloudinary.config()
+    previous = (config.api_key, config.api_secret, config.cloud_name)
+    cloudinary.config(api_key="test-key", api_secret="test-secret", cloud_name="demo")
+    yield "test-secret"
+    cloudinary.config(api_key=previous[0], api_secret=previous[1], cloud_name=previous[2])
+
+@pytest.mark.asyncio
+async def test_signed_upload_params(admin_authenticated_client: AsyncClient, cloudinary_credentials):
+    import cloudinary.utils
+    response = await admin_authenticated_client.post("/api/products/uploads/signature")
+    assert response.status_code == status.HTTP_200_OK
+    data = response.json()
+    assert data["folder"] == "void_ecommerce_products"
+    assert data["upload_url"].endswith("/demo/image/upload")
+    signed = {k: data[k] for k in ("timestamp", "folder", "allowed_formats")}
+    assert data["signature"] == cloudinary.utils.api_sign_request(signed, cloudinary_credentials)
+
+@pytest.mark.asyncio
+async def test_attach_signed_images_to_product(admin_authenticated_client: AsyncClient, test_product_sql: Producto, cloudinary_credentials):
+    import cloudinary.utils
+    product_id = test_product_sql.id
+
+    def uploaded(public_id, version=1700000000):
+        signature = cloudinary.utils.api_sign_request({"public_id": public_id, "version": version}, cloudinary_credentials)
+        return {"public_id": public_id, "version": version, "signature": signature}
+
+    response = await admin_authenticated_client.post(f"/api/products/{product_id}/images", json=[uploaded("void_ecommerce_products/remera")])
+    assert response.status_code == status.HTTP_200_OK
+    assert response.json()["urls_imagenes"] == ["https://res.cloudinary.com/demo/image/upload/v1700000000/void_ecommerce_products/remera"]
+
+    forged = {**uploaded("void_ecommerce_products/otra"), "signature": "0" * 40}
+    response = await admin_authenticated_client.post(f"/api/products/{product_id}/images", json=[forged])
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    response = await admin_authenticated_client.post(f"/api/products/{product_id}/images", json=[uploaded("otra_carpeta/x")])
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    too_many = [uploaded(f"void_ecommerce_products/img{i}") for i in range(3)]
+    response = await admin_authenticated_client.post(f"/api/products/{product_id}/images", json=too_many)
+    assert response.status_code == status.HTTP_400_BAD_REQUEST
+    assert len((await admin_authenticated_client.get(f"/api/products/{product_id}")).json()["urls_imagenes"]) == 1
+
+@pytest.mark.asyncio
+async def test_responsive_image_urls(client: AsyncClient, db_sql: AsyncSession, test_category: Categoria):
+    original = "https://res.cloudinary.com/demo/image/upload/v17/void_ecommerce_products/remera.jpg"
+    producto = Producto(nombre="Remera", precio=100, sku="SKU-RESP", stock=1, categoria_id=test_category.id, urls_imagenes=[original])
+    db_sql.add(producto)
+    await db_sql.flush()
+    product_id = producto.id
+    await db_sql.commit()
+
+    plain = (await client.get(f"/api/products/{product_id}")).json()
+    assert "imagenes_responsive" not in plain
+
+    response = await client.get(f"/api/products/{product_id}?responsive=true")
+    (imagen,) = response.json()["imagenes_responsive"]
+    assert imagen["original"] == original
+    assert imagen["variantes"][0] == {
+        "ancho": 320, "url": "https://res.cloudinary.com/demo/image/upload/c_limit,w_320,f_auto,q_auto/v17/void_ecommerce_products/remera.jpg"
+    }
+    assert imagen["srcset"].endswith(" 1024w")
+    assert response.headers["etag"] != (await client.get(f"/api/products/{product_id}")).headers["etag"]
+
+    listing = (await client.get("/api/products/?responsive=true")).json()
+    assert listing[0]["imagenes_responsive"] == [imagen]
+    assert "imagenes_responsive" not in (await client.get("/api/products/")).json()[0]
+    card = (await client.get("/api/products/?view=card&responsive=true")).json()
+    assert card[0]["imagen_responsive"] == imagen
@@ -0,0 +1,193 @@
+# En tests/test_query_plans.py
+#
+# Corre EXPLAIN QUERY PLAN (SQLite) sobre las queries calientes de los routers y
+# falla si alguna vuelve a recorrer una tabla entera. No mide tiempos: mira el plan,
+# así que un índice borrado o una query reescrita sin querer salta acá.
+import re
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import event, insert, select, text
+from sqlalchemy.dialects import sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Categoria, ConversacionIA, DetalleOrden, Orden, Producto, VarianteProducto
+from routers import admin_router, chatbot_router, products_router
+from schemas.product_schemas import ProductFilters
+from services import cart_service, order_service, product_import, webhook_inbox
+from utils import pagination
+
+# Un SCAN es recorrer la tabla entera, aunque sea por un índice (cubriente o no): lo
+# único que no cuenta es leer un índice en orden para servir el ORDER BY con LIMIT
+# (`ordered`), que corta en la primera página. Un SEARCH (con "=?", ">?"...) es una búsqueda.
+FULL_SCAN = re.compile(r"\bSCAN (\w+)")
+INDEX_SCAN = re.compile(r"\bSCAN (\w+) USING (?:COVERING )?INDEX \w+$", re.MULTILINE)
+# "RIGHT PART OF" es cuando el índice da solo la primera columna del orden y el resto se ordena igual
+TEMP_SORT = re.compile(r"USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY")
+# SQLite arma un índice temporal por query cuando falta uno de verdad; MySQL no.
+# No importa sobre qué tabla: siempre es un fallo
+AUTOMATIC_INDEX = re.compile(r"(\w+) USING AUTOMATIC")
+
+
+@pytest_asyncio.fixture
+async def seeded_db(db_sql: AsyncSession) -> AsyncSession:
+    """Un catálogo y un historial de ventas con volumen suficiente para que el planner elija en serio."""
+    await db_sql.execute(insert(Categoria), [{"id": c, "nombre": f"Categoría {c}"} for c in range(1, 21)])
+    await db_sql.execute(insert(Producto), [
+        {"id": i, "nombre": f"Producto {i}", "precio": Decimal(1000 + i % 500), "sku": f"PLAN-{i}",
+         "stock": i % 7, "categoria_id": 1 + i % 20, "material": "Algodón", "color": "Negro"}
+        for i in range(1, 2001)
+    ])
+    await db_sql.execute(insert(VarianteProducto), [
+        {"id": v, "producto_id": 1 + v % 2000, "tamanio": "M", "color": "Negro", "cantidad_en_stock": v % 5}
+        for v in range(1, 6001)
+    ])
+    await db_sql.execute(insert(Orden), [
+        {"id": o, "usuario_id": f"user-{o % 50}", "monto_total": Decimal(5000), "estado": "pagado",
+         "estado_pago": "approved", "payment_id_mercadopago": f"mp-{o}"}
+        for o in range(1, 1001)
+    ])
+    await db_sql.execute(insert(DetalleOrden), [
+        {"orden_id": 1 + d % 1000, "variante_producto_id": 1 + d % 6000, "cantidad": 1, "precio_en_momento_compra": Decimal(1000)}
+        for d in range(1, 3001)
+    ])
+    await db_sql.execute(insert(ConversacionIA), [
+        {"sesion_id": f"sesion-{c % 100}", "prompt": "hola", "respuesta": "chau"} for c in range(1, 1001)
+    ])
+    await db_sql.commit()
+    await db_sql.execute(text("ANALYZE"))
+    return db_sql
+
+
+async def explain(db: AsyncSession, statement) -> str:
+    sql = str(statement.compile(dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True}))
+    rows = (await db.execute(text("EXPLAIN QUERY PLAN " + sql))).all()
+    return "\n".join(row[-1] for row in rows)
+
+
+async def explain_executed(db: AsyncSession, run) -> list:
+    """
+    Para lo que arma el ORM por su cuenta (selectinload): corre `run` de verdad,
+    junta las sentencias que llegan al driver y devuelve [(sql, plan)].
+    """
+    executed = []
+    listener = lambda conn, cursor, statement, parameters, *args: executed.append((statement, parameters))
+    engine = db.bind.sync_engine
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        await run()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    conn = await db.connection()
+    plans = []
+    for statement, parameters in executed:
+        rows = (await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)).all()
+        plans.append((statement, "\n".join(row[-1] for row in rows)))
+    return plans
+
+
+def _page(sort_by=None, cursor="", categoria_id=None, view="full"):
+    # Lo mismo que arma GET /api/products/ (cursor "" = primera página en modo cursor)
+    return products_router._product_page_query(ProductFilters(categoria_id=categoria_id), 0, 20, sort_by, cursor, view)
+
+
+# (nombre, query, tablas que no pueden recorrerse enteras, ¿tiene que venir ya ordenada?)
+# Cada query sale de la misma función que usa el código de producción: si alguien
+# la reescribe, acá se mira el plan de la versión nueva.
+HOT_QUERIES = [
+    # products_router
+    ("listado por categoría ordenado por precio",
+     lambda: _page("precio_asc", categoria_id=3), {"productos"}, True),
+    ("listado por categoría, página siguiente (cursor)",
+     lambda: _page("precio_asc", pagination.encode_cursor("precio_asc", Decimal(1200), 500), categoria_id=3), {"productos"}, True),
+    ("listado por categoría ordenado por precio descendente, página siguiente (cursor)",
+     lambda: _page("precio_desc", pagination.encode_cursor("precio_desc", Decimal(1200), 500), categoria_id=3), {"productos"}, True),
+    ("listado ordenado por precio descendente, página siguiente (cursor)",
+     lambda: _page("precio_desc", pagination.encode_cursor("precio_desc", Decimal(1200), 500)), {"productos"}, True),
+    ("listado ordenado por nombre, página siguiente (cursor)",
+     lambda: _page("nombre_desc", pagination.encode_cursor("nombre_desc", "Producto 500", 500)), {"productos"}, True),
+    ("listado por cursor sin orden",
+     lambda: _page(None, pagination.encode_cursor(None, None, 1500)), {"productos"}, True),
+    ("listado por categoría con offset",
+     lambda: _page("precio_asc", None, categoria_id=3), {"productos"}, True),
+    ("vista card por categoría",
+     lambda: _page("precio_asc", categoria_id=3, view="card"), {"productos", "variantes_productos"}, True),
+    ("validadores del listado por categoría",
+     lambda: products_router._list_validators_query(ProductFilters(categoria_id=3)), {"productos", "variantes_productos"}, False),
+    ("detalle de un producto",
+     lambda: products_router._product_detail_query(10), {"productos", "variantes_productos"}, False),
+    ("colisión de SKUs (importación)",
+     lambda: product_import.taken_skus_query(["PLAN-1", "PLAN-2"]), {"productos"}, False),
+    # admin_router
+    ("ventas con sus detalles",
+     lambda: admin_router._sales_rows_query(), {"detalles_orden"}, False),
+    ("ventas con sus detalles (ORM)",
+     lambda: admin_router._sales_query(), {"detalles_orden"}, False),
+    ("detalle de una venta",
+     lambda: admin_router._sale_detail_query(10), {"ordenes", "detalles_orden", "variantes_productos", "productos"}, False),
+    ("ventas por día",
+     lambda: admin_router._sales_over_time_query(), {"detalles_orden"}, False),
+    ("producto más vendido",
+     lambda: admin_router._most_sold_product_query(), {"productos", "variantes_productos"}, False),
+    # checkout (order_service / cart_service)
+    ("orden por payment_id de Mercado Pago",
+     lambda: order_service.existing_order_query("mp-10"), {"ordenes"}, False),
+    ("validación del carrito (variantes + producto + reservas)",
+     lambda: cart_service.validation_query([10, 11, 12], "guest-1"), {"variantes_productos", "productos", "reservas_stock"}, False),
+    # webhook_inbox
+    ("eventos vencidos del inbox de webhooks",
+     lambda: webhook_inbox.due_query(datetime(2030, 1, 1)), {"webhook_inbox"}, False),
+    ("profundidad del inbox por estado",
+     lambda: webhook_inbox.depth_query(), {"webhook_inbox"}, False),
+    # chatbot_router
+    ("historial de una sesión del chatbot",
+     lambda: chatbot_router._history_query("sesion-7"), {"conversaciones_ia"}, True),
+]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name,build,no_scan,ordered", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+async def test_hot_query_uses_indexes(seeded_db: AsyncSession, name, build, no_scan, ordered):
+    plan = await explain(seeded_db, build())
+    automatic = AUTOMATIC_INDEX.findall(plan)
+    assert not automatic, f"'{name}' necesita un índice que no existe en {sorted(set(automatic))}:\n{plan}"
+    scanned = set(FULL_SCAN.findall(plan)) & no_scan
+    if ordered:
+        scanned -= set(INDEX_SCAN.findall(plan))
+    assert not scanned, f"'{name}' recorre entera(s) {sorted(scanned)}:\n{plan}"
+    if ordered:
+        assert not TEMP_SORT.search(plan), f"'{name}' ordena en memoria en vez de usar el índice:\n{plan}"
+
+
+@pytest.mark.asyncio
+async def test_reserved_stock_lookup_is_index_only(seeded_db: AsyncSession):
+    """El camino caliente del checkout (stock - reservas vigentes) no puede leer la tabla de reservas."""
+    from services import stock_reservations
+    for clave in (None, "guest-1"):  # También sin las reservas del propio comprador
+        held = stock_reservations.held_subquery([5, 6, 7], excluir_clave=clave)
+        plan = await explain(seeded_db, select(held.c.variante_id, held.c.reservado))
+        assert "USING COVERING INDEX ix_reservas_variante_expira" in plan, plan
+        # La versión correlacionada que usa la validación del carrito, igual
+        plan = await explain(seeded_db, cart_service.validation_query([5, 6, 7], clave))
+        assert "SEARCH reservas_stock USING COVERING INDEX ix_reservas_variante_expira (variante_id=?" in plan, plan
+
+
+@pytest.mark.asyncio
+async def test_card_page_only_reads_the_variants_of_its_products(seeded_db: AsyncSession):
+    """El stock de la grilla no puede agregar todas las variantes del catálogo para mostrar 20 productos."""
+    plan = await explain(seeded_db, _page("precio_asc", categoria_id=3, view="card"))
+    assert "MATERIALIZE" not in plan, plan
+    assert "SEARCH variantes_productos USING COVERING INDEX ix_variantes_producto_stock (producto_id=?)" in plan, plan
+
+
+@pytest.mark.asyncio
+async def test_listing_variant_load_uses_index(seeded_db: AsyncSession):
+    """Las variantes de la página las trae selectinload con su propia query: se mira la que corre de verdad."""
+    plans = await explain_executed(
+        seeded_db, lambda: products_router._load_product_page(seeded_db, ProductFilters(categoria_id=3), 0, 20, "precio_asc", "")
+    )
+    variant_plans = [plan for sql, plan in plans if "FROM variantes_productos" in sql]
+    assert len(variant_plans) == 1, plans
+    assert not FULL_SCAN.findall(variant_plans[0]), variant_plans[0]
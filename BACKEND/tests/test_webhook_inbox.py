@@ -0,0 +1,153 @@
+# En tests/test_webhook_inbox.py
+from datetime import datetime
+
+import pytest
+import pytest_asyncio
+from httpx import AsyncClient
+from fastapi import status
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from database.models import Orden, Producto, VarianteProducto, WebhookEvento
+from services import webhook_inbox
+
+
+@pytest.fixture
+def session_factory(db_sql: AsyncSession):
+    """Como AsyncSessionLocal de producción (expire_on_commit=False), pero sobre la base de test."""
+    return sessionmaker(bind=db_sql.bind, class_=AsyncSession, expire_on_commit=False)
+
+
+@pytest_asyncio.fixture
+async def variant_id(db_sql: AsyncSession, test_category):
+    producto = Producto(nombre="Remera Webhook", precio=1500, sku="WH-1", stock=0, categoria_id=test_category.id)
+    db_sql.add(producto)
+    await db_sql.flush()
+    variante = VarianteProducto(producto_id=producto.id, tamanio="M", color="Negro", cantidad_en_stock=3)
+    db_sql.add(variante)
+    await db_sql.flush()
+    variante_id = variante.id
+    await db_sql.commit()
+    return variante_id
+
+
+def _approved(payment_id, variante_id, status_="approved"):
+    return {
+        "id": payment_id, "status": status_, "external_reference": "guest-1", "transaction_amount": 1500,
+        "additional_info": {"items": [{"id": str(variante_id), "quantity": "1", "unit_price": "1500"}]},
+    }
+
+
+async def _notify(client: AsyncClient, payment_id):
+    return await client.post("/api/checkout/webhook", json={"type": "payment", "data": {"id": str(payment_id)}})
+
+
+@pytest.mark.asyncio
+async def test_webhook_only_queues_and_deduplicates(client: AsyncClient, db_sql, fake_mercadopago):
+    assert (await _notify(client, 10)).json() == {"status": "ok", "reason": "Queued"}
+    assert (await _notify(client, 10)).json() == {"status": "ok", "reason": "Already queued"}
+    assert fake_mercadopago.calls == []  # Nada de MP dentro del request
+    rows = (await db_sql.execute(select(WebhookEvento.payment_id, WebhookEvento.estado))).all()
+    assert [tuple(r) for r in rows] == [("10", "pendiente")]
+
+
+@pytest.mark.asyncio
+async def test_consumer_creates_the_order(client: AsyncClient, variant_id, fake_mercadopago, session_factory):
+    fake_mercadopago.add_payment(_approved(20, variant_id))
+    await _notify(client, 20)
+
+    assert await webhook_inbox.drain(session_factory) == 1
+    async with session_factory() as db:
+        assert (await db.execute(select(Orden.usuario_id).where(Orden.payment_id_mercadopago == "20"))).scalar_one() == "guest-1"
+        assert (await db.execute(select(WebhookEvento.estado))).scalar_one() == "procesado"
+        assert (await db.get(VarianteProducto, variant_id)).cantidad_en_stock == 2
+
+    metrics = (await client.get("/health/metrics")).json()["webhook_inbox"]
+    assert metrics["procesados"] == 1
+    assert metrics["profundidad"] == {"pendiente": 0, "procesando": 0, "fallido": 0}
+
+
+@pytest.mark.asyncio
+async def test_pending_payment_is_requeued_by_the_next_notification(client: AsyncClient, variant_id, fake_mercadopago, session_factory):
+    fake_mercadopago.add_payment(_approved(30, variant_id, status_="in_process"))
+    await _notify(client, 30)
+    await webhook_inbox.drain(session_factory)
+
+    fake_mercadopago.add_payment(_approved(30, variant_id))
+    assert (await _notify(client, 30)).json()["reason"] == "Queued"
+    await webhook_inbox.drain(session_factory)
+    async with session_factory() as db:
+        assert (await db.execute(select(Orden.id).where(Orden.payment_id_mercadopago == "30"))).scalar_one_or_none()
+
+
+@pytest.mark.asyncio
+async def test_failures_are_retried_then_dead_lettered(admin_authenticated_client: AsyncClient, monkeypatch, session_factory):
+    monkeypatch.setattr(webhook_inbox, "WEBHOOK_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(webhook_inbox, "WEBHOOK_BACKOFF_SECONDS", 0)
+    calls = []
+
+    async def broken(db, payment_id):
+        calls.append(payment_id)
+        raise RuntimeError("MP caído")
+
+    await _notify(admin_authenticated_client, 40)
+    await webhook_inbox.drain(session_factory, handler=broken)
+    assert calls == ["40", "40", "40"]
+
+    failed = (await admin_authenticated_client.get("/api/admin/webhooks")).json()
+    assert [(e["payment_id"], e["intentos"]) for e in failed] == [("40", 3)]
+    assert "MP caído" in failed[0]["ultimo_error"]
+    assert (await admin_authenticated_client.get("/health/metrics")).json()["webhook_inbox"]["profundidad"]["fallido"] == 1
+
+    retried = await admin_authenticated_client.post(f"/api/admin/webhooks/{failed[0]['id']}/retry")
+    assert retried.status_code == status.HTTP_200_OK
+    assert (retried.json()["estado"], retried.json()["intentos"]) == ("pendiente", 0)
+    assert (await admin_authenticated_client.post(f"/api/admin/webhooks/{failed[0]['id']}/retry")).status_code == status.HTTP_404_NOT_FOUND
+
+
+@pytest.mark.asyncio
+async def test_out_of_stock_is_dead_lettered_without_retries(client: AsyncClient, variant_id, fake_mercadopago, monkeypatch, session_factory):
+    monkeypatch.setattr(webhook_inbox, "WEBHOOK_BACKOFF_SECONDS", 0)
+    payment = _approved(50, variant_id)
+    payment["additional_info"]["items"][0]["quantity"] = "10"  # Hay 3
+    fake_mercadopago.add_payment(payment)
+    await _notify(client, 50)
+
+    await webhook_inbox.drain(session_factory)
+    async with session_factory() as db:
+        evento = (await db.execute(select(WebhookEvento).where(WebhookEvento.payment_id == "50"))).scalar_one()
+        assert (evento.estado, evento.intentos) == ("fallido", 1)
+        assert "StockInsuficiente" in evento.ultimo_error
+        assert (await db.get(VarianteProducto, variant_id)).cantidad_en_stock == 3
+    assert webhook_inbox.stats()["reintentos"] == 0
+
+
+@pytest.mark.asyncio
+async def test_claim_takes_the_batch_with_one_update(db_sql, session_factory):
+    from sqlalchemy import event, update
+    for payment_id in range(60, 70):
+        await webhook_inbox.enqueue(db_sql, str(payment_id), {"type": "payment"})
+    # Otro worker ya tomó tres (lease vigente): no se pueden volver a tomar
+    async with session_factory() as db:
+        await db.execute(
+            update(WebhookEvento).where(WebhookEvento.payment_id.in_(["60", "61", "62"]))
+            .values(estado="procesando", lease="otro", proximo_intento_en=datetime(2999, 1, 1))
+        )
+        await db.commit()
+
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement.split()[0])
+    event.listen(db_sql.bind.sync_engine, "before_cursor_execute", listener)
+    try:
+        async with session_factory() as db:
+            claimed = await webhook_inbox._claim(db)
+    finally:
+        event.remove(db_sql.bind.sync_engine, "before_cursor_execute", listener)
+
+    assert len(claimed) == 7
+    assert statements.count("UPDATE") == 1  # Un UPDATE para todo el lote, no uno por evento
+    async with session_factory() as db:
+        leases = (await db.execute(select(WebhookEvento.lease).where(WebhookEvento.id.in_(claimed)).distinct())).scalars().all()
+        assert len(leases) == 1 and leases[0] != "otro"
+        assert await webhook_inbox._claim(db) == []  # Todo tomado
@@ -0,0 +1,60 @@
+# En BACKEND/utils/cache.py
+
+from cachetools import TTLCache
+
+
+class InstrumentedTTLCache(TTLCache):
+    """
+    TTLCache (LRU + vencimiento) que además cuenta aciertos, fallos, desalojos
+    por tamaño y vencimientos, para poder exponerlos en /health/metrics.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def lookup(self, key, default=None):
+        """Como `get`, pero anotando si fue acierto o fallo."""
+        try:
+            value = self[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return value
+
+    def invalidate(self, key) -> bool:
+        """Saca una entrada a propósito (no cuenta como desalojo)."""
+        if self.pop(key, None) is None:
+            return False
+        self.invalidations += 1
+        return True
+
+    def popitem(self):
+        # TTLCache llama a popitem solo cuando tiene que hacer lugar (LRU)
+        item = super().popitem()
+        self.evictions += 1
+        return item
+
+    def expire(self, time=None):
+        expired = super().expire(time)
+        self.expirations += len(expired)
+        return expired
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,32 @@
+# En BACKEND/utils/db_locks.py
+
+from typing import Dict, List
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+# Tope de ids por sentencia: un IN/CASE de 10k ramas es un parseo caro para MySQL,
+# de a 1000 son unas pocas sentencias por request.
+STATEMENT_CHUNK_SIZE = 1000
+
+
+def chunks(items: list, size: int = STATEMENT_CHUNK_SIZE):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def lock_rows(db: AsyncSession, columns, id_column, ids: List[int]) -> Dict[int, tuple]:
+    """
+    SELECT ... FOR UPDATE en orden de id. Todo lo que bloquea filas de la misma
+    tabla (edición masiva, descuento de stock, reservas) pasa por acá: así toman
+    los locks en el mismo orden y no se bloquean mutuamente (deadlock).
+    Devuelve {id: (columnas...)} de las filas que existen.
+    """
+    rows = {}
+    for chunk in chunks(sorted(ids)):
+        result = await db.execute(
+            select(id_column, *columns).where(id_column.in_(chunk)).order_by(id_column).with_for_update()
+        )
+        for row in result.all():
+            rows[row[0]] = tuple(row[1:])
+    return rows
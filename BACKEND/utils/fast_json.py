@@ -0,0 +1,97 @@
+# En BACKEND/utils/fast_json.py
+
+import gzip
+import os
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+import orjson
+from fastapi import Request, Response
+
+try:
+    import brotli  # Opcional: si no está instalado negociamos solo gzip
+except ImportError:
+    brotli = None
+
+# Los endpoints calientes (listado de productos, ventas y usuarios del admin) pueden
+# pasar por acá en vez de response_model + json estándar. Es opt-in:
+# FAST_JSON_ENABLED=true para prenderlo, sin tocar código.
+FAST_JSON_ENABLED = os.getenv("FAST_JSON_ENABLED", "false").lower() in ("1", "true", "yes")
+# Comprimir respuestas chicas cuesta más de lo que ahorra
+COMPRESS_MIN_BYTES = int(os.getenv("FAST_JSON_COMPRESS_MIN_BYTES", 1024))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def _default(value: Any):
+    # orjson no conoce Decimal; en los schemas los montos ya salen como float
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Tipo no serializable: {type(value).__name__}")
+
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default)
+
+
+def negotiate_encoding(accept_encoding: Optional[str]) -> Optional[str]:
+    """Elige 'br' o 'gzip' según Accept-Encoding (respetando q=0). None = sin comprimir."""
+    if not accept_encoding:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def fast_json_response(
+    request: Request,
+    content: Any,
+    headers: Optional[dict] = None,
+    status_code: int = 200,
+    encoded_cache: Optional[Dict[str, bytes]] = None,
+) -> Response:
+    """
+    Serializa con orjson y comprime si el cliente lo acepta y vale la pena.
+    Si se pasa `encoded_cache` (un dict guardado junto a un valor cacheado),
+    el cuerpo ya serializado/comprimido se reutiliza entre requests.
+    """
+    encoded = encoded_cache if encoded_cache is not None else {}
+    body = encoded.get("identity")
+    if body is None:
+        body = encoded["identity"] = dumps(content)
+
+    # La misma URL puede salir comprimida o no según Accept-Encoding
+    response_headers = {**(headers or {}), "Vary": "Accept-Encoding"}
+    if len(body) >= COMPRESS_MIN_BYTES:
+        encoding = negotiate_encoding(request.headers.get("accept-encoding"))
+        if encoding:
+            compressed = encoded.get(encoding)
+            if compressed is None:
+                compressed = encoded[encoding] = _compress(body, encoding)
+            body = compressed
+            response_headers["Content-Encoding"] = encoding
+            # Un ETag fuerte no puede compartirse entre codificaciones distintas (RFC 9110 8.8.3):
+            # comprimido va débil. If-None-Match compara débil, así que el 304 sigue andando.
+            etag = response_headers.get("ETag")
+            if etag and not etag.startswith("W/"):
+                response_headers["ETag"] = "W/" + etag
+
+    return Response(content=body, status_code=status_code, headers=response_headers, media_type="application/json")
@@ -0,0 +1,34 @@
+# En BACKEND/utils/image_urls.py
+
+from functools import lru_cache
+
+# Anchos que usa el front (grilla mobile, grilla desktop, detalle)
+RESPONSIVE_WIDTHS = (320, 640, 1024)
+_UPLOAD_SEGMENT = "/image/upload/"
+
+
+@lru_cache(maxsize=20000)
+def responsive_image(url: str) -> dict:
+    """
+    A partir de la URL guardada de Cloudinary arma las variantes por ancho, con
+    formato y calidad automáticos (WebP/AVIF según el navegador). Las URLs tienen
+    la versión adentro, así que el resultado no cambia nunca y se memoiza.
+    Si la URL no es de Cloudinary se devuelve solo el original.
+    """
+    if "res.cloudinary.com" not in url or _UPLOAD_SEGMENT not in url:
+        return {"original": url, "variantes": [], "srcset": ""}
+
+    base, rest = url.split(_UPLOAD_SEGMENT, 1)
+    variantes = [
+        {"ancho": width, "url": f"{base}{_UPLOAD_SEGMENT}c_limit,w_{width},f_auto,q_auto/{rest}"}
+        for width in RESPONSIVE_WIDTHS
+    ]
+    return {
+        "original": url,
+        "variantes": variantes,
+        "srcset": ", ".join(f"{v['url']} {v['ancho']}w" for v in variantes),
+    }
+
+
+def responsive_images(urls) -> list:
+    return [responsive_image(url) for url in (urls or []) if url]
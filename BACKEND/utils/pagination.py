@@ -0,0 +1,92 @@
+# En BACKEND/utils/pagination.py
+
+import base64
+import json
+from decimal import Decimal, InvalidOperation
+from typing import Any, Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import and_, or_
+
+# Orden soportado por el catálogo: (columna, descendente). El id siempre va como
+# desempate en el mismo sentido que la columna: así el orden es total y estable, y
+# los índices (columna, id) lo sirven recorridos al derecho o al revés, sin ordenar en memoria.
+SORT_COLUMNS = {
+    "precio_asc": ("precio", False),
+    "precio_desc": ("precio", True),
+    "nombre_asc": ("nombre", False),
+    "nombre_desc": ("nombre", True),
+}
+
+
+def encode_cursor(sort_by: Optional[str], last_value: Any, last_id: int) -> str:
+    """
+    Arma un cursor opaco a partir de la última fila de la página.
+    El cliente no tiene que interpretarlo, solo devolverlo tal cual.
+    """
+    if isinstance(last_value, Decimal):
+        last_value = str(last_value)
+    payload = {"s": sort_by, "v": last_value, "id": last_id}
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, sort_by: Optional[str]) -> Tuple[Any, int]:
+    """
+    Devuelve (último valor de la columna de orden, último id).
+    Un cursor armado con otro `sort_by` no sirve: se rechaza con 400.
+    """
+    invalid = HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor inválido.")
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        last_id = int(payload["id"])
+        last_value = payload.get("v")
+    except (ValueError, KeyError, TypeError):
+        raise invalid
+
+    if payload.get("s") != sort_by:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="El cursor no corresponde al orden pedido (sort_by)."
+        )
+    if sort_by in SORT_COLUMNS and SORT_COLUMNS[sort_by][0] == "precio":
+        try:
+            last_value = Decimal(last_value)
+        except (InvalidOperation, TypeError):
+            raise invalid
+    return last_value, last_id
+
+
+def keyset_order_by(model, sort_by: Optional[str]) -> list:
+    """Cláusulas ORDER BY para un `sort_by`, siempre con el id como desempate."""
+    if sort_by in SORT_COLUMNS:
+        column_name, descending = SORT_COLUMNS[sort_by]
+        column = getattr(model, column_name)
+        if descending:
+            return [column.desc(), model.id.desc()]
+        return [column.asc(), model.id.asc()]
+    return [model.id.asc()]
+
+
+def keyset_after(model, sort_by: Optional[str], last_value: Any, last_id: int):
+    """
+    Condición WHERE que deja solo las filas posteriores al cursor.
+    Equivale a comparar la tupla (columna, id) sin usar OFFSET, así que
+    cada página cuesta lo mismo sin importar qué tan profunda sea.
+    """
+    if sort_by not in SORT_COLUMNS:
+        return model.id > last_id
+
+    column_name, descending = SORT_COLUMNS[sort_by]
+    column = getattr(model, column_name)
+    if descending:
+        return or_(column < last_value, and_(column == last_value, model.id < last_id))
+    return or_(column > last_value, and_(column == last_value, model.id > last_id))
+
+
+def sort_value(obj, sort_by: Optional[str]) -> Any:
+    """Valor de la columna de orden de una fila (None si se ordena solo por id)."""
+    if sort_by in SORT_COLUMNS:
+        return getattr(obj, SORT_COLUMNS[sort_by][0])
+    return None
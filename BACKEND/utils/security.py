@@ -1,6 +1,9 @@
 import os
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-from typing import Optional
+from functools import partial
+from typing import Optional, Tuple
 import logging
 
 from fastapi import Depends, HTTPException, status, Header
@@ -11,6 +14,7 @@ from pymongo.database import Database
 from dotenv import load_dotenv
 
 from database.database import get_db_nosql
+from services import principal_cache
 
 load_dotenv()
 
@@ -26,7 +30,12 @@ if not SECRET_KEY:
 ALGORITHM = os.getenv("ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Costo de bcrypt. Si se sube, los hashes viejos quedan marcados como desactualizados
+# y (con PASSWORD_REHASH_ON_LOGIN) se rehashean cuando el usuario entra.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_REHASH_ON_LOGIN = os.getenv("PASSWORD_REHASH_ON_LOGIN", "false").lower() in ("1", "true", "yes")
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
 
 # --- FUNCIONES DE UTILIDAD ---
@@ -37,6 +46,52 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+# --- Hashing fuera del event loop ---
+# bcrypt son cientos de ms de CPU: corriendo en el loop, una ráfaga de logins frena
+# a todos los demás requests del worker. Va a un pool chico propio (bcrypt suelta el
+# GIL) y con tope de cola: si ya hay demasiados esperando, respondemos 503 al toque
+# en vez de apilar logins que igual van a terminar en timeout.
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 16))
+
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+_hash_pending = 0
+
+
+async def _run_hashing(func, *args):
+    global _hash_pending
+    if _hash_pending >= PASSWORD_HASH_MAX_PENDING:
+        logger.warning(f"Pool de hashing saturado ({_hash_pending} pendientes). Rechazando con 503.")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Demasiados intentos de ingreso en este momento. Probá de nuevo en unos segundos.",
+            headers={"Retry-After": "1"},
+        )
+    _hash_pending += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_executor, partial(func, *args))
+    finally:
+        _hash_pending -= 1
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verifica en el pool. Devuelve (válida, hash_nuevo): hash_nuevo viene solo si
+    PASSWORD_REHASH_ON_LOGIN está activo y el hash guardado usa otro costo/esquema.
+    """
+    if PASSWORD_REHASH_ON_LOGIN:
+        return await _run_hashing(pwd_context.verify_and_update, plain_password, hashed_password)
+    return await _run_hashing(pwd_context.verify, plain_password, hashed_password), None
+
+
+async def get_password_hash_async(password: str) -> str:
+    return await _run_hashing(pwd_context.hash, password)
+
+
+def shutdown_hashing():
+    """Lo llama el lifespan al apagar."""
+    _hash_executor.shutdown(wait=True)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     to_encode = data.copy()
     if expires_delta:
@@ -75,7 +130,7 @@ async def get_current_user_optional(
             logger.warning("Token JWT no contiene el campo 'sub' (email).")
             return None
         
-        user = await db.users.find_one({"email": email})
+        user = await principal_cache.get_user(db, email)
         if user:
             user["id"] = str(user["_id"])
         return user